@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Replay the jmx dumps of test/ through the collectors, and compare their cost with a stored baseline:
+    python benchmark.py                 # compare with test/benchmark.json, exit 1 on a regression
+    python benchmark.py --times         # also compare the times
+    python benchmark.py --save          # store the current results as the baseline
+    python benchmark.py --synthetic     # also replay large synthetic daemons, see synthetic.py
+For each collector it reports:
+    decode    seconds to decode the jmx response into beans, as get_metrics does.
+    collect   seconds of the first collect() of the beans, building every family.
+    cached    seconds of the next collect() of the same beans, whose families come from the family cache.
+    objects   python objects allocated by the first collect() and still alive with its families.
+    series    samples exported.
+Times are the best of --iterations runs and objects their median, after --warmup runs which are not measured.
+The baseline is stored by the first run, and kept out of git: its times are only meaningful on the machine which
+stored it, so they are only compared with --times. It is not compared with runs of other parameters.
+'''
+
+import gc
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+
+from cmd import utils
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from cmd.hdfs_datanode import DataNodeMetricCollector
+from cmd.hdfs_journalnode import JournalNodeMetricCollector
+from cmd.yarn_resourcemanager import ResourceManagerMetricCollector
+from cmd.mapreduce_jobhistoryserver import MapReduceMetricCollector
+from cmd.hbase_master import HBaseMasterMetricCollector
+from cmd.hbase_regionserver import HBaseRegionServerMetricCollector
+from cmd.yarn_nodemanager import NodeManagerMetricCollector
+from cmd.hive_server import HiveServerMetricCollector
+from synthetic import load_beans, generate
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# the dumps of test/, a directory holding one file per bean, and the daemons without dumps, generated from their definitions.
+FIXTURES = [
+    ('namenode', NameNodeMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/namenode'))),
+    ('datanode', DataNodeMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/datanode/datanode.json'))),
+    ('journalnode', JournalNodeMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/journalnode/journalnode.json'))),
+    ('resourcemanager', ResourceManagerMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/yarn'))),
+    ('jobhistoryserver', MapReduceMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/jobhistoryserver/jobhistoryserver.json'))),
+    ('master', HBaseMasterMetricCollector, lambda: load_beans(os.path.join(ROOT, 'test/hbase/hbase.json'))),
+    ('regionserver', HBaseRegionServerMetricCollector, lambda: generate('regionserver')),
+    ('nodemanager', NodeManagerMetricCollector, lambda: generate('nodemanager')),
+    ('hiveserver2', HiveServerMetricCollector, lambda: generate('hiveserver2')),
+]
+
+# daemons of a large cluster, scaled up from the dumps.
+SYNTHETIC_FIXTURES = [
+    ('namenode-300-rpc-methods', NameNodeMetricCollector, lambda: generate('namenode', rpc_methods=300)),
+    ('resourcemanager-5000-nodemanagers', ResourceManagerMetricCollector, lambda: generate('resourcemanager', nodemanagers=5000)),
+    ('regionserver-10000-regions', HBaseRegionServerMetricCollector, lambda: generate('regionserver', regions=10000, tables=100, users=100)),
+]
+
+COLUMNS = ['decode', 'collect', 'cached', 'objects', 'series']
+
+
+def run(name, cls, body, iterations, warmup):
+    '''
+    @return the {column: value} of the collector cls replaying body.
+    '''
+    url = 'http://{0}.benchmark:1/jmx'.format(name)
+    result = {'decode': None, 'collect': None, 'cached': None}
+    objects = []
+    for i in range(warmup + iterations):
+        collector = cls('benchmark', url)
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            beans = utils.beans_of_bodies([body], collector._accept)
+            decoded = time.time()
+            with utils.prefetched(url, beans):
+                before = len(gc.get_objects())
+                start_collect = time.time()
+                families = list(collector.collect())
+                collected = time.time()
+                allocated = len(gc.get_objects()) - before
+                start_cached = time.time()
+                list(collector.collect())
+                cached = time.time()
+        finally:
+            gc.enable()
+            collector.close()
+        if i < warmup:
+            continue
+        for column, seconds in (('decode', decoded - start), ('collect', collected - start_collect), ('cached', cached - start_cached)):
+            result[column] = seconds if result[column] is None else min(result[column], seconds)
+        objects.append(allocated)
+    result['objects'] = sorted(objects)[len(objects) // 2]
+    result['series'] = sum(len(family.samples) for family in families)
+    return result
+
+
+def compare(results, baseline, tolerance, columns=COLUMNS):
+    '''
+    @param columns: The columns to compare.
+    @return the regressions of results against baseline, a list of messages.
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for column in columns:
+            value, base = results[name][column], baseline[name].get(column)
+            if base is None:
+                continue
+            if column == 'series':
+                if value != base:
+                    regressions.append("{0}: {1} series, {2} in the baseline".format(name, value, base))
+            elif value > base * (1 + tolerance):
+                regressions.append("{0}: {1} {2:.6g}, {3:.6g} in the baseline (+{4:.0%})".format(name, column, value, base, value / float(base) - 1))
+    return regressions
+
+
+def report(results, baseline):
+    print("{0:<36}".format('collector') + "".join("{0:>22}".format(column) for column in COLUMNS))
+    for name in sorted(results):
+        line = "{0:<36}".format(name)
+        for column in COLUMNS:
+            value = results[name][column]
+            cell = "{0:.3f}ms".format(value * 1000) if column in ('decode', 'collect', 'cached') else str(value)
+            base = baseline.get(name, {}).get(column)
+            if base:
+                cell += " ({0:+.0%})".format(value / float(base) - 1)
+            line += "{0:>22}".format(cell)
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Replay the jmx dumps of test/ through the collectors and compare their cost with a baseline.'
+    )
+    parser.add_argument(
+        '--baseline',
+        metavar='path',
+        required=False,
+        help='Baseline json file. (default "test/benchmark.json")',
+        default=os.path.join(ROOT, 'test', 'benchmark.json')
+    )
+    parser.add_argument(
+        '--save',
+        required=False,
+        action='store_true',
+        help='Store the results as the baseline instead of comparing them. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '--times',
+        required=False,
+        action='store_true',
+        help='Also compare the decode, collect and cached times, not only the objects and series. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '--synthetic',
+        required=False,
+        action='store_true',
+        help='Also run the collectors of the large synthetic daemons. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '--iterations',
+        metavar='iterations',
+        required=False,
+        type=int,
+        help='Runs of each collector, the best time is kept. (default "20")',
+        default=20
+    )
+    parser.add_argument(
+        '--warmup',
+        metavar='iterations',
+        required=False,
+        type=int,
+        help='Runs of each collector before the measured ones, to fill the caches of the process. (default "3")',
+        default=3
+    )
+    parser.add_argument(
+        '--tolerance',
+        metavar='ratio',
+        required=False,
+        type=float,
+        help='Regression threshold of times and objects, relative to the baseline. (default "0.5")',
+        default=0.5
+    )
+    parser.add_argument(
+        'collectors',
+        metavar='collector',
+        nargs='*',
+        help='Collectors to run, e.g. namenode datanode. (default all)'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # the collectors log each scrape.
+    logging.disable(logging.INFO)
+    results = {}
+    for name, cls, beans in FIXTURES + (SYNTHETIC_FIXTURES if args.synthetic else []):
+        if args.collectors and name not in args.collectors:
+            continue
+        results[name] = run(name, cls, json.dumps({'beans': beans()}), args.iterations, args.warmup)
+
+    # times and objects depend on these, results of other parameters are not comparable.
+    parameters = {'iterations': args.iterations, 'warmup': args.warmup, 'python': platform.python_version()}
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    baseline = stored.get('results', {}) if not stored or stored.get('parameters') == parameters else None
+    if args.save or not stored:
+        if baseline is None:
+            print("the baseline parameters {0} differ, dropping its results".format(json.dumps(stored.get('parameters'), sort_keys=True)))
+            baseline = {}
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'parameters': parameters, 'results': baseline}, f, indent=2, sort_keys=True, separators=(',', ': '))
+        report(results, {})
+        print("baseline saved to {0}".format(args.baseline))
+        return 0
+    if baseline is None:
+        report(results, {})
+        print("not compared: the baseline parameters {0} differ from {1}, store a new one with --save".format(
+            json.dumps(stored.get('parameters'), sort_keys=True), json.dumps(parameters, sort_keys=True)))
+        return 2
+    report(results, baseline)
+    regressions = compare(results, baseline, args.tolerance, COLUMNS if args.times else ['objects', 'series'])
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
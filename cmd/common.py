@@ -4,6 +4,10 @@
 import yaml
 import re
 import time
+import zlib
+import threading
+from functools import partial
+from collections import OrderedDict
 from sys import exit
 from prometheus_client import start_http_server
 from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REGISTRY
@@ -11,6 +15,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
+from definitions import metric_definitions
 
 logger = get_module_logger(__name__)
 
@@ -31,15 +36,20 @@ class MetricCol(object):
         self._cluster = cluster
         self._url = url.rstrip('/')
         self._component = component
+        self._service = service
         self._prefix = 'hadoop_{0}_{1}'.format(component, service)
 
-        self._file_list = utils.get_file_list(service)
-        self._common_file = utils.get_file_list("common")
+        self._file_list = metric_definitions.files(service)
+        self._common_file = metric_definitions.files("common")
         self._merge_list = self._file_list + self._common_file
+        self._family_cache = FamilyCache()
 
-        self._metrics = {}
-        for i in range(len(self._file_list)):
-            self._metrics.setdefault(self._file_list[i], utils.read_json_file(service, self._file_list[i]))
+    @property
+    def _metrics(self):
+        '''
+        Metric definitions of this service, shared by all collectors and reloaded in place by metric_definitions.
+        '''
+        return metric_definitions.get(self._service)
 
     def collect(self):
         '''
@@ -57,26 +67,483 @@ class MetricCol(object):
         '''
         pass
 
+    def close(self):
+        '''
+        Called once the collector is no longer scraped, e.g. unregistered, to stop what it runs in the background.
+        '''
+        pass
+
+    def _queries(self):
+        '''
+        ObjectName patterns of the beans this collector reads, passed to utils.get_metrics so that only those
+        beans are fetched. Subclasses reading beans they cannot name up front keep the default None,
+        which fetches the whole /jmx.
+        '''
+        return None
+
+    def _accept(self, object_name):
+        '''
+        Whether this collector reads the bean named object_name, passed to utils.get_metrics so that
+        the other beans are dropped while the jmx response is parsed. Every bean is kept by default.
+        '''
+        return True
+
     def _setup_metrics_labels(self):
         pass
 
     def _get_metrics(self, metrics):
         pass
 
-def common_metrics_info(cluster, beans, component, service):
+    def _update_families(self, families, service, beans, setup, get, *context):
+        '''
+        Set up the families of service and add the value of every bean of service to them,
+        unless these beans are the same as in the previous scrape, then the families built at that time are reused.
+        @param families: The {service: {key: family}} dict of the collector, e.g. self._hadoop_namenode_metrics.
+        @param setup: Function creating the families of service in families[service].
+        @param get: Function adding the value of one bean to the families of service.
+        @param context: Anything else the families depend on, e.g. the host label of the beans.
+        '''
+        families[service] = self._family_cache.families(service, beans, partial(_build_families, families, service, beans, setup, get), *context)
+
+
+def _build_families(families, service, beans, setup, get):
+    families[service] = {}
+    setup()
+    for bean in beans:
+        get(bean)
+    return families[service]
+
+
+class FamilyCache(object):
+    '''
+    The metric families built from the beans of each service at the previous scrape, with those beans.
+    Some beans do not change between two scrapes, e.g. StartupProgress, DataNodeInfo, or any bean of an idle daemon,
+    their families are then yielded again instead of walking the definitions and building new ones.
+    Beans are compared with ==, which stops at the first changed attribute. Most services carry counters and change
+    on every scrape: once the beans of a service changed max_changes scrapes in a row, they are neither kept nor
+    compared for the next recheck scrapes, so a busy daemon pays nothing for the cache.
+    A family is never modified once built, so it can be yielded any number of times.
+    '''
+    def __init__(self, max_changes=3, recheck=20):
+        self._lock = threading.Lock()
+        self._max_changes = max_changes
+        self._recheck = recheck
+        self._entries = {}
+        self._changes = {}
+        self._skips = {}
+        self._hits = {}
+        self._misses = {}
+
+    def families(self, service, beans, build, *context):
+        '''
+        @param service: The definition file the beans are routed to, e.g. "FSNamesystem", "JvmMetrics".
+        @param beans: The beans of service in this scrape, which must not be modified afterwards.
+        @param build: Function building the families of service from beans, returning a dict of {key: family}.
+        @param context: Anything else the families depend on.
+        @return the families of service, reused from the previous scrape if beans and context are unchanged.
+        '''
+        skips = self._skips.get(service, 0)
+        if skips:
+            self._skips[service] = skips - 1
+            self._count(self._misses, service)
+            return build()
+        key = (metric_definitions.generation, context)
+        entry = self._entries.get(service)
+        if entry is not None and entry[0] == key and entry[1] == beans:
+            self._changes[service] = 0
+            self._count(self._hits, service)
+            return entry[2]
+        families = build()
+        self._count(self._misses, service)
+        changes = self._changes.get(service, 0) + (entry is not None)
+        if changes >= self._max_changes:
+            # a single change after the recheck scrapes makes the service volatile again.
+            self._changes[service] = self._max_changes - 1
+            self._skips[service] = self._recheck
+            self._entries.pop(service, None)
+        else:
+            self._changes[service] = changes
+            self._entries[service] = (key, beans, families)
+        return families
+
+    def _count(self, counts, service):
+        with self._lock:
+            counts[service] = counts.get(service, 0) + 1
+
+    def counts(self):
+        '''
+        @return a dict of {service: (hits, misses)} since the collector was created.
+        '''
+        with self._lock:
+            services = set(self._hits) | set(self._misses)
+            return dict((service, (self._hits.get(service, 0), self._misses.get(service, 0))) for service in services)
+
+
+class FamilyTemplate(object):
+    '''
+    The immutable part of a gauge family: name, help text and label names, validated once.
+    A family is set up on every scrape the beans of its module change, a template turns that into one dict lookup
+    instead of validating the name and label names of a new GaugeMetricFamily again.
+    '''
+    __slots__ = ('name', 'documentation', 'labelnames')
+
+    def __init__(self, name, documentation, labelnames):
+        # GaugeMetricFamily raises the same ValueError as before on an invalid name or label name.
+        GaugeMetricFamily(name, documentation, labels=labelnames)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+
+class TemplateSample(object):
+    '''
+    A sample of a TemplateFamily, holding its label values only. It reads like a prometheus_client Sample,
+    the labels dict being built when the sample is rendered, so a family kept by the FamilyCache holds no dicts.
+    '''
+    __slots__ = ('_template', '_values', 'value', 'timestamp')
+
+    def __init__(self, template, values, value, timestamp=None):
+        self._template = template
+        self._values = values
+        self.value = value
+        self.timestamp = timestamp
+
+    @property
+    def name(self):
+        return self._template.name
+
+    @property
+    def labels(self):
+        return dict(zip(self._template.labelnames, self._values))
+
+    @property
+    def exemplar(self):
+        return None
+
+    def __getitem__(self, index):
+        return (self.name, self.labels, self.value, self.timestamp, self.exemplar)[index]
+
+
+class TemplateFamily(GaugeMetricFamily):
+    '''
+    A GaugeMetricFamily set up from a FamilyTemplate, with TemplateSample samples.
+    '''
+    def __init__(self, template):
+        # name and labels were validated by the template, do not call GaugeMetricFamily.__init__.
+        self.name = template.name
+        self.documentation = template.documentation
+        self.unit = ''
+        self.type = 'gauge'
+        self.samples = []
+        self._labelnames = template.labelnames
+        self._template = template
+
+    def add_metric(self, labels, value, timestamp=None):
+        self.samples.append(TemplateSample(self._template, tuple(labels), value, timestamp))
+
+
+_family_templates = {}
+
+def gauge_family(name, documentation, labels=None):
+    '''
+    Drop-in replacement of GaugeMetricFamily(name, documentation, labels=labels) used to set up the metrics,
+    the template of each (name, documentation, labels) being built once per process.
+    '''
+    key = (name, documentation, tuple(labels or ()))
+    template = _family_templates.get(key)
+    if template is None:
+        template = _family_templates[key] = FamilyTemplate(*key)
+    return TemplateFamily(template)
+
+
+class CardinalityLimit(object):
+    '''
+    Bounds the number of series of a label with many values, e.g. the regions of a RegionServer, given by a spec:
+      "all"              every value is kept.
+      "topk:<k>[:<m>]"   the k values with the highest metric m (the sum of their metrics by default) are kept,
+                         the other ones are folded into "other".
+      "hash:<n>"         values are folded into n buckets, "bucket_<i>", by a hash of the value.
+      "other"            every value is folded into "other".
+    The series folded together are summed, or reduced with min/max for min, max, mean, percentile and age metrics.
+    '''
+    def __init__(self, spec='all'):
+        '''
+        @raise ValueError if spec is not valid.
+        '''
+        parts = spec.split(':')
+        self._mode = parts[0]
+        self._size = 0
+        self._rank = None
+        try:
+            if self._mode in ('topk', 'hash') and 2 <= len(parts) <= (3 if self._mode == 'topk' else 2):
+                self._size = int(parts[1])
+                self._rank = parts[2] if len(parts) == 3 else None
+            elif self._mode not in ('all', 'other') or len(parts) != 1:
+                raise ValueError()
+        except ValueError:
+            raise ValueError("invalid cardinality limit '{0}', expect all, other, topk:<k>[:<metric>] or hash:<n>".format(spec))
+        if self._mode in ('topk', 'hash') and self._size < 1:
+            raise ValueError("invalid cardinality limit '{0}', the size must be positive".format(spec))
+        self._spec = spec
+
+    def __repr__(self):
+        return self._spec
+
+    def apply(self, samples):
+        '''
+        @param samples: A list of (key, value of the label, value) of one bean, key being the metric, e.g. "region_metric_storeCount".
+        @return the list of (key, value of the label, value) to export, and the number of series dropped by folding.
+        '''
+        if self._mode == 'all':
+            return samples, 0
+        labels = self._labels(samples)
+        folded = OrderedDict()
+        for key, label, value in samples:
+            series = (key, labels.get(label, label))
+            folded[series] = _fold(key, folded[series], value) if series in folded else value
+        return [(key, label, value) for (key, label), value in folded.items()], len(samples) - len(folded)
+
+    def _labels(self, samples):
+        if self._mode == 'other':
+            return dict((label, 'other') for key, label, value in samples)
+        if self._mode == 'hash':
+            return dict((label, 'bucket_{0}'.format((zlib.crc32(label.encode('utf-8') if isinstance(label, unicode) else label) & 0xffffffff) % self._size))
+                        for key, label, value in samples)
+        ranks = {}
+        for key, label, value in samples:
+            if self._rank is None or key.endswith('_metric_' + self._rank):
+                ranks[label] = ranks.get(label, 0) + value
+            else:
+                ranks.setdefault(label, 0)
+        kept = set(sorted(ranks, key=lambda label: (-ranks[label], label))[:self._size])
+        return dict((label, 'other') for label in ranks if label not in kept)
+
+
+_min_metric = re.compile(r'(^|_)min|min[A-Z]')
+_max_metric = re.compile(r'(^|_)(max|mean|median)|max[A-Z]|percentile|Age$')
+
+def _fold(key, a, b):
+    metric = key.split('_metric_')[-1]
+    if _min_metric.search(metric):
+        return min(a, b)
+    if _max_metric.search(metric):
+        return max(a, b)
+    return a + b
+
+
+_object_name_cache = {}
+
+def parse_object_name(object_name):
+    '''
+    Split the ObjectName of a bean into the key beans are dispatched on, results are memoized.
+    e.g. "Hadoop:service=HBase,name=RegionServer,sub=Regions" -> ("HBase", "RegionServer", "Regions"),
+         "java.lang:type=Runtime" -> ("Runtime", None, None).
+    @return a tuple of (service, name, sub), missing properties are None.
+    '''
+    try:
+        return _object_name_cache[object_name]
+    except KeyError:
+        properties = {}
+        for prop in object_name.split(":", 1)[-1].split(","):
+            k, _, v = prop.partition("=")
+            properties[k.strip()] = v.strip()
+        key = (properties.get("service") or properties.get("type"), properties.get("name"), properties.get("sub"))
+        _object_name_cache[object_name] = key
+        return key
+
+
+class BeanDispatcher(object):
+    '''
+    Routes the beans of a scrape to their handlers in a single pass.
+    Each ObjectName is parsed once, and the handlers of a (service, name, sub) key are resolved the first time
+    the key is seen, so the cost of a scrape is linear in the number of beans whatever the number of handlers.
+    '''
+    def __init__(self, routes):
+        '''
+        @param routes: A list of (handler, match), handler being any hashable identifier of a handler,
+                       e.g. a definition file name, and match a function of (service, name, sub).
+        '''
+        self._routes = routes
+        self._index = {}
+
+    def handlers(self, key):
+        try:
+            return self._index[key]
+        except KeyError:
+            handlers = self._index[key] = tuple(handler for handler, match in self._routes if match(*key))
+            return handlers
+
+    def accepts(self, object_name):
+        '''
+        @return whether a bean named object_name is routed to any handler.
+        '''
+        return bool(self.handlers(parse_object_name(object_name)))
+
+    def group(self, beans):
+        '''
+        @return a dict of {handler: [beans routed to the handler]}, beans keeping their order.
+        '''
+        groups = {}
+        for bean in beans:
+            for handler in self.handlers(parse_object_name(bean.get('name', ''))):
+                groups.setdefault(handler, []).append(bean)
+        return groups
+
+
+def metric_value(bean, metric):
+    return bean[metric] if metric in bean else 0
+
+def metric_value_or_zero(bean, metric):
+    return bean[metric] if metric in bean and bean[metric] else 0
+
+
+# Translation tables of the common metrics, built once per definition file by metric_definitions.table():
+# jmx attribute -> (family key, label values after cluster and tag).
+def _jvm_table(metrics):
+    table = []
+    for metric in metrics:
+        name = "_".join(["jvm", utils.snake_case(metric)])
+        if 'Mem' in metric:
+            if "Used" in metric:
+                table.append((metric, "jvm_mem_used_mebibytes", [metric.split("Used")[0].split("Mem")[1]]))
+            elif "Committed" in metric:
+                table.append((metric, "jvm_mem_committed_mebibytes", [metric.split("Committed")[0].split("Mem")[1]]))
+            elif "Max" in metric:
+                mode = metric.split("Max")[0].split("Mem")[1] if "Heap" in metric else "max"
+                table.append((metric, "jvm_mem_max_mebibytes", [mode]))
+            else:
+                table.append((metric, "".join([name, 'ebibytes']), []))
+        elif 'Gc' in metric:
+            if "GcCount" in metric:
+                typo = "total" if "GcCount" == metric else metric.split("GcCount")[1]
+                table.append((metric, "jvm_gc_count", [typo]))
+            elif "GcTimeMillis" in metric:
+                typo = "total" if "GcTimeMillis" == metric else metric.split("GcTimeMillis")[1]
+                table.append((metric, "jvm_gc_time_milliseconds", [typo]))
+            elif "ThresholdExceeded" in metric:
+                table.append((metric, "jvm_gc_exceeded_threshold_total", [metric.split("ThresholdExceeded")[0].split("GcNum")[1]]))
+            else:
+                table.append((metric, name, []))
+        elif 'Threads' in metric:
+            table.append((metric, "jvm_threads_state_total", [metric.split("Threads")[1]]))
+        elif 'Log' in metric:
+            table.append((metric, "jvm_log_level_total", [metric.split("Log")[1]]))
+        else:
+            table.append((metric, name, []))
+    return table
+
+def _rpc_table(metrics):
+    table = []
+    for metric in metrics:
+        if "NumOps" in metric:
+            table.append((metric, "MethodNumOps", [metric.split('NumOps')[0]]))
+        elif "AvgTime" in metric:
+            table.append((metric, "MethodAvgTime", [metric.split('AvgTime')[0]]))
+        else:
+            table.append((metric, metric, []))
+    return table
+
+def _ugi_table(metrics):
+    table = []
+    for metric in metrics:
+        if 'NumOps' in metric:
+            if 'Login' in metric:
+                table.append((metric, 'NumOps', ['Login', metric.split('Login')[1].split('NumOps')[0]]))
+            else:
+                table.append((metric, 'NumOps', [metric.split('NumOps')[0]]))
+        elif 'AvgTime' in metric:
+            if 'Login' in metric:
+                table.append((metric, 'AvgTime', ['Login', metric.split('Login')[1].split('AvgTime')[0]]))
+            else:
+                table.append((metric, 'AvgTime', [metric.split('AvgTime')[0]]))
+        else:
+            table.append((metric, metric, []))
+    return table
+
+def _metric_system_table(metrics):
+    table = []
+    for metric in metrics:
+        if 'NumOps' in metric:
+            table.append((metric, 'NumOps', [metric.split('NumOps')[0]]))
+        elif 'AvgTime' in metric:
+            table.append((metric, 'AvgTime', [metric.split('AvgTime')[0]]))
+        else:
+            table.append((metric, metric, []))
+    return table
+
+_rpc_detailed_cache = {}
+
+def _rpc_detailed_translation(metric):
+    '''
+    RpcDetailedActivity attributes are the rpc method names, not the definition keys,
+    so they are translated to (family key, method) lazily and memoized.
+    @return None for attributes which are not exported, e.g. "name", "tag.port".
+    '''
+    try:
+        return _rpc_detailed_cache[metric]
+    except KeyError:
+        translation = None
+        if metric[0].isupper():
+            if "NumOps" in metric:
+                translation = ("NumOps", metric.split('NumOps')[0])
+            elif "AvgTime" in metric:
+                translation = ("AvgTime", metric.split("AvgTime")[0])
+        _rpc_detailed_cache[metric] = translation
+        return translation
+
+_common_dispatcher = BeanDispatcher([
+    ('JvmMetrics', lambda service, name, sub: name == 'JvmMetrics'),
+    ('OperatingSystem', lambda service, name, sub: service == 'OperatingSystem'),
+    ('RpcActivity', lambda service, name, sub: name is not None and name.startswith('RpcActivity')),
+    ('RpcDetailedActivity', lambda service, name, sub: name is not None and name.startswith('RpcDetailedActivity')),
+    ('UgiMetrics', lambda service, name, sub: name == 'UgiMetrics'),
+    ('MetricsSystem', lambda service, name, sub: name == 'MetricsSystem' and sub == 'Stats'),
+    ('Runtime', lambda service, name, sub: service == 'Runtime'),
+])
+
+# ObjectName patterns of the beans read by common_metrics_info, per common definition file.
+_COMMON_QUERIES = {
+    'JvmMetrics': ['Hadoop:service={0},name=JvmMetrics'],
+    'OperatingSystem': ['java.lang:type=OperatingSystem'],
+    'RpcActivity': ['Hadoop:service={0},name=RpcActivity*'],
+    'RpcDetailedActivity': ['Hadoop:service={0},name=RpcDetailedActivity*'],
+    'UgiMetrics': ['Hadoop:service={0},name=UgiMetrics'],
+    'MetricsSystem': ['Hadoop:service={0},name=MetricsSystem,sub=Stats'],
+    'Runtime': ['java.lang:type=Runtime'],
+}
+
+def common_queries(jmx_service):
+    '''
+    @param jmx_service: The service key of the Hadoop beans of the daemon, e.g. "NameNode", "HBase".
+    @return the ObjectName patterns of the beans of the loaded common definition files.
+    '''
+    queries = []
+    for file_name in metric_definitions.files("common"):
+        for query in _COMMON_QUERIES.get(file_name, []):
+            queries.append(query.format(jmx_service))
+    return queries
+
+def common_accepts(object_name):
+    '''
+    @return whether common_metrics_info reads the bean named object_name.
+    '''
+    return _common_dispatcher.accepts(object_name)
+
+def common_metrics_info(cluster, beans, component, service, cache=None):
     '''
     A closure function was setup to scrape the SAME metrics all services have.
+    @param cache: The FamilyCache of the collector, to reuse the families of the modules whose beans did not change.
     @return a closure variable named common_metrics, which contains all the metrics that scraped from the given beans.
     '''
-    tmp_metrics = {}
+    metric_definitions.maybe_reload()
+    tmp_metrics = metric_definitions.get("common")
     common_metrics = {}
     _cluster = cluster
     _prefix = 'hadoop_{0}_{1}'.format(component, service)
-    _metrics_type = utils.get_file_list("common")
+    _metrics_type = metric_definitions.files("common")
 
     for i in range(len(_metrics_type)):
         common_metrics.setdefault(_metrics_type[i], {})
-        tmp_metrics.setdefault(_metrics_type[i], utils.read_json_file("common", _metrics_type[i]))
 
 
     def setup_jvm_labels():
@@ -84,7 +551,7 @@ def common_metrics_info(cluster, beans, component, service):
             '''
             Processing module JvmMetrics
             '''
-            snake_case = "_".join(["jvm", re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()])
+            snake_case = "_".join(["jvm", utils.snake_case(metric)])
             if 'Mem' in metric:
                 name = "".join([snake_case, "ebibytes"])
                 label = ["cluster", "mode"]
@@ -128,18 +595,18 @@ def common_metrics_info(cluster, beans, component, service):
                 label = ["cluster"]
                 key = snake_case
                 descriptions = tmp_metrics['JvmMetrics'][metric]
-            common_metrics['JvmMetrics'][key] = GaugeMetricFamily("_".join([_prefix, key]),
-                                                                  descriptions,
-                                                                  labels=label)
+            common_metrics['JvmMetrics'][key] = gauge_family("_".join([_prefix, key]),
+                                                             descriptions,
+                                                             labels=label)
         return common_metrics
 
     def setup_os_labels():
         for metric in tmp_metrics['OperatingSystem']:
             label = ["cluster"]
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-            common_metrics['OperatingSystem'][metric] = GaugeMetricFamily("_".join([_prefix, snake_case]), 
-                                                                          tmp_metrics['OperatingSystem'][metric],
-                                                                          labels=label)
+            snake_case = utils.snake_case(metric)
+            common_metrics['OperatingSystem'][metric] = gauge_family("_".join([_prefix, snake_case]), 
+                                                                     tmp_metrics['OperatingSystem'][metric],
+                                                                     labels=label)
         return common_metrics
 
     def setup_rpc_labels():
@@ -150,17 +617,17 @@ def common_metrics_info(cluster, beans, component, service):
             `tag.port` should be an identifier to distinguish each module.
             '''
             if 'Rpc' in metric:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                snake_case = utils.snake_case(metric)
             else:
-                snake_case = "_".join(["rpc", re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()])
+                snake_case = "_".join(["rpc", utils.snake_case(metric)])
             label = ["cluster", "tag"]
             if "NumOps" in metric:
                 if num_rpc_flag:
                     key = "MethodNumOps"
                     label.append("method")
-                    common_metrics['RpcActivity'][key] = GaugeMetricFamily("_".join([_prefix, "rpc_method_called_total"]),
-                                                                           "Total number of the times the method is called.",
-                                                                           labels = label)
+                    common_metrics['RpcActivity'][key] = gauge_family("_".join([_prefix, "rpc_method_called_total"]),
+                                                                      "Total number of the times the method is called.",
+                                                                      labels = label)
                     num_rpc_flag = 0
                 else:
                     continue
@@ -168,17 +635,17 @@ def common_metrics_info(cluster, beans, component, service):
                 if avg_rpc_flag:
                     key = "MethodAvgTime"
                     label.append("method")
-                    common_metrics['RpcActivity'][key] = GaugeMetricFamily("_".join([_prefix, "rpc_method_avg_time_milliseconds"]),
-                                                                           "Average turn around time of the method in milliseconds.",
-                                                                           labels = label)
+                    common_metrics['RpcActivity'][key] = gauge_family("_".join([_prefix, "rpc_method_avg_time_milliseconds"]),
+                                                                      "Average turn around time of the method in milliseconds.",
+                                                                      labels = label)
                     avg_rpc_flag = 0
                 else:
                     continue
             else:
                 key = metric
-                common_metrics['RpcActivity'][key] = GaugeMetricFamily("_".join([_prefix, snake_case]),
-                                                                       tmp_metrics['RpcActivity'][metric],
-                                                                       labels = label)
+                common_metrics['RpcActivity'][key] = gauge_family("_".join([_prefix, snake_case]),
+                                                                  tmp_metrics['RpcActivity'][metric],
+                                                                  labels = label)
         return common_metrics    
     
     def setup_rpc_detailed_labels():
@@ -194,9 +661,9 @@ def common_metrics_info(cluster, beans, component, service):
                 name = "_".join([_prefix, 'rpc_detailed_method_avg_time_milliseconds'])
             else:
                 pass
-            common_metrics['RpcDetailedActivity'][key] = GaugeMetricFamily(name,
-                                                                           tmp_metrics['RpcDetailedActivity'][metric],
-                                                                           labels = label)
+            common_metrics['RpcDetailedActivity'][key] = gauge_family(name,
+                                                                      tmp_metrics['RpcDetailedActivity'][metric],
+                                                                      labels = label)
         return common_metrics
 
     def setup_ugi_labels():
@@ -208,9 +675,9 @@ def common_metrics_info(cluster, beans, component, service):
                     key = 'NumOps'
                     label.extend(["method","state"]) if 'Login' in metric else label.append("method")
                     ugi_num_flag = 0
-                    common_metrics['UgiMetrics'][key] = GaugeMetricFamily("_".join([_prefix, 'ugi_method_called_total']),
-                                                                          "Total number of the times the method is called.",
-                                                                          labels = label)
+                    common_metrics['UgiMetrics'][key] = gauge_family("_".join([_prefix, 'ugi_method_called_total']),
+                                                                     "Total number of the times the method is called.",
+                                                                     labels = label)
                 else:
                     continue
             elif 'AvgTime' in metric:
@@ -218,16 +685,16 @@ def common_metrics_info(cluster, beans, component, service):
                     key = 'AvgTime'
                     label.extend(["method", "state"]) if 'Login' in metric else label.append("method")
                     ugi_avg_flag = 0
-                    common_metrics['UgiMetrics'][key] = GaugeMetricFamily("_".join([_prefix, 'ugi_method_avg_time_milliseconds']),
-                                                                          "Average turn around time of the method in milliseconds.",
-                                                                          labels = label)
+                    common_metrics['UgiMetrics'][key] = gauge_family("_".join([_prefix, 'ugi_method_avg_time_milliseconds']),
+                                                                     "Average turn around time of the method in milliseconds.",
+                                                                     labels = label)
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-                common_metrics['UgiMetrics'][metric] = GaugeMetricFamily("_".join([_prefix, 'ugi', snake_case]),
-                                                                         tmp_metrics['UgiMetrics'][metric],
-                                                                         labels = label)
+                snake_case = utils.snake_case(metric)
+                common_metrics['UgiMetrics'][metric] = gauge_family("_".join([_prefix, 'ugi', snake_case]),
+                                                                    tmp_metrics['UgiMetrics'][metric],
+                                                                    labels = label)
         return common_metrics
 
     def setup_metric_system_labels():
@@ -239,9 +706,9 @@ def common_metrics_info(cluster, beans, component, service):
                     key = 'NumOps'
                     label.append("oper")
                     metric_num_flag = 0
-                    common_metrics['MetricsSystem'][key] = GaugeMetricFamily("_".join([_prefix, 'metricssystem_operations_total']),
-                                                                             "Total number of operations",
-                                                                             labels = label)
+                    common_metrics['MetricsSystem'][key] = gauge_family("_".join([_prefix, 'metricssystem_operations_total']),
+                                                                        "Total number of operations",
+                                                                        labels = label)
                 else:
                     continue
             elif 'AvgTime' in metric:
@@ -249,115 +716,30 @@ def common_metrics_info(cluster, beans, component, service):
                     key = 'AvgTime'
                     label.append("oper")
                     metric_avg_flag = 0
-                    common_metrics['MetricsSystem'][key] = GaugeMetricFamily("_".join([_prefix, 'metricssystem_method_avg_time_milliseconds']),
-                                                                             "Average turn around time of the operations in milliseconds.",
-                                                                             labels = label)
+                    common_metrics['MetricsSystem'][key] = gauge_family("_".join([_prefix, 'metricssystem_method_avg_time_milliseconds']),
+                                                                        "Average turn around time of the operations in milliseconds.",
+                                                                        labels = label)
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-                common_metrics['MetricsSystem'][metric] = GaugeMetricFamily("_".join([_prefix, 'metricssystem', snake_case]),
-                                                                            tmp_metrics['MetricsSystem'][metric],
-                                                                            labels = label)
+                snake_case = utils.snake_case(metric)
+                common_metrics['MetricsSystem'][metric] = gauge_family("_".join([_prefix, 'metricssystem', snake_case]),
+                                                                       tmp_metrics['MetricsSystem'][metric],
+                                                                       labels = label)
         return common_metrics
 
     def setup_runtime_labels():
         for metric in tmp_metrics['Runtime']:
             label = ["cluster", "host"]
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-            common_metrics['Runtime'][metric] = GaugeMetricFamily("_".join([_prefix, snake_case, "milliseconds"]), 
-                                                                  tmp_metrics['Runtime'][metric], 
-                                                                  labels = label)
-        return common_metrics
-
-    def setup_labels(beans):
-        '''
-        预处理，分析各个模块的特点，进行分类，添加label
-        '''
-        for i in range(len(beans)):
-            if 'name=JvmMetrics' in beans[i]['name']:
-                setup_jvm_labels()
-
-            if 'OperatingSystem' in beans[i]['name']:
-                setup_os_labels()
-
-            if 'RpcActivity' in beans[i]['name']:
-                setup_rpc_labels()
-
-            if 'RpcDetailedActivity' in beans[i]['name']:
-                setup_rpc_detailed_labels()
-
-            if 'UgiMetrics' in beans[i]['name']:
-                setup_ugi_labels()
-
-            if 'MetricsSystem' in beans[i]['name'] and "sub=Stats" in beans[i]['name']:
-                setup_metric_system_labels()   
-
-            if 'Runtime' in beans[i]['name']:
-                setup_runtime_labels()
-                
+            snake_case = utils.snake_case(metric)
+            common_metrics['Runtime'][metric] = gauge_family("_".join([_prefix, snake_case, "milliseconds"]), 
+                                                             tmp_metrics['Runtime'][metric], 
+                                                             labels = label)
         return common_metrics
 
-
-
     def get_jvm_metrics(bean):
-        for metric in tmp_metrics['JvmMetrics']:
-            name = "_".join(["jvm", re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()])
-            if 'Mem' in metric:
-                if "Used" in metric:
-                    key = "jvm_mem_used_mebibytes"
-                    mode = metric.split("Used")[0].split("Mem")[1]
-                    label = [_cluster, mode]
-                elif "Committed" in metric:
-                    key = "jvm_mem_committed_mebibytes"
-                    mode = metric.split("Committed")[0].split("Mem")[1]
-                    label = [_cluster, mode]
-                elif "Max" in metric:
-                    key = "jvm_mem_max_mebibytes"
-                    if "Heap" in metric:
-                        mode = metric.split("Max")[0].split("Mem")[1]
-                    else:
-                        mode = "max"
-                    label = [_cluster, mode]
-                else:
-                    key = "".join([name, 'ebibytes'])
-                    label = [_cluster]
-                
-            elif 'Gc' in metric:
-                if "GcCount" in metric:
-                    key = "jvm_gc_count"
-                    if "GcCount" == metric:
-                        typo = "total"
-                    else:
-                        typo = metric.split("GcCount")[1]
-                    label = [_cluster, typo]
-                elif "GcTimeMillis" in metric:
-                    key = "jvm_gc_time_milliseconds"
-                    if "GcTimeMillis" == metric:
-                        typo = "total"
-                    else:
-                        typo = metric.split("GcTimeMillis")[1]
-                    label = [_cluster, typo]
-                elif "ThresholdExceeded" in metric:
-                    key = "jvm_gc_exceeded_threshold_total"
-                    typo = metric.split("ThresholdExceeded")[0].split("GcNum")[1]
-                    label = [_cluster, typo]
-                else:
-                    key = name
-                    label = [_cluster]
-            elif 'Threads' in metric:
-                key = "jvm_threads_state_total"
-                state = metric.split("Threads")[1]
-                label = [_cluster, state]
-            elif 'Log' in metric:
-                key = "jvm_log_level_total"
-                level = metric.split("Log")[1]
-                label = [_cluster, level]
-            else:
-                key = name
-                label = [_cluster]
-            common_metrics['JvmMetrics'][key].add_metric(label,
-                                                         bean[metric] if metric in bean else 0)
+        for metric, key, label in metric_definitions.table("common", "JvmMetrics", _jvm_table):
+            common_metrics['JvmMetrics'][key].add_metric([_cluster] + label, metric_value(bean, metric))
         return common_metrics
 
     def get_os_metrics(bean):
@@ -369,83 +751,28 @@ def common_metrics_info(cluster, beans, component, service):
 
     def get_rpc_metrics(bean):
         rpc_tag = bean['tag.port']
-        for metric in tmp_metrics['RpcActivity']:
-            if "NumOps" in metric:
-                method = metric.split('NumOps')[0]
-                label = [_cluster, rpc_tag, method]
-                key = "MethodNumOps"
-            elif "AvgTime" in metric:
-                method = metric.split('AvgTime')[0]
-                label = [_cluster, rpc_tag, method]
-                key = "MethodAvgTime"
-            else:
-                label = [_cluster, rpc_tag]
-                key = metric
-            common_metrics['RpcActivity'][key].add_metric(label,
-                                                          bean[metric] if metric in bean else 0)
+        for metric, key, label in metric_definitions.table("common", "RpcActivity", _rpc_table):
+            common_metrics['RpcActivity'][key].add_metric([_cluster, rpc_tag] + label, metric_value(bean, metric))
         return common_metrics
 
     def get_rpc_detailed_metrics(bean):
         detail_tag = bean['tag.port']
         for metric in bean:
-            if metric[0].isupper():
-                label = [_cluster, detail_tag]
-                if "NumOps" in metric:
-                    key = "NumOps"
-                    method = metric.split('NumOps')[0]
-                    label = [_cluster, detail_tag, method]
-                elif "AvgTime" in metric:
-                    key = "AvgTime"
-                    method = metric.split("AvgTime")[0]
-                    label = [_cluster, detail_tag, method]                    
-                else:
-                    pass
-                common_metrics['RpcDetailedActivity'][key].add_metric(label,
+            translation = _rpc_detailed_translation(metric)
+            if translation:
+                key, method = translation
+                common_metrics['RpcDetailedActivity'][key].add_metric([_cluster, detail_tag, method],
                                                                       bean[metric])
         return common_metrics
 
     def get_ugi_metrics(bean):
-        for metric in tmp_metrics['UgiMetrics']:
-            if 'NumOps' in metric:
-                key = 'NumOps'
-                if 'Login' in metric:
-                    method = 'Login'
-                    state = metric.split('Login')[1].split('NumOps')[0]
-                    label = [_cluster, method, state]
-                else:
-                    method = metric.split('NumOps')[0]
-                    label = [_cluster, method]
-                # common_metrics['UgiMetrics'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
-            elif 'AvgTime' in metric:
-                key = 'AvgTime'
-                if 'Login' in metric:
-                    method = 'Login'
-                    state = metric.split('Login')[1].split('AvgTime')[0]
-                    label = [_cluster, method, state]
-                else:
-                    method = metric.split('AvgTime')[0]
-                    label = [_cluster, method]
-                # common_metrics['UgiMetrics'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
-            else:
-                key = metric
-                label = [_cluster]
-            common_metrics['UgiMetrics'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
+        for metric, key, label in metric_definitions.table("common", "UgiMetrics", _ugi_table):
+            common_metrics['UgiMetrics'][key].add_metric([_cluster] + label, metric_value_or_zero(bean, metric))
         return common_metrics
 
     def get_metric_system_metrics(bean):
-        for metric in tmp_metrics['MetricsSystem']:
-            if 'NumOps' in metric:
-                key = 'NumOps'
-                oper = metric.split('NumOps')[0]
-                label = [_cluster, oper]
-            elif 'AvgTime' in metric:
-                key = 'AvgTime'
-                oper = metric.split('AvgTime')[0]
-                label = [_cluster, oper]
-            else:
-                key = metric
-                label = [_cluster]
-            common_metrics['MetricsSystem'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
+        for metric, key, label in metric_definitions.table("common", "MetricsSystem", _metric_system_table):
+            common_metrics['MetricsSystem'][key].add_metric([_cluster] + label, metric_value_or_zero(bean, metric))
         return common_metrics
 
     def get_runtime_metrics(bean):
@@ -456,33 +783,24 @@ def common_metrics_info(cluster, beans, component, service):
 
     def get_metrics():
         '''
-        给setup_labels模块的输出结果进行赋值，从url中获取对应的数据，挨个赋值
+        Set up the labels of each module found in beans once, then add the value of every bean routed to it,
+        or reuse the families of the previous scrape from cache if the beans of the module did not change.
         '''
-        common_metrics = setup_labels(beans)
-        for i in range(len(beans)):
-            if 'name=JvmMetrics' in beans[i]['name']:
-                get_jvm_metrics(beans[i])
-
-            if 'OperatingSystem' in beans[i]['name']:
-                get_os_metrics(beans[i])
-
-            if 'RpcActivity' in beans[i]['name']:
-                get_rpc_metrics(beans[i])
-
-            if 'RpcDetailedActivity' in beans[i]['name']:
-                get_rpc_detailed_metrics(beans[i])
-
-            if 'UgiMetrics' in beans[i]['name']:
-                get_ugi_metrics(beans[i])
-
-            if 'MetricsSystem' in beans[i]['name'] and "sub=Stats" in beans[i]['name']:
-                get_metric_system_metrics(beans[i])
-
-            if 'Runtime' in beans[i]['name']:
-                get_runtime_metrics(beans[i])                
-
+        for handler, group in _common_dispatcher.group(beans).items():
+            setup, get = handlers[handler]
+            build = partial(_build_families, common_metrics, handler, group, setup, get)
+            common_metrics[handler] = build() if cache is None else cache.families(handler, group, build)
         return common_metrics
 
+    handlers = {
+        'JvmMetrics': (setup_jvm_labels, get_jvm_metrics),
+        'OperatingSystem': (setup_os_labels, get_os_metrics),
+        'RpcActivity': (setup_rpc_labels, get_rpc_metrics),
+        'RpcDetailedActivity': (setup_rpc_detailed_labels, get_rpc_detailed_metrics),
+        'UgiMetrics': (setup_ugi_labels, get_ugi_metrics),
+        'MetricsSystem': (setup_metric_system_labels, get_metric_system_metrics),
+        'Runtime': (setup_runtime_labels, get_runtime_metrics),
+    }
     return get_metrics
 
 def main():
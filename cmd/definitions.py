@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+import utils
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class MetricDefinitions(object):
+    '''
+    Process-wide registry of the metric definition json files, e.g. namenode/*.json, common/*.json.
+    Each directory is listed and parsed once and then shared by every MetricCol and common_metrics_info,
+    so a scrape does no disk I/O and no yaml parsing.
+    A loaded snapshot is never modified, reload() builds new dicts and swaps them in.
+    The set of files of a directory is fixed at its first load, only their content can be reloaded,
+    since every collector sets up its handlers per file.
+    '''
+    def __init__(self, check_interval=30):
+        '''
+        @param check_interval: Min seconds between two mtime checks done by maybe_reload().
+        '''
+        self._lock = threading.Lock()
+        self._check_interval = check_interval
+        self._last_check = time.time()
+        self._files = {}
+        self._metrics = {}
+        self._mtimes = {}
+        self._tables = {}
+        self._reload_requested = False
+        # bumped on every (re)load, so that anything derived from the definitions can tell it is stale.
+        self.generation = 0
+
+    def files(self, path_name):
+        '''
+        @param path_name: The definition directory, e.g. "namenode", "common".
+        @return a list of definition file names in path_name, without ".json".
+        '''
+        if path_name not in self._files:
+            self._load(path_name)
+        return self._files[path_name]
+
+    def get(self, path_name):
+        '''
+        @param path_name: The definition directory, e.g. "namenode", "common".
+        @return a dict of {file_name: {metric: descriptions}}, which must be treated as read-only.
+        '''
+        metrics = self._metrics.get(path_name)
+        if metrics is None:
+            self._load(path_name)
+            metrics = self._metrics[path_name]
+        return metrics
+
+    def table(self, path_name, file_name, build):
+        '''
+        Translation table of a definition file, e.g. jmx attribute -> (family key, label values),
+        computed by build once per loaded snapshot, so that a scrape only does lookups.
+        @param build: A module level function taking the {metric: descriptions} dict of the file.
+        '''
+        key = (path_name, file_name, build)
+        table = self._tables.get(key)
+        if table is None:
+            table = self._tables[key] = build(self.get(path_name).get(file_name) or {})
+        return table
+
+    def reload(self):
+        '''
+        Re-read every loaded definition file, e.g. on SIGHUP.
+        '''
+        for path_name in list(self._files):
+            self._load(path_name, reload=True)
+        logger.info("metric definitions reloaded: {0}".format(", ".join(sorted(self._files))))
+
+    def request_reload(self):
+        '''
+        Have the next maybe_reload() re-read every loaded definition file. Safe to call from a signal handler,
+        which must not take the lock of _load: the interrupted thread may be holding it.
+        '''
+        self._reload_requested = True
+
+    def maybe_reload(self):
+        '''
+        Reload the directories whose files changed on disk, at most once every check_interval seconds,
+        or all of them if request_reload() was called. It is cheap enough to be called on every scrape.
+        '''
+        if self._reload_requested:
+            self._reload_requested = False
+            self.reload()
+            return
+        now = time.time()
+        if now - self._last_check < self._check_interval:
+            return
+        self._last_check = now
+        for path_name in list(self._files):
+            if self._stat(path_name) != self._mtimes.get(path_name):
+                logger.info("metric definitions in '{0}' changed, reloading".format(path_name))
+                self._load(path_name, reload=True)
+
+    def _load(self, path_name, reload=False):
+        with self._lock:
+            if path_name in self._files and not reload:
+                return
+            files = self._files.get(path_name)
+            if files is None:
+                files = utils.get_file_list(path_name)
+            old = self._metrics.get(path_name, {})
+            metrics = {}
+            for i in range(len(files)):
+                content = utils.read_json_file(path_name, files[i])
+                if not content and files[i] in old:
+                    logger.warning("keep the previous definitions of {0}/{1}.json".format(path_name, files[i]))
+                    content = old[files[i]]
+                metrics[files[i]] = content
+            self._mtimes[path_name] = self._stat(path_name)
+            self._metrics[path_name] = metrics
+            self._files[path_name] = files
+            self._tables = dict((k, v) for k, v in self._tables.items() if k[0] != path_name)
+            self.generation += 1
+
+    @staticmethod
+    def _stat(path_name):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path_name)
+        mtimes = {}
+        try:
+            for name in os.listdir(path):
+                mtimes[name] = os.path.getmtime(os.path.join(path, name))
+        except OSError:
+            pass
+        return mtimes
+
+
+metric_definitions = MetricDefinitions()
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import bisect
+import hashlib
+import requests
+
+import utils
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class HashRing(object):
+    '''
+    Consistent hashing of the jmx urls over the exporter replicas of a central deployment.
+    Each shard owns many points of the ring, a url belongs to the shard of the first point after its hash,
+    so adding or removing a replica only moves about 1/shards of the targets.
+    '''
+    def __init__(self, shards=1, points=128):
+        '''
+        @param shards: Number of exporter replicas sharing the targets.
+        @param points: Number of points of each shard in the ring, more points spread the targets more evenly.
+        '''
+        self._shards = shards
+        ring = sorted((self._hash("{0}-{1}".format(shard, i)), shard) for shard in range(shards) for i in range(points))
+        self._points = [point for point, shard in ring]
+        self._owners = [shard for point, shard in ring]
+
+    @staticmethod
+    def _hash(key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def shard_of(self, key):
+        '''
+        @return the index of the shard owning key, e.g. a jmx url, in [0, shards).
+        '''
+        if self._shards == 1:
+            return 0
+        i = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+class ServiceDiscovery(object):
+    '''
+    ServiceDiscovery keeps the targets of a ScrapeEngine in sync with the services api.
+    Every poll computes the services running on this host (on every host of every cluster in central mode,
+    restricted to the urls of this shard), diffs them against the registered targets and
+    registers the added services, unregisters the removed ones, and swaps the collector of a service whose
+    jmx url changed, e.g. after a failover. The api is polled with If-None-Match, so an unchanged service
+    list costs a 304. While the api fails, the registered targets are kept and the poll interval doubles
+    up to max_interval.
+    '''
+    def __init__(self, url, engine, collectors, interval=10, max_interval=300, central=False, shards=1, shard=0):
+        '''
+        @param url: The services api, e.g. http://127.0.0.1:9035/alert/getservicesbyhost.
+        @param engine: The ScrapeEngine the collectors are registered in.
+        @param collectors: A list of (service, collector class), a service of the api being handled by the
+                           first class whose service is part of its name, e.g. "NAMENODE".
+        @param interval: Seconds between two polls.
+        @param max_interval: Max seconds between two polls while the api fails.
+        @param central: Scrape the services of every host in the api instead of the services of this host.
+        @param shards: Number of exporter replicas sharing the targets in central mode.
+        @param shard: Index of this replica, in [0, shards).
+        '''
+        self._url = url
+        self._engine = engine
+        self._collectors = collectors
+        self._interval = interval
+        self._max_interval = max_interval
+        self._delay = interval
+        self._host = utils.get_hostname()
+        self._central = central
+        self._ring = HashRing(shards)
+        self._shard = shard
+        self._etag = None
+        self._targets = {}
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self._delay)
+
+    def poll(self):
+        '''
+        Poll the services api once and apply the changes to the engine.
+        @return False if the api could not be read, True otherwise.
+        '''
+        try:
+            result, etag = self._fetch()
+        except Exception as e:
+            self._backoff()
+            logger.warning("Error happened while requests url {0}, retry in {1}s, error msg: {2}".format(self._url, self._delay, e))
+            return False
+        if result is not None:
+            try:
+                self._apply(self._desired_targets(result))
+            except Exception as e:
+                self._backoff()
+                logger.warning("Error happened while applying the services of {0}, retry in {1}s, error msg: {2}".format(self._url, self._delay, e))
+                return False
+            # only an applied response may be answered with a 304 by the next polls.
+            self._etag = etag
+        self._delay = self._interval
+        return True
+
+    def _backoff(self):
+        self._delay = min(self._delay * 2, self._max_interval)
+
+    def _fetch(self):
+        '''
+        @return the decoded services api response and its ETag, or (None, None) if it did not change since the
+                previous poll.
+        '''
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = utils.session_pool.get(self._url).get(self._url, headers=headers, timeout=30)
+        if response.status_code == requests.codes.not_modified:
+            return None, None
+        response.raise_for_status()
+        return response.json(), response.headers.get('ETag')
+
+    def _desired_targets(self, result):
+        '''
+        @return a dict of {(cluster, host, service): (jmx url, collector class)} of the services to scrape.
+        '''
+        targets = {}
+        for cluster, nodes in result.items():
+            for i in range(len(nodes)):
+                for host, info in nodes[i].items():
+                    if not self._central and host != self._host:
+                        continue
+                    for service, conf in info.items():
+                        cls = self._collector_of(service)
+                        if cls is None:
+                            continue
+                        if not isinstance(conf, dict) or not conf.get('jmx'):
+                            logger.warning("no jmx url of {0} on {1} in cluster {2}, skip it".format(service, host, cluster))
+                            continue
+                        # the url as the collector keeps it, which keys the engine, breakers, sessions and stats.
+                        url = conf['jmx'].rstrip('/')
+                        if self._ring.shard_of(url) != self._shard:
+                            continue
+                        targets.setdefault((cluster, host, service), (url, cls))
+        if not targets:
+            if self._central:
+                logger.error("No service assigned to shard {0}".format(self._shard))
+            else:
+                logger.error("No service running in THIS node")
+        return targets
+
+    def _collector_of(self, service):
+        for name, cls in self._collectors:
+            if name in service:
+                return cls
+        return None
+
+    def _apply(self, targets):
+        for key in set(self._targets) - set(targets):
+            url = self._targets.pop(key)
+            logger.info("{0} on {1} of cluster {2} is gone, unregister {3}".format(key[2], key[1], key[0], url))
+            self._drop(url)
+        for key, (url, cls) in targets.items():
+            old_url = self._targets.get(key)
+            if old_url == url:
+                continue
+            logger.info("{0} on {1} of cluster {2}: {3} -> {4}, start to register".format(key[2], key[1], key[0], old_url, url))
+            # register the new collector before dropping the old one, so the service is never missing.
+            self._engine.register(cls(key[0], url), key=url)
+            self._targets[key] = url
+            if old_url is not None:
+                self._drop(old_url)
+
+    def _drop(self, url):
+        # the same jmx url may still be the target of another service.
+        if url not in self._targets.values():
+            self._engine.unregister(url)
+            utils.discard_target(url)
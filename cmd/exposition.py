@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import zlib
+import threading
+from prometheus_client import make_wsgi_app
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+
+from utils import get_module_logger
+from scrape import merge_rendered
+
+logger = get_module_logger(__name__)
+
+
+class ExpositionCache(object):
+    '''
+    The /metrics response of the background mode. The families of the targets are kept as text and gzip bytes until
+    the ScrapeEngine takes a new snapshot, so the scrapers of a refresh interval get them without any serialization or
+    compression. On a new snapshot, only the targets refreshed since the previous response are rendered again, see
+    ScrapeEngine.rendered_targets, and their families are merged by name.
+    The other collectors of the registry, e.g. the exporter and process metrics, are rendered on every request, and
+    appended to the gzip bytes as a gzip member of their own.
+    The ETag is weak, since it only changes with the targets, and differs per encoding.
+    '''
+    def __init__(self, engine, registry=REGISTRY):
+        '''
+        @param engine: The ScrapeEngine registered in registry, with a refresh interval.
+        @param registry: The registry to render, the families of the engine targets being taken from the engine.
+        '''
+        self._engine = engine
+        self._registry = registry
+        self._lock = threading.Lock()
+        self._started = int(time.time())
+        self._generation = None
+        self._targets = None
+
+    def etag(self, gzip=False):
+        '''
+        @param gzip: Whether the ETag is the one of the gzip response.
+        @return the ETag of the current response, without rendering it.
+        '''
+        return self._etag(self._engine.generation(), gzip)
+
+    def _etag(self, generation, gzip):
+        return 'W/"{0:x}-{1:x}{2}"'.format(self._started, generation, '-gzip' if gzip else '')
+
+    def get(self, gzip=False):
+        '''
+        @param gzip: Whether to return the response compressed with gzip.
+        @return the (etag, body) of the current response.
+        '''
+        generation = self._engine.generation()
+        with self._lock:
+            if self._targets is None or self._generation != generation:
+                text = merge_rendered(self._engine.rendered_targets())
+                self._targets = (text, _gzip(text))
+                self._generation = generation
+            targets = self._targets
+        etag = self._etag(generation, gzip)
+        rest = self._engine.render_without_targets(self._registry)
+        if gzip:
+            return etag, targets[1] + _gzip(rest)
+        return etag, targets[0] + rest
+
+
+def _gzip(text):
+    '''
+    @return text compressed as a gzip member, several members making a valid gzip stream when concatenated.
+    '''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(text) + compressor.flush()
+
+
+def make_metrics_app(cache, registry=REGISTRY):
+    '''
+    WSGI app serving the metrics of registry from cache, with ETag and gzip support, a 304 being answered without
+    rendering anything.
+    Requests for the OpenMetrics format or for some metric names only are rendered by prometheus_client.
+    '''
+    fallback = make_wsgi_app(registry)
+
+    def metrics_app(environ, start_response):
+        if environ.get('QUERY_STRING') or 'application/openmetrics-text' in environ.get('HTTP_ACCEPT', ''):
+            return fallback(environ, start_response)
+        gzip = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        etag = cache.etag(gzip)
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', [('ETag', etag), ('Vary', 'Accept-Encoding')])
+            return ['']
+        etag, body = cache.get(gzip)
+        headers = [('Content-Type', CONTENT_TYPE_LATEST), ('ETag', etag), ('Vary', 'Accept-Encoding')]
+        if gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        start_response('200 OK', headers)
+        return [body]
+
+    return metrics_app
@@ -11,11 +11,19 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info, common_queries, common_accepts
 
 logger = get_module_logger(__name__)
 
 
+def _region_server_names(servers):
+    '''
+    @param servers: tag.liveRegionServers or tag.deadRegionServers, e.g. "host1,16020,1533287415019;host2,16020,1533287404358".
+    @return a list of the region server host names.
+    '''
+    return [server.split(',')[0] for server in servers.split(';')]
+
+
 class HBaseMasterMetricCollector(MetricCol):
     def __init__(self, cluster, url):
         MetricCol.__init__(self, cluster, url, "hbase", "master")
@@ -24,13 +32,19 @@ class HBaseMasterMetricCollector(MetricCol):
             self._hadoop_hbase_metrics.setdefault(self._file_list[i], {})
 
 
+    def _queries(self):
+        return ["Hadoop:service=HBase,name=Master,sub={0}".format(f) for f in self._file_list] + common_queries("HBase")
+
+    def _accept(self, object_name):
+        return any(f in object_name for f in self._file_list) or common_accepts(object_name)
+
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
@@ -42,7 +56,7 @@ class HBaseMasterMetricCollector(MetricCol):
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hbase", "master")
+            common_metrics = common_metrics_info(self._cluster, beans, "hbase", "master", self._family_cache)
             self._hadoop_hbase_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -53,7 +67,7 @@ class HBaseMasterMetricCollector(MetricCol):
     def _setup_server_labels(self):
         for metric in self._metrics['Server']:
             label = ["cluster", "host"]
-            name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            name = utils.snake_case(metric)
             if 'RegionServersState' in metric:
                 label.append('server')
             elif 'numRegionServers' in metric:
@@ -62,19 +76,19 @@ class HBaseMasterMetricCollector(MetricCol):
                 name = 'dead_region'
             else:
                 pass
-            self._hadoop_hbase_metrics['Server'][metric] = GaugeMetricFamily("_".join([self._prefix, 'server', name]),
-                                                                             self._metrics['Server'][metric],
-                                                                             labels=label)
+            self._hadoop_hbase_metrics['Server'][metric] = gauge_family("_".join([self._prefix, 'server', name]),
+                                                                        self._metrics['Server'][metric],
+                                                                        labels=label)
 
     def _setup_balancer_labels(self):
         balancer_flag = 1
         for metric in self._metrics['Balancer']:
             label = ["cluster", "host"]
             if '_min' in metric or '_max' in metric or '_mean' in metric or 'median' in metric:
-                name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-                self._hadoop_hbase_metrics['Balancer'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                   self._metrics['Balancer'][metric],
-                                                                                   labels=label)
+                name = utils.snake_case(metric)
+                self._hadoop_hbase_metrics['Balancer'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                              self._metrics['Balancer'][metric],
+                                                                              labels=label)
             elif 'BalancerCluster' in metric:
                 if balancer_flag:
                     balancer_flag = 0
@@ -86,21 +100,21 @@ class HBaseMasterMetricCollector(MetricCol):
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                snake_case = utils.snake_case(metric)
                 name = "_".join(['balancer', snake_case])
-                self._hadoop_hbase_metrics['Balancer'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                   self._metrics['Balancer'][metric],
-                                                                                   labels=label)
+                self._hadoop_hbase_metrics['Balancer'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                              self._metrics['Balancer'][metric],
+                                                                              labels=label)
 
     def _setup_assignmentmanger_labels(self):
         bulkassign_flag, assign_flag = 1, 1
         for metric in self._metrics['AssignmentManger']:
             label = ["cluster", "host"]            
             if '_min' in metric or '_max' in metric or '_mean' in metric or 'median' in metric:
-                name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-                self._hadoop_hbase_metrics['AssignmentManger'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                           self._metrics['AssignmentManger'][metric],
-                                                                                           labels=label)
+                name = utils.snake_case(metric)
+                self._hadoop_hbase_metrics['AssignmentManger'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                      self._metrics['AssignmentManger'][metric],
+                                                                                      labels=label)
             elif 'BulkAssign' in metric:
                 if bulkassign_flag:
                     bulkassign_flag = 0
@@ -122,27 +136,27 @@ class HBaseMasterMetricCollector(MetricCol):
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                snake_case = utils.snake_case(metric)
                 name = "_".join(['assignmentmanger', snake_case])
-                self._hadoop_hbase_metrics['AssignmentManger'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                           self._metrics['AssignmentManger'][metric],
-                                                                                           labels=label)
+                self._hadoop_hbase_metrics['AssignmentManger'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                      self._metrics['AssignmentManger'][metric],
+                                                                                      labels=label)
 
     def _setup_ipc_labels(self):
         total_calltime_flag, response_size_flag, process_calltime_flag, queue_calltime_flag, request_size_flag, exception_flag = 1, 1, 1, 1, 1, 1
         for metric in self._metrics['IPC']:
             label = ["cluster", "host"]
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            snake_case = utils.snake_case(metric)
             if '_min' in metric or '_max' in metric or '_mean' in metric or 'median' in metric:
                 name = "_".join(['ipc', snake_case])
-                self._hadoop_hbase_metrics['IPC'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                              self._metrics['IPC'][metric],
-                                                                              labels=label)
+                self._hadoop_hbase_metrics['IPC'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                         self._metrics['IPC'][metric],
+                                                                         labels=label)
             elif 'RangeCount_' in metric:
                 name = metric.replace("-", "_").lower()
-                self._hadoop_hbase_metrics['IPC'][metric] = GaugeMetricFamily("_".join([self._prefix, 'ipc', name]),
-                                                                              self._metrics['IPC'][metric],
-                                                                              labels=label)
+                self._hadoop_hbase_metrics['IPC'][metric] = gauge_family("_".join([self._prefix, 'ipc', name]),
+                                                                         self._metrics['IPC'][metric],
+                                                                         labels=label)
             elif 'TotalCallTime' in metric:
                 if total_calltime_flag:
                     total_calltime_flag = 0
@@ -199,27 +213,27 @@ class HBaseMasterMetricCollector(MetricCol):
                     name = 'ipc_exceptions_total'
                     key = 'exceptions'
                     label.append("type")
-                    self._hadoop_hbase_metrics['IPC'][key] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                               "Exceptions caused by requests",
-                                                                               labels = label)
+                    self._hadoop_hbase_metrics['IPC'][key] = gauge_family("_".join([self._prefix, name]),
+                                                                          "Exceptions caused by requests",
+                                                                          labels = label)
                 else:
                     continue
             else:
                 name = "_".join(['ipc', snake_case])
-                self._hadoop_hbase_metrics['IPC'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                              self._metrics['IPC'][metric],
-                                                                              labels=label)
+                self._hadoop_hbase_metrics['IPC'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                         self._metrics['IPC'][metric],
+                                                                         labels=label)
 
     def _setup_filesystem_labels(self):
         hlog_split_time_flag, metahlog_split_time_flag, hlog_split_size_flag, metahlog_split_size_flag = 1, 1, 1, 1
         for metric in self._metrics['FileSystem']:
             label = ["cluster", "host"]
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            snake_case = utils.snake_case(metric)
             if '_min' in metric or '_max' in metric or '_mean' in metric or 'median' in metric:
                 name = snake_case
-                self._hadoop_hbase_metrics['FileSystem'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                     self._metrics['FileSystem'][metric],
-                                                                                     labels=label)
+                self._hadoop_hbase_metrics['FileSystem'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                self._metrics['FileSystem'][metric],
+                                                                                labels=label)
             elif 'MetaHlogSplitTime' in metric:
                 if metahlog_split_time_flag:
                     metahlog_split_time_flag = 0
@@ -264,9 +278,9 @@ class HBaseMasterMetricCollector(MetricCol):
                     continue                
             else:
                 name = snake_case
-                self._hadoop_hbase_metrics['FileSystem'][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                     self._metrics['FileSystem'][metric],
-                                                                                     labels=label)
+                self._hadoop_hbase_metrics['FileSystem'][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                self._metrics['FileSystem'][metric],
+                                                                                labels=label)
 
     def _setup_metrics_labels(self, beans):
         # The metrics we want to export.
@@ -292,17 +306,17 @@ class HBaseMasterMetricCollector(MetricCol):
         for metric in self._metrics['Server']:
             if 'RegionServersState' in metric:
                 if 'tag.liveRegionServers' in bean and bean['tag.liveRegionServers']:
-                    live_region_servers = yaml.safe_load(bean['tag.liveRegionServers'])
-                    live_region_list = live_region_servers.split(';')
+                    live_region_list = utils.decoded_attributes.get(self._url, 'tag.liveRegionServers', bean['tag.liveRegionServers'],
+                                                                    _region_server_names)
                     for j in range(len(live_region_list)):
-                        server = live_region_list[j].split(',')[0]
+                        server = live_region_list[j]
                         label = [self._cluster, host, server]
                         self._hadoop_hbase_metrics['Server'][metric].add_metric(label, 1.0)
                 elif 'tag.deadRegionServers' in bean and bean['tag.deadRegionServers']:
-                    dead_region_servers = yaml.safe_load(bean['tag.deadRegionServers'])
-                    dead_region_list = dead_region_servers.split(';')
+                    dead_region_list = utils.decoded_attributes.get(self._url, 'tag.deadRegionServers', bean['tag.deadRegionServers'],
+                                                                    _region_server_names)
                     for j in range(len(dead_region_list)):
-                        server = dead_region_list[j].split(',')[0]
+                        server = dead_region_list[j]
                         label = [self._cluster, host, server]
                         self._hadoop_hbase_metrics['Server'][metric].add_metric(label + [server], 0.0)
                 else:
@@ -4,6 +4,7 @@
 import yaml
 import re
 import time
+from functools import partial
 from sys import exit
 from prometheus_client import start_http_server
 from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REGISTRY
@@ -11,10 +12,25 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, CardinalityLimit, gauge_family, BeanDispatcher, common_metrics_info, common_queries, common_accepts
 
 logger = get_module_logger(__name__)
 
+# limits of the regions, tables and users exported by every RegionServer, see CardinalityLimit.
+series_limits = {
+    'region': CardinalityLimit('topk:100:totalRequestCount'),
+    'table': CardinalityLimit('topk:100'),
+    'user': CardinalityLimit('topk:100'),
+}
+
+# jmx attributes of a region, table or user, the region being its encoded name.
+_entity_patterns = [
+    ('region', 'region', re.compile(r'^Namespace_.+?_table_.+_region_(?P<entity>[^_]+)_metric_(?P<metric>.+)$')),
+    ('table', 'table', re.compile(r'^Namespace_.+?_table_(?P<entity>.+?)_metric_(?P<metric>.+)$')),
+    ('user', 'User', re.compile(r'^User_(?P<entity>.+?)_metric_(?P<metric>.+)$')),
+]
+_max_entity_keys = 100000
+
 
 class HBaseRegionServerMetricCollector(MetricCol):
     def __init__(self, cluster, url):
@@ -22,26 +38,36 @@ class HBaseRegionServerMetricCollector(MetricCol):
         self._hadoop_regionserver_metrics = {}
         for i in range(len(self._file_list)):
             self._hadoop_regionserver_metrics.setdefault(self._file_list[i], {})
+        # each definition file handles the beans of the same "sub", e.g. Regions.json <- "sub=Regions".
+        self._dispatcher = BeanDispatcher([(service, self._sub_matcher(service)) for service in self._file_list])
+        self._entity_keys = {}
+        # number of region, table and user series dropped by series_limits, per service and label.
+        self._folded_series = {}
+
 
+    def _queries(self):
+        return ["Hadoop:service=HBase,name=RegionServer,sub={0}".format(f) for f in self._file_list] + common_queries("HBase")
+
+    def _accept(self, object_name):
+        return self._dispatcher.accepts(object_name) or common_accepts(object_name)
 
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
         else:
-            # set up all metrics with labels and descriptions.
-            self._setup_labels(beans)
-    
-            # add metric value to every metric.
-            self._get_metrics(beans)
+            groups = self._dispatcher.group(beans)
+
+            # set up all metrics with labels and descriptions, and add metric value to every metric.
+            self._get_metrics(beans, groups)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hbase", "regionserver")
+            common_metrics = common_metrics_info(self._cluster, beans, "hbase", "regionserver", self._family_cache)
             self._hadoop_regionserver_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -49,65 +75,67 @@ class HBaseRegionServerMetricCollector(MetricCol):
                 for metric in self._hadoop_regionserver_metrics[service]:
                     yield self._hadoop_regionserver_metrics[service][metric]
 
-    def _setup_labels(self, beans):
-        for i in range(len(beans)):
-            for service in self._metrics:
-                if service in beans[i]['name']:
-                    for metric in self._metrics[service]:
-                        name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()
-                        if 'region_metric' in metric:
-                            label = ['cluster', 'host', 'region']
-                        elif 'table_metric' in metric:
-                            label = ['cluster', 'host', 'table']
-                        elif 'User_metric' in metric:
-                            label = ['cluster', 'host', 'user']
-                        else:
-                            label = ['cluster', 'host']
-                        self._hadoop_regionserver_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, service.lower(), name]),
-                                                                                                self._metrics[service][metric],
-                                                                                                labels=label)
-
-    def _get_regions_metrics(self, bean, service, host):
-        for metric in bean:
-            if metric in self._metrics[service]:
-                if "_region_" in metric and 'metric' in metric:
-                    region = metric.split("_metric_")[0].split("region_")[1]
-                    key = "".join(["region", metric.split(region)[-1]])
-                    self._hadoop_regionserver_metrics[service][key].add_metric([self._cluster, host, region], bean[metric])
-                elif metric in self._metrics[service]:
-                    self._hadoop_regionserver_metrics[service][metric].add_metric([self._cluster, host], bean[metric])
-                else:
-                    continue
-            else:
-                continue
-
-    def _get_tables_metrics(self, bean, service, host):
-        for metric in bean:
-            if metric in self._metrics[service]:
-                if "_table_" in metric and 'metric' in metric:
-                    table = metric.split("_metric_")[0].split("table_")[1]
-                    key = "".join(["table", metric.split(table)[-1]])
-                    self._hadoop_regionserver_metrics[service][key].add_metric([self._cluster, host, table], bean[metric])
-                elif metric in self._metrics[service]:
-                    self._hadoop_regionserver_metrics[service][metric].add_metric([self._cluster, host], bean[metric])
-                else:
-                    continue
+            host = next((bean['tag.Hostname'] for bean in beans if 'tag.Hostname' in bean), None)
+            if host is not None:
+                yield self._folded_series_family(host)
+
+    def _folded_series_family(self, host):
+        folded = gauge_family("_".join([self._prefix, "folded_series"]),
+                              "Number of region, table or user series dropped by folding them into other label values, see --region-series.",
+                              labels=['cluster', 'host', 'label'])
+        for dimension in ('region', 'table', 'user'):
+            count = sum(self._folded_series[service].get(dimension, 0) for service in self._folded_series)
+            folded.add_metric([self._cluster, host, dimension], count)
+        return folded
+
+    @staticmethod
+    def _sub_matcher(service):
+        return lambda bean_service, name, sub: sub == service
+
+    def _setup_labels(self, service):
+        self._folded_series[service] = {}
+        for metric in self._metrics[service]:
+            name = utils.underscore_case(metric)
+            if 'region_metric' in metric:
+                label = ['cluster', 'host', 'region']
+            elif 'table_metric' in metric:
+                label = ['cluster', 'host', 'table']
+            elif 'User_metric' in metric:
+                label = ['cluster', 'host', 'user']
             else:
-                continue
-
-    def _get_users_metrics(self, bean, service, host):
+                label = ['cluster', 'host']
+            self._hadoop_regionserver_metrics[service][metric] = gauge_family("_".join([self._prefix, service.lower(), name]),
+                                                                                    self._metrics[service][metric],
+                                                                                    labels=label)
+
+    def _entity_key(self, metric):
+        # "Namespace_default_table_t1_region_5f3c_metric_storeCount" -> ("region", "region_metric_storeCount", "5f3c")
+        if metric not in self._entity_keys:
+            if len(self._entity_keys) > _max_entity_keys:
+                self._entity_keys.clear()
+            entity_key = None
+            for dimension, prefix, pattern in _entity_patterns:
+                match = pattern.match(metric)
+                if match:
+                    entity_key = (dimension, "_".join([prefix, "metric", match.group('metric')]), match.group('entity'))
+                    break
+            self._entity_keys[metric] = entity_key
+        return self._entity_keys[metric]
+
+    def _get_entity_metrics(self, bean, service, host):
+        samples = {}
         for metric in bean:
-            if metric in self._metrics[service]:
-                if "User_" in metric and '_metric_' in metric:
-                    user = metric.split("_metric_")[0].split("User_")[1]
-                    key = "".join(["User", metric.split(user)[-1]])
-                    self._hadoop_regionserver_metrics[service][key].add_metric([self._cluster, host, user], bean[metric])
-                elif metric in self._metrics[service]:
+            entity_key = self._entity_key(metric)
+            if entity_key is None:
+                if metric in self._metrics[service]:
                     self._hadoop_regionserver_metrics[service][metric].add_metric([self._cluster, host], bean[metric])
-                else:
-                    continue
-            else:
-                continue
+            elif entity_key[1] in self._metrics[service]:
+                samples.setdefault(entity_key[0], []).append((entity_key[1], entity_key[2], bean[metric]))
+        for dimension in samples:
+            kept, folded = series_limits[dimension].apply(samples[dimension])
+            for key, entity, value in kept:
+                self._hadoop_regionserver_metrics[service][key].add_metric([self._cluster, host, entity], value)
+            self._folded_series[service][dimension] = self._folded_series[service].get(dimension, 0) + folded
 
     def _get_other_metrics(self, bean, service, host):
         for metric in bean:
@@ -116,7 +144,7 @@ class HBaseRegionServerMetricCollector(MetricCol):
             else:
                 continue
 
-    def _get_metrics(self, beans):
+    def _get_metrics(self, beans, groups):
         
         for i in range(len(beans)):
             if 'tag.Hostname' in beans[i]:
@@ -125,18 +153,15 @@ class HBaseRegionServerMetricCollector(MetricCol):
             else:
                 continue
 
-        for i in range(len(beans)):
-            for service in self._metrics:
-                if 'Regions' == service and 'sub={0}'.format(service) in beans[i]['name']:
-                    self._get_regions_metrics(beans[i], service, host)
-                elif 'Tables' == service and 'sub={0}'.format(service) in beans[i]['name']:
-                    self._get_tables_metrics(beans[i], service, host)
-                elif 'Users' == service and 'sub={0}'.format(service) in beans[i]['name']:
-                    self._get_users_metrics(beans[i], service, host)
-                elif 'sub={0}'.format(service) in beans[i]['name']:
-                    self._get_other_metrics(beans[i], service, host)
-                else:
-                    continue
+        for service, group in groups.items():
+            if service not in self._metrics:
+                continue
+            if service in ('Regions', 'Tables', 'Users'):
+                get = self._get_entity_metrics
+            else:
+                get = self._get_other_metrics
+            self._update_families(self._hadoop_regionserver_metrics, service, group,
+                                  partial(self._setup_labels, service), partial(get, service=service, host=host), host)
 
 
 def main():
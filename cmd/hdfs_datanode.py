@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info, common_queries, common_accepts
 
 logger = get_module_logger(__name__)
 
@@ -23,25 +23,28 @@ class DataNodeMetricCollector(MetricCol):
             self._hadoop_datanode_metrics.setdefault(self._file_list[i], {})
 
 
+    def _queries(self):
+        return ["Hadoop:service=DataNode,name={0}*".format(f) for f in self._file_list] + common_queries("DataNode")
+
+    def _accept(self, object_name):
+        return any(f in object_name for f in self._file_list) or common_accepts(object_name)
+
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
         else:
-            # set up all metrics with labels and descriptions.
-            self._setup_metrics_labels(beans)
-    
-            # add metric value to every metric.
+            # set up all metrics with labels and descriptions, and add metric value to every metric.
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "datanode")
+            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "datanode", self._family_cache)
             self._hadoop_datanode_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -59,11 +62,11 @@ class DataNodeMetricCollector(MetricCol):
                 name = "_".join([self._prefix, 'volume_state'])
             else:
                 label = ["cluster", "version"]
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                snake_case = utils.snake_case(metric)
                 name = "_".join([self._prefix, snake_case])
-            self._hadoop_datanode_metrics['DataNodeInfo'][metric] = GaugeMetricFamily(name,
-                                                                                      self._metrics['DataNodeInfo'][metric],
-                                                                                      labels=label)
+            self._hadoop_datanode_metrics['DataNodeInfo'][metric] = gauge_family(name,
+                                                                                 self._metrics['DataNodeInfo'][metric],
+                                                                                 labels=label)
             
     def _setup_dnactivity_labels(self):
         block_flag, client_flag = 1, 1
@@ -87,14 +90,14 @@ class DataNodeMetricCollector(MetricCol):
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                snake_case = utils.snake_case(metric)
                 label = ['cluster', 'host']
                 key = metric
                 name = snake_case                    
                 descriptions = self._metrics['DataNodeActivity'][metric]
-            self._hadoop_datanode_metrics['DataNodeActivity'][key] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                       descriptions,
-                                                                                       labels=label)
+            self._hadoop_datanode_metrics['DataNodeActivity'][key] = gauge_family("_".join([self._prefix, name]),
+                                                                                  descriptions,
+                                                                                  labels=label)
 
     def _setup_dnvolume_labels(self):
         iorate_num_flag, iorate_avg_flag = 1, 1
@@ -122,44 +125,35 @@ class DataNodeMetricCollector(MetricCol):
                 key = metric
                 descriptions = self._metrics['DataNodeVolume'][metric]
                 if 'NumOps' in metric:
-                    name = "_".join([re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric.split("NumOps")[0]).lower(), "total"])
+                    name = "_".join([utils.snake_case(metric.split("NumOps")[0]), "total"])
                 elif 'AvgTime' in metric:
-                    name = "_".join([re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric.split("AvgTime")[0]).lower(), "time_milliseconds"])
+                    name = "_".join([utils.snake_case(metric.split("AvgTime")[0]), "time_milliseconds"])
                 else:
-                    name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-            self._hadoop_datanode_metrics['DataNodeVolume'][key] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                     descriptions,
-                                                                                     labels = label)
+                    name = utils.snake_case(metric)
+            self._hadoop_datanode_metrics['DataNodeVolume'][key] = gauge_family("_".join([self._prefix, name]),
+                                                                                descriptions,
+                                                                                labels = label)
     
     def _setup_fsdatasetstate_labels(self):
         for metric in self._metrics['FSDatasetState']:
             label = ['cluster', 'host']
             if "Num" in metric:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric.split("Num")[1]).lower()
+                snake_case = utils.snake_case(metric.split("Num")[1])
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-            self._hadoop_datanode_metrics['FSDatasetState'][metric] = GaugeMetricFamily("_".join([self._prefix, snake_case]),
-                                                                                        self._metrics['FSDatasetState'][metric],
-                                                                                        labels = label)
-
-    def _setup_metrics_labels(self, beans):
-        # The metrics we want to export.
-        for i in range(len(beans)):
-            if 'DataNodeInfo' in beans[i]['name']:
-                self._setup_dninfo_labels()
-            if 'DataNodeActivity' in self._metrics:
-                self._setup_dnactivity_labels()
-            if 'DataNodeVolume' in self._metrics:
-                self._setup_dnvolume_labels()
-            if 'FSDatasetState' in self._metrics:
-                self._setup_fsdatasetstate_labels()
+                snake_case = utils.snake_case(metric)
+            self._hadoop_datanode_metrics['FSDatasetState'][metric] = gauge_family("_".join([self._prefix, snake_case]),
+                                                                                   self._metrics['FSDatasetState'][metric],
+                                                                                   labels = label)
 
     def _get_dninfo_metrics(self, bean):
+        if 'BPServiceActorInfo' in bean:
+            actor_info_list = utils.decoded_attributes.get(self._url, 'BPServiceActorInfo', bean['BPServiceActorInfo'])
+        if 'VolumeInfo' in bean:
+            volume_info_dict = utils.decoded_attributes.get(self._url, 'VolumeInfo', bean['VolumeInfo'])
         for metric in self._metrics['DataNodeInfo']:
             version = bean['Version']
             if 'ActorState' in metric:
                 if 'BPServiceActorInfo' in bean:
-                    actor_info_list = yaml.safe_load(bean['BPServiceActorInfo'])
                     for j in range(len(actor_info_list)):
                         host = actor_info_list[j]['NamenodeAddress'].split(':')[0]
                         label = [self._cluster, version, host]
@@ -171,7 +165,6 @@ class DataNodeMetricCollector(MetricCol):
                     continue
             elif 'VolumeInfo' in metric:
                 if 'VolumeInfo' in bean:
-                    volume_info_dict = yaml.safe_load(bean['VolumeInfo'])
                     for k, v in volume_info_dict.items():
                         path = k
                         for key, val in v.items():
@@ -227,16 +220,21 @@ class DataNodeMetricCollector(MetricCol):
             self._hadoop_datanode_metrics['FSDatasetState'][metric].add_metric(label, bean[metric] if metric in bean else 0)
 
     def _get_metrics(self, beans):
-        for i in range(len(beans)):
-            if 'DataNodeInfo' in beans[i]['name']:
-                self._get_dninfo_metrics(beans[i])
-            if 'DataNodeActivity' in beans[i]['name']:
-                self._get_dnactivity_metrics(beans[i])
-            if 'DataNodeVolume' in beans[i]['name']:
-                self._get_dnvolume_metrics(beans[i])
-            if 'FSDatasetState' in beans[i]['name'] and 'FSDatasetState' in beans[i]['modelerType']:
-                self._get_fsdatasetstate_metrics(beans[i])
-                    
+        # The metrics we want to export, set up and filled per module, or reused if its beans did not change.
+        handlers = [
+            ('DataNodeInfo', self._setup_dninfo_labels, self._get_dninfo_metrics),
+            ('DataNodeActivity', self._setup_dnactivity_labels, self._get_dnactivity_metrics),
+            ('DataNodeVolume', self._setup_dnvolume_labels, self._get_dnvolume_metrics),
+            ('FSDatasetState', self._setup_fsdatasetstate_labels, self._get_fsdatasetstate_metrics),
+        ]
+        for service, setup, get in handlers:
+            group = [bean for bean in beans if service in bean['name']]
+            if 'FSDatasetState' == service:
+                # skip the FsDatasetImpl bean named FSDatasetState-<uuid>.
+                group = [bean for bean in group if service in bean['modelerType']]
+            if group and service in self._metrics:
+                self._update_families(self._hadoop_datanode_metrics, service, group, setup, get)
+
 def main():
     try:
         args = utils.parse_args()
@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info, common_queries, common_accepts
 
 logger = get_module_logger(__name__)
 
@@ -23,13 +23,19 @@ class JournalNodeMetricCollector(MetricCol):
             self._hadoop_journalnode_metrics.setdefault(self._file_list[i], {})
 
 
+    def _queries(self):
+        return ["Hadoop:service=JournalNode,name={0}*".format(f) for f in self._file_list] + common_queries("JournalNode")
+
+    def _accept(self, object_name):
+        return any(f in object_name for f in self._file_list) or common_accepts(object_name)
+
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
@@ -41,7 +47,7 @@ class JournalNodeMetricCollector(MetricCol):
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "journalnode")
+            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "journalnode", self._family_cache)
             self._hadoop_journalnode_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -87,10 +93,10 @@ class JournalNodeMetricCollector(MetricCol):
                 else:
                     continue
             else:
-                snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-                self._hadoop_journalnode_metrics['Journal-prod'][metric] = GaugeMetricFamily("_".join([self._prefix, snake_case]),
-                                                                                             self._metrics['Journal-prod'][metric],
-                                                                                             labels=label)
+                snake_case = utils.snake_case(metric)
+                self._hadoop_journalnode_metrics['Journal-prod'][metric] = gauge_family("_".join([self._prefix, snake_case]),
+                                                                                        self._metrics['Journal-prod'][metric],
+                                                                                        labels=label)
 
     def _setup_metrics_labels(self, beans):
         # The metrics we want to export.
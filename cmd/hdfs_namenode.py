@@ -3,6 +3,7 @@
 
 import yaml
 import re
+from urlparse import urlsplit
 import time
 from sys import exit
 from prometheus_client import start_http_server
@@ -11,10 +12,113 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, BeanDispatcher, common_metrics_info, common_queries, common_accepts, metric_value, metric_value_or_zero
+from definitions import metric_definitions
 
 logger = get_module_logger(__name__)
 
+HA_STATE = {
+    'initializing': 0.0,
+    'active': 1.0,
+    'standby': 2.0,
+    'stopping': 3.0,
+}
+
+FS_STATE = {
+    'Safemode': 0.0,
+    'Operational': 1.0,
+}
+
+ADMIN_STATE = {
+    'In Service': 0.0,
+    'Decommission In Progress': 1.0,
+    'Decommissioned': 2.0,
+    'Entering Maintenance': 3.0,
+    'In Maintenance': 4.0,
+}
+
+# Whether to export the series of every DataNode, decoded from the LiveNodes and DeadNodes of the NameNodeInfo bean,
+# so a central exporter gets the capacity and health of the DataNodes from the NameNode alone, see --namenode-datanodes.
+datanode_metrics = False
+
+
+def _ha_state_value(bean, metric):
+    return HA_STATE.get(bean['tag.HAState'], 9999)
+
+def _fs_state_value(bean, metric):
+    return FS_STATE.get(bean['FSState'], 9999)
+
+def _sync_times_value(bean, metric):
+    return float(re.sub('\s', '', bean[metric])) if metric in bean and bean[metric] else 0
+
+# Translation tables, built once per definition file by metric_definitions.table():
+# jmx attribute -> (family key, label values after cluster, value transform).
+def _nnactivity_table(metrics):
+    table = []
+    for metric in metrics:
+        if "NumOps" in metric:
+            table.append((metric, "MethodNumOps", [metric.split('NumOps')[0]], metric_value))
+        elif "AvgTime" in metric:
+            table.append((metric, "MethodAvgTime", [metric.split('AvgTime')[0]], metric_value))
+        elif "Ops" in metric:
+            table.append((metric, "Operations", [metric.split('Ops')[0]], metric_value))
+        else:
+            table.append((metric, "Operations", [metric], metric_value))
+    return table
+
+def _startupprogress_table(metrics):
+    table = []
+    for metric in metrics:
+        if "Count" in metric:
+            table.append((metric, "PhaseCount", [metric.split("Count")[0]], metric_value))
+        elif "ElapsedTime" in metric and "ElapsedTime" != metric:
+            table.append((metric, "PhaseElapsedTime", [metric.split("ElapsedTime")[0]], metric_value))
+        elif "Total" in metric:
+            table.append((metric, "PhaseTotal", [metric.split("Total")[0]], metric_value))
+        elif "PercentComplete" in metric and "PercentComplete" != metric:
+            table.append((metric, "PhasePercentComplete", [metric.split("PercentComplete")[0]], metric_value))
+        else:
+            table.append((metric, metric, [], metric_value))
+    return table
+
+def _fsnamesystem_table(metrics):
+    table = []
+    for metric in metrics:
+        if 'HAState' in metric:
+            table.append((metric, metric, [], _ha_state_value))
+        elif metric.startswith("Capacity"):
+            table.append((metric, 'capacity', [metric.split("Capacity")[1]], metric_value))
+        else:
+            table.append((metric, metric, [], metric_value))
+    return table
+
+def _fsnamesystem_state_table(metrics):
+    table = []
+    for metric in metrics:
+        if 'FSState' in metric:
+            table.append((metric, metric, [], _fs_state_value))
+        elif "TotalSyncTimes" in metric:
+            table.append((metric, metric, [], _sync_times_value))
+        elif "DataNodes" in metric:
+            table.append((metric, 'datanodes_num', [metric.split("DataNodes")[0].split("Num")[1]], metric_value_or_zero))
+        else:
+            table.append((metric, metric, [], metric_value_or_zero))
+    return table
+
+def _retrycache_table(metrics):
+    return [(metric, "cache", [metric.split('Cache')[1]], metric_value_or_zero) for metric in metrics]
+
+
+# NameNode beans handled by this collector, keyed on the definition file of their metrics.
+_dispatcher = BeanDispatcher([
+    ('NameNodeActivity', lambda service, name, sub: name == 'NameNodeActivity'),
+    ('StartupProgress', lambda service, name, sub: name == 'StartupProgress'),
+    ('FSNamesystem', lambda service, name, sub: name == 'FSNamesystem'),
+    ('FSNamesystemState', lambda service, name, sub: name == 'FSNamesystemState'),
+    ('RetryCache', lambda service, name, sub: name is not None and name.startswith('RetryCache')),
+    ('NameNodeInfo', lambda service, name, sub: name == 'NameNodeInfo'),
+])
+
 
 class NameNodeMetricCollector(MetricCol):
 
@@ -25,25 +129,34 @@ class NameNodeMetricCollector(MetricCol):
             self._hadoop_namenode_metrics.setdefault(self._file_list[i], {})
 
 
+    def _queries(self):
+        return ["Hadoop:service=NameNode,name={0}*".format(f) for f in self._file_list
+                if f != 'NameNodeInfo' or datanode_metrics] + common_queries("NameNode")
+
+    def _accept(self, object_name):
+        # routes are memoized, so NameNodeInfo is left out here rather than in its route.
+        if object_name == 'Hadoop:service=NameNode,name=NameNodeInfo':
+            return datanode_metrics
+        return _dispatcher.accepts(object_name) or common_accepts(object_name)
+
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
         else:
-            # set up all metrics with labels and descriptions.
-            self._setup_metrics_labels(beans)
-    
-            # add metric value to every metric.
-            self._get_metrics(beans)
+            groups = _dispatcher.group(beans)
+
+            # set up all metrics with labels and descriptions, and add metric value to every metric.
+            self._get_metrics(groups)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "namenode")
+            common_metrics = common_metrics_info(self._cluster, beans, "hdfs", "namenode", self._family_cache)
             self._hadoop_namenode_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -54,23 +167,22 @@ class NameNodeMetricCollector(MetricCol):
     def _setup_nnactivity_labels(self):
         num_namenode_flag,avg_namenode_flag,ops_namenode_flag = 1,1,1
         for metric in self._metrics['NameNodeActivity']:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
             label = ["cluster", "method"]
             if "NumOps" in metric:
                 if num_namenode_flag:
                     key = "MethodNumOps"
-                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = GaugeMetricFamily("_".join([self._prefix, "nnactivity_method_ops_total"]),
-                                                                                               "Total number of the times the method is called.",
-                                                                                               labels=label)
+                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = gauge_family("_".join([self._prefix, "nnactivity_method_ops_total"]),
+                                                                                          "Total number of the times the method is called.",
+                                                                                          labels=label)
                     num_namenode_flag = 0
                 else:
                     continue
             elif "AvgTime" in metric:
                 if avg_namenode_flag:
                     key = "MethodAvgTime"
-                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = GaugeMetricFamily("_".join([self._prefix, "nnactivity_method_avg_time_milliseconds"]),
-                                                                                               "Average turn around time of the method in milliseconds.",
-                                                                                               labels=label)
+                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = gauge_family("_".join([self._prefix, "nnactivity_method_avg_time_milliseconds"]),
+                                                                                          "Average turn around time of the method in milliseconds.",
+                                                                                          labels=label)
                     avg_namenode_flag = 0
                 else:
                     continue
@@ -78,16 +190,15 @@ class NameNodeMetricCollector(MetricCol):
                 if ops_namenode_flag:
                     ops_namenode_flag = 0
                     key = "Operations"
-                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = GaugeMetricFamily("_".join([self._prefix, "nnactivity_operations_total"]),
-                                                                                               "Total number of each operation.",
-                                                                                               labels=label)
+                    self._hadoop_namenode_metrics['NameNodeActivity'][key] = gauge_family("_".join([self._prefix, "nnactivity_operations_total"]),
+                                                                                          "Total number of each operation.",
+                                                                                          labels=label)
                 else:
                     continue
 
     def _setup_startupprogress_labels(self):
         sp_count_flag,sp_elapsed_flag,sp_total_flag,sp_complete_flag = 1,1,1,1
         for metric in self._metrics['StartupProgress']:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
             if "ElapsedTime" == metric:
                 key = "ElapsedTime"
                 name = "total_elapsed_time_milliseconds"
@@ -135,12 +246,12 @@ class NameNodeMetricCollector(MetricCol):
                     continue                
             else:
                 key = metric
-                name = snake_case
+                name = utils.snake_case(metric)
                 label = ["cluster"]
                 descriptions = self._metrics['StartupProgress'][metric]            
-            self._hadoop_namenode_metrics['StartupProgress'][key] = GaugeMetricFamily("_".join([self._prefix, "startup_process", name]),
-                                                                                      descriptions,
-                                                                                      labels = label)
+            self._hadoop_namenode_metrics['StartupProgress'][key] = gauge_family("_".join([self._prefix, "startup_process", name]),
+                                                                                 descriptions,
+                                                                                 labels = label)
 
     def _setup_fsnamesystem_labels(self):
         cap_flag = 1
@@ -157,16 +268,16 @@ class NameNodeMetricCollector(MetricCol):
             else:
                 key = metric
                 label = ["cluster"]
-                name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+                name = utils.snake_case(metric)
                 descriptions = self._metrics['FSNamesystem'][metric]
-            self._hadoop_namenode_metrics['FSNamesystem'][key] = GaugeMetricFamily("_".join([self._prefix, "fsname_system", name]),
-                                                                                   descriptions,
-                                                                                   labels = label)
+            self._hadoop_namenode_metrics['FSNamesystem'][key] = gauge_family("_".join([self._prefix, "fsname_system", name]),
+                                                                              descriptions,
+                                                                              labels = label)
 
     def _setup_fsnamesystem_state_labels(self):
         num_flag = 1
         for metric in self._metrics['FSNamesystemState']:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            snake_case = utils.snake_case(metric)
             if 'DataNodes' in metric:
                 if num_flag:
                     num_flag = 0
@@ -179,9 +290,9 @@ class NameNodeMetricCollector(MetricCol):
                 key = metric
                 label = ["cluster"]
                 descriptions = self._metrics['FSNamesystemState'][metric]
-            self._hadoop_namenode_metrics['FSNamesystemState'][key] = GaugeMetricFamily("_".join([self._prefix, "fsname_system", snake_case]),
-                                                                                        descriptions,
-                                                                                        labels = label)
+            self._hadoop_namenode_metrics['FSNamesystemState'][key] = gauge_family("_".join([self._prefix, "fsname_system", snake_case]),
+                                                                                   descriptions,
+                                                                                   labels = label)
 
     def _setup_retrycache_labels(self):
         cache_flag = 1
@@ -190,144 +301,78 @@ class NameNodeMetricCollector(MetricCol):
                 cache_flag = 0
                 key = "cache"
                 label = ["cluster", "mode"]
-                self._hadoop_namenode_metrics['RetryCache'][key] = GaugeMetricFamily("_".join([self._prefix, "cache_total"]), 
-                                                                                     "Total number of RetryCache in each mode", 
-                                                                                     labels = label)
+                self._hadoop_namenode_metrics['RetryCache'][key] = gauge_family("_".join([self._prefix, "cache_total"]), 
+                                                                                "Total number of RetryCache in each mode", 
+                                                                                labels = label)
             else:
                 continue
 
-    def _setup_metrics_labels(self, beans):
-        # The metrics we want to export.
-        for i in range(len(beans)):
-            if 'NameNodeActivity' in beans[i]['name']:
-                self._setup_nnactivity_labels()
-    
-            if 'StartupProgress' in beans[i]['name']:
-                self._setup_startupprogress_labels()
-                    
-            if 'FSNamesystem' in beans[i]['name']:
-                self._setup_fsnamesystem_labels()
-    
-            if 'FSNamesystemState' in beans[i]['name']:
-                self._setup_fsnamesystem_state_labels()
-    
-            if 'RetryCache' in beans[i]['name']:
-                self._setup_retrycache_labels()
+    def _setup_nninfo_labels(self):
+        for metric in self._metrics['NameNodeInfo']:
+            self._hadoop_namenode_metrics['NameNodeInfo'][metric] = gauge_family("_".join([self._prefix, "datanode", utils.snake_case(metric)]),
+                                                                                 self._metrics['NameNodeInfo'][metric],
+                                                                                 labels = ["cluster", "namenode", "datanode"])
 
+    def _add_table_metrics(self, service, table, bean):
+        families = self._hadoop_namenode_metrics[service]
+        for metric, key, label, value in table:
+            families[key].add_metric([self._cluster] + label, value(bean, metric))
 
     def _get_nnactivity_metrics(self, bean):
-        for metric in self._metrics['NameNodeActivity']:
-            if "NumOps" in metric:
-                method = metric.split('NumOps')[0]
-                label = [self._cluster, method]
-                key = "MethodNumOps"
-            elif "AvgTime" in metric:
-                method = metric.split('AvgTime')[0]
-                label = [self._cluster, method]
-                key = "MethodAvgTime"
-            else:
-                if "Ops" in metric:
-                    method = metric.split('Ops')[0]
-                else:
-                    method = metric
-                label = [self._cluster, method]                    
-                key = "Operations"
-            self._hadoop_namenode_metrics['NameNodeActivity'][key].add_metric(label,
-                                                                              bean[metric] if metric in bean else 0)
+        self._add_table_metrics('NameNodeActivity', metric_definitions.table("namenode", "NameNodeActivity", _nnactivity_table), bean)
 
     def _get_startupprogress_metrics(self, bean):
-        for metric in self._metrics['StartupProgress']:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
-            if "Count" in metric:
-                key = "PhaseCount"
-                phase = metric.split("Count")[0]
-                label = [self._cluster, phase]
-            elif "ElapsedTime" in metric and "ElapsedTime" != metric:
-                key = "PhaseElapsedTime"
-                phase = metric.split("ElapsedTime")[0]
-                label = [self._cluster, phase]
-            elif "Total" in metric:
-                key = "PhaseTotal"
-                phase = metric.split("Total")[0]
-                label = [self._cluster, phase]
-            elif "PercentComplete" in metric and "PercentComplete" != metric:
-                key = "PhasePercentComplete"
-                phase = metric.split("PercentComplete")[0]
-                label = [self._cluster, phase]
-            else:
-                key = metric
-                label = [self._cluster]
-            self._hadoop_namenode_metrics['StartupProgress'][key].add_metric(label,
-                                                                             bean[metric] if metric in bean else 0)
+        self._add_table_metrics('StartupProgress', metric_definitions.table("namenode", "StartupProgress", _startupprogress_table), bean)
 
     def _get_fsnamesystem_metrics(self, bean):
-        for metric in self._metrics['FSNamesystem']:
-            key = metric
-            if 'HAState' in metric:
-                label = [self._cluster]
-                if 'initializing' == bean['tag.HAState']:
-                    value = 0.0
-                elif 'active' == bean['tag.HAState']:
-                    value = 1.0
-                elif 'standby' == bean['tag.HAState']:
-                    value = 2.0
-                elif 'stopping' == bean['tag.HAState']:
-                    value = 3.0
-                else:
-                    value = 9999
-                self._hadoop_namenode_metrics['FSNamesystem'][key].add_metric(label, value)
-            elif metric.startswith("Capacity"):
-                key = 'capacity'
-                mode = metric.split("Capacity")[1]
-                label = [self._cluster, mode]
-                self._hadoop_namenode_metrics['FSNamesystem'][key].add_metric(label, bean[metric] if metric in bean else 0)
-            else:
-                label = [self._cluster]
-                self._hadoop_namenode_metrics['FSNamesystem'][key].add_metric(label, bean[metric] if metric in bean else 0)
+        self._add_table_metrics('FSNamesystem', metric_definitions.table("namenode", "FSNamesystem", _fsnamesystem_table), bean)
 
     def _get_fsnamesystem_state_metrics(self, bean):
-        for metric in self._metrics['FSNamesystemState']:
-            label = [self._cluster]
-            key = metric
-            if 'FSState' in metric:
-                if 'Safemode' == bean['FSState']:
-                    value = 0.0
-                elif 'Operational' == bean['FSState']:
-                    value = 1.0
-                else:
-                    value = 9999
-                self._hadoop_namenode_metrics['FSNamesystemState'][key].add_metric(label, value)
-            elif "TotalSyncTimes" in metric:
-                self._hadoop_namenode_metrics['FSNamesystemState'][key].add_metric(label, float(re.sub('\s', '', bean[metric])) if metric in bean and bean[metric] else 0)
-            elif "DataNodes" in metric:
-                key = 'datanodes_num'
-                state = metric.split("DataNodes")[0].split("Num")[1]
-                label = [self._cluster, state]
-                self._hadoop_namenode_metrics['FSNamesystemState'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
-
-            else:
-                self._hadoop_namenode_metrics['FSNamesystemState'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
+        self._add_table_metrics('FSNamesystemState', metric_definitions.table("namenode", "FSNamesystemState", _fsnamesystem_state_table), bean)
 
     def _get_retrycache_metrics(self, bean):
-        for metric in self._metrics['RetryCache']:
-            key = "cache"
-            label = [self._cluster, metric.split('Cache')[1]]
-            self._hadoop_namenode_metrics['RetryCache'][key].add_metric(label, bean[metric] if metric in bean and bean[metric] else 0)
-
-
-    def _get_metrics(self, beans):
-        for i in range(len(beans)):
-            if 'NameNodeActivity' in beans[i]['name']:
-                self._get_nnactivity_metrics(beans[i])
-            if 'StartupProgress' in beans[i]['name']:
-                self._get_startupprogress_metrics(beans[i])
-            if 'FSNamesystem' in beans[i]['name'] and 'FSNamesystemState' not in beans[i]['name']:
-                self._get_fsnamesystem_metrics(beans[i])
-            if 'FSNamesystemState' in beans[i]['name']:
-                self._get_fsnamesystem_state_metrics(beans[i])
-            if 'RetryCache' in beans[i]['name']:
-                self._get_retrycache_metrics(beans[i])
-                    
+        self._add_table_metrics('RetryCache', metric_definitions.table("namenode", "RetryCache", _retrycache_table), bean)
+
+    def _get_nninfo_metrics(self, bean):
+        # {"host:port": {"capacity": ..., "lastContact": ...}}, dead DataNodes only having lastContact and decommissioned.
+        families = self._hadoop_namenode_metrics['NameNodeInfo']
+        # both NameNodes of an HA pair report every DataNode.
+        namenode = urlsplit(self._url).netloc
+        for attribute, live in (('LiveNodes', 1.0), ('DeadNodes', 0.0)):
+            if not bean.get(attribute):
+                continue
+            nodes = utils.decoded_attributes.get(self._url, attribute, bean[attribute])
+            for datanode in sorted(nodes):
+                node = nodes[datanode]
+                label = [self._cluster, namenode, datanode]
+                for metric in families:
+                    if 'live' == metric:
+                        value = live
+                    elif 'adminState' == metric:
+                        if 'adminState' in node:
+                            value = ADMIN_STATE.get(node['adminState'], 9999)
+                        else:
+                            value = ADMIN_STATE['Decommissioned'] if node.get('decommissioned') else ADMIN_STATE['In Service']
+                    elif metric in node:
+                        value = node[metric]
+                    else:
+                        continue
+                    families[metric].add_metric(label, value)
+
+
+    def _get_metrics(self, groups):
+        # The metrics we want to export, set up and filled per module, or reused if its beans did not change.
+        handlers = [
+            ('NameNodeActivity', self._setup_nnactivity_labels, self._get_nnactivity_metrics),
+            ('StartupProgress', self._setup_startupprogress_labels, self._get_startupprogress_metrics),
+            ('FSNamesystem', self._setup_fsnamesystem_labels, self._get_fsnamesystem_metrics),
+            ('FSNamesystemState', self._setup_fsnamesystem_state_labels, self._get_fsnamesystem_state_metrics),
+            ('RetryCache', self._setup_retrycache_labels, self._get_retrycache_metrics),
+            ('NameNodeInfo', self._setup_nninfo_labels, self._get_nninfo_metrics),
+        ]
+        for service, setup, get in handlers:
+            if service in groups:
+                self._update_families(self._hadoop_namenode_metrics, service, groups[service], setup, get)
 
 
 def main():
@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info
 
 logger = get_module_logger(__name__)
 
@@ -30,7 +30,7 @@ class HiveLlapDaemonMetricCollector(MetricCol):
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
@@ -42,7 +42,7 @@ class HiveLlapDaemonMetricCollector(MetricCol):
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hive", "llapdaemon")
+            common_metrics = common_metrics_info(self._cluster, beans, "hive", "llapdaemon", self._family_cache)
             self._hadoop_llapdaemon_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -57,8 +57,8 @@ class HiveLlapDaemonMetricCollector(MetricCol):
                     label = ['cluster', 'host', 'cpu']
                 else:
                     label = ['cluster', 'host']
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                self._hadoop_llapdaemon_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, service.lower(), name]),
+                name = utils.underscore_case(metric)                
+                self._hadoop_llapdaemon_metrics[service][metric] = gauge_family("_".join([self._prefix, service.lower(), name]),
                                                                                       self._metrics[service][metric],
                                                                                       labels=label)
             else:
@@ -68,8 +68,8 @@ class HiveLlapDaemonMetricCollector(MetricCol):
         label = ["cluster", "host"]
         for metric in self._metrics[service]:
             if metric in bean:
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                self._hadoop_llapdaemon_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, service.lower(), name]),
+                name = utils.underscore_case(metric)                
+                self._hadoop_llapdaemon_metrics[service][metric] = gauge_family("_".join([self._prefix, service.lower(), name]),
                                                                                       self._metrics[service][metric],
                                                                                       labels=label)
             else:
@@ -4,6 +4,7 @@
 import yaml
 import re
 import time
+import threading
 from sys import exit
 from prometheus_client import start_http_server
 from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REGISTRY
@@ -11,10 +12,110 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info
 
 logger = get_module_logger(__name__)
 
+# Only shows up in the hiveserver2 bean once HiveServer2 initialized its metastore counts.
+READY_METRIC = 'init_total_count_tables'
+
+
+def is_ready(beans):
+    for bean in beans:
+        if READY_METRIC in bean:
+            return True
+    return False
+
+
+class HiveServerReadiness(object):
+    '''
+    Readiness state machine of one HiveServer2 target: NOT_READY -> WARMING_UP -> READY, and back to
+    WARMING_UP when a ready target restarts.
+    Scrapes never wait for the target: while it warms up they get the last beans seen ready, if not older
+    than stale_after seconds, or whatever the target returns, and a background thread polls the target
+    with a growing delay until it is ready, max_wait seconds passed or stop() is called.
+    The age of the beans a scrape got tells last ready beans from current ones.
+    '''
+    NOT_READY, WARMING_UP, READY = "not_ready", "warming_up", "ready"
+
+    def __init__(self, url, fetch, poll_interval=1, max_poll_interval=30, max_wait=600, stale_after=300):
+        '''
+        @param url: The jmx url of the target, for logging.
+        @param fetch: A function returning the beans of the target.
+        '''
+        self._url = url
+        self._fetch = fetch
+        self._poll_interval = poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._max_wait = max_wait
+        self._stale_after = stale_after
+        self._lock = threading.Lock()
+        self._state = self.NOT_READY
+        self._last_ready = None
+        self._watcher = None
+        self._stopped = threading.Event()
+
+    def ready(self):
+        return self._state == self.READY
+
+    def update(self, beans):
+        '''
+        Record the beans of a scrape.
+        @return the beans the scrape should export, and the seconds since they were read, 0 unless they are
+                the last beans seen ready.
+        '''
+        now = time.time()
+        with self._lock:
+            if is_ready(beans):
+                self._set_ready(beans, now)
+                return beans, 0.0
+            if self._state == self.READY:
+                logger.info("HiveServer2 {0} is not ready anymore, warming up".format(self._url))
+            self._state = self.WARMING_UP
+            if self._watcher is None and not self._stopped.is_set():
+                self._watcher = threading.Thread(target=self._watch, name="hiveserver2-readiness")
+                self._watcher.daemon = True
+                self._watcher.start()
+            if self._last_ready is not None and now - self._last_ready[1] < self._stale_after:
+                return self._last_ready[0], now - self._last_ready[1]
+            return beans, 0.0
+
+    def stop(self):
+        '''
+        Stop polling the target, e.g. once it is unregistered.
+        '''
+        self._stopped.set()
+
+    def _set_ready(self, beans, now):
+        if self._state != self.READY:
+            logger.info("HiveServer2 {0} is ready".format(self._url))
+        self._state = self.READY
+        self._last_ready = (beans, now)
+
+    def _watch(self):
+        start = time.time()
+        delay = self._poll_interval
+        try:
+            while time.time() - start < self._max_wait:
+                if self._stopped.wait(delay):
+                    return
+                delay = min(delay * 2, self._max_poll_interval)
+                try:
+                    beans = self._fetch()
+                except Exception as e:
+                    logger.info("Can't scrape metrics from url: {0}, error msg: {1}".format(self._url, e))
+                    continue
+                with self._lock:
+                    if self._state == self.READY:
+                        return
+                    if is_ready(beans):
+                        self._set_ready(beans, time.time())
+                        return
+            logger.warning("HiveServer2 {0} is still not ready after {1}s".format(self._url, self._max_wait))
+        finally:
+            with self._lock:
+                self._watcher = None
+
 
 class HiveServerMetricCollector(MetricCol):
 
@@ -23,6 +124,7 @@ class HiveServerMetricCollector(MetricCol):
         self._hadoop_hiveserver2_metrics = {}
         for i in range(len(self._file_list)):
             self._hadoop_hiveserver2_metrics.setdefault(self._file_list[i], {})
+        self._readiness = HiveServerReadiness(self._url, self._fetch)
 
 
     def collect(self):
@@ -30,71 +132,81 @@ class HiveServerMetricCollector(MetricCol):
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
         try:
-            count = 0
-            # In case no metrics we need in the jmx url, a time sleep and while-loop was set here to wait for the KEY metrics
-            while count < 5:
-                beans = utils.get_metrics(self._url)
-                if 'init_total_count_tables' not in beans:
-                    count += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    break
+            beans = self._fetch()
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
-        else:
-            pass
-        finally:
-            # set up all metrics with labels and descriptions.
-            self._setup_labels(beans)
+            beans = []
+
+        # a HiveServer2 warming up is never waited for here, see HiveServerReadiness.
+        beans, age = self._readiness.update(beans)
+
+        # set up all metrics with labels and descriptions.
+        self._setup_labels(beans)
+
+        # add metric value to every metric.
+        self._get_metrics(beans)
+
+        # update namenode metrics with common metrics
+        common_metrics = common_metrics_info(self._cluster, beans, "hive", "hiveserver2", self._family_cache)
+        self._hadoop_hiveserver2_metrics.update(common_metrics())
+
+        for i in range(len(self._merge_list)):
+            service = self._merge_list[i]
+            for metric in self._hadoop_hiveserver2_metrics[service]:
+                yield self._hadoop_hiveserver2_metrics[service][metric]
 
-            # add metric value to every metric.
-            self._get_metrics(beans)
+        ready = gauge_family("_".join([self._prefix, "ready"]),
+                             "Whether HiveServer2 finished its initialization (1) or is warming up (0).",
+                             labels=["cluster"])
+        ready.add_metric([self._cluster], 1.0 if self._readiness.ready() else 0.0)
+        yield ready
+        beans_age = gauge_family("_".join([self._prefix, "beans_age_seconds"]),
+                                 "Seconds since the exported metrics were read: 0 when current, the age of the last metrics read ready while HiveServer2 warms up.",
+                                 labels=["cluster"])
+        beans_age.add_metric([self._cluster], age)
+        yield beans_age
 
-            # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "hive", "hiveserver2")
-            self._hadoop_hiveserver2_metrics.update(common_metrics())
+    def close(self):
+        self._readiness.stop()
 
-            for i in range(len(self._merge_list)):
-                service = self._merge_list[i]
-                for metric in self._hadoop_hiveserver2_metrics[service]:
-                    yield self._hadoop_hiveserver2_metrics[service][metric]
+    def _fetch(self):
+        return utils.get_metrics(self._url, self._queries(), self._accept)
 
     def _setup_node_labels(self, bean, service):
         label = ["cluster", "host", "client_id", "node_id"]
         for metric in self._metrics[service]:
             if metric in bean:
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()
-                self._hadoop_hiveserver2_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, 'producer_node', name]),
-                                                                                      self._metrics[service][metric],
-                                                                                      labels=label)
+                name = utils.underscore_case(metric)
+                self._hadoop_hiveserver2_metrics[service][metric] = gauge_family("_".join([self._prefix, 'producer_node', name]),
+                                                                                 self._metrics[service][metric],
+                                                                                 labels=label)
 
     def _setup_topic_labels(self, bean, service):
         label = ["cluster", "host", "client_id", "topic"]
         for metric in self._metrics[service]:
             if metric in bean:
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                self._hadoop_hiveserver2_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, 'producer_topic', name]),
-                                                                                      self._metrics[service][metric],
-                                                                                      labels=label)
+                name = utils.underscore_case(metric)                
+                self._hadoop_hiveserver2_metrics[service][metric] = gauge_family("_".join([self._prefix, 'producer_topic', name]),
+                                                                                 self._metrics[service][metric],
+                                                                                 labels=label)
     
     def _setup_producer_labels(self, bean, service):
         label = ["cluster", "host", "client_id"]
         for metric in self._metrics[service]:
             if metric in bean:
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                self._hadoop_hiveserver2_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                      self._metrics[service][metric],
-                                                                                      labels=label)
+                name = utils.underscore_case(metric)                
+                self._hadoop_hiveserver2_metrics[service][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                 self._metrics[service][metric],
+                                                                                 labels=label)
     
     def _setup_other_labels(self, bean, service):
         label = ["cluster", "host"]
         for metric in self._metrics[service]:
             if metric in bean:
-                name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                self._hadoop_hiveserver2_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                      self._metrics[service][metric],
-                                                                                      labels=label)
+                name = utils.underscore_case(metric)                
+                self._hadoop_hiveserver2_metrics[service][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                 self._metrics[service][metric],
+                                                                                 labels=label)
 
     def _setup_labels(self, beans):
         # The metrics we want to export.
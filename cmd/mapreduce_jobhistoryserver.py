@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, common_metrics_info, common_queries, common_accepts
 
 logger = get_module_logger(__name__)
 
@@ -24,13 +24,19 @@ class MapReduceMetricCollector(MetricCol):
         #     self._hadoop_jobhistoryserver_metrics.setdefault(self._file_list[i], {})
 
 
+    def _queries(self):
+        return common_queries("JobHistoryServer")
+
+    def _accept(self, object_name):
+        return common_accepts(object_name)
+
     def collect(self):
         # Request data from ambari Collect Host API
         # Request exactly the System level information we need from node
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
@@ -42,7 +48,7 @@ class MapReduceMetricCollector(MetricCol):
             # self._get_metrics(self._beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "mapreduce", "jobhistoryserver")
+            common_metrics = common_metrics_info(self._cluster, beans, "mapreduce", "jobhistoryserver", self._family_cache)
             self._hadoop_jobhistoryserver_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
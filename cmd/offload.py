@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import multiprocessing
+from collections import OrderedDict
+from prometheus_client.core import Metric
+
+import utils
+from utils import get_module_logger
+from common import TemplateFamily, gauge_family
+
+logger = get_module_logger(__name__)
+
+
+class ParsePool(object):
+    '''
+    Worker processes decoding the jmx responses of heavy targets, e.g. a RegionServer with thousands of regions,
+    and building their metrics, so that the json decoding and the python loops of their collectors run on other
+    cores instead of holding the GIL of the exporter. The exporter only fetches the raw response bodies, and gets
+    back the families in a compact form, see _pack.
+    The pool must be created before any thread is started, since its processes are forked at creation.
+    '''
+    def __init__(self, processes=0, services=()):
+        '''
+        @param processes: Number of worker processes, 0 parses every target in the exporter process.
+        @param services: Services whose targets are parsed by the workers, e.g. ["regionserver", "jobhistoryserver"].
+        '''
+        self._services = frozenset(services)
+        self._pool = multiprocessing.Pool(processes) if processes > 0 else None
+
+    def handles(self, collector):
+        return self._pool is not None and collector._service in self._services
+
+    def collect(self, collector, bodies, deadline):
+        '''
+        @param bodies: The response bodies of the target, from utils.get_metrics(..., raw=True).
+        @return the families of the target, or None if they were not built before deadline, and the seconds taken to build them.
+        '''
+        result = self._pool.apply_async(_collect_bodies, (type(collector), collector._cluster, collector._url, bodies))
+        try:
+            parse_seconds, received, matched, build_seconds, packed = result.get(max(deadline - time.time(), 0))
+        except multiprocessing.TimeoutError:
+            logger.warning("parsing {0} missed its deadline".format(collector._url))
+            return None, 0.0
+        utils.target_stats.decoded(collector._url, parse_seconds, received, matched)
+        return [_unpack(family) for family in packed], build_seconds
+
+
+# collectors of the worker process, the latest ones of each (class, cluster, url).
+_collectors = OrderedDict()
+_max_collectors = 256
+
+def _collect_bodies(cls, cluster, url, bodies):
+    key = (cls, cluster, url)
+    collector = _collectors.pop(key, None)
+    if collector is None:
+        collector = cls(cluster, url)
+    _collectors[key] = collector
+    while len(_collectors) > _max_collectors:
+        _collectors.popitem(last=False)[1].close()
+    start = time.time()
+    counter = utils.BeanCounter(collector._accept)
+    beans = utils.beans_of_bodies(bodies, counter)
+    parsed = time.time()
+    with utils.prefetched(url, beans):
+        packed = [_pack(family) for family in collector.collect()]
+    return parsed - start, counter.received, counter.matched, time.time() - parsed, packed
+
+def _pack(family):
+    # the label names of a gauge family are sent once, its samples as (label values, value).
+    if isinstance(family, TemplateFamily):
+        return (family.name, family.documentation, None, family._labelnames,
+                [(sample._values, sample.value) for sample in family.samples])
+    return (family.name, family.documentation, family.type, None,
+            [(sample.name, sample.labels, sample.value) for sample in family.samples])
+
+def _unpack(packed):
+    name, documentation, typ, labelnames, samples = packed
+    if typ is None:
+        family = gauge_family(name, documentation, labels=labelnames)
+        for values, value in samples:
+            family.add_metric(values, value)
+    else:
+        family = Metric(name, documentation, typ)
+        for sample_name, labels, value in samples:
+            family.add_sample(sample_name, labels, value)
+    return family
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import OrderedDict
+from urlparse import parse_qs, urlsplit
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from prometheus_client import make_wsgi_app
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from prometheus_client.exposition import ThreadingWSGIServer, choose_encoder
+
+import utils
+import profiling
+from utils import get_module_logger
+from scrape import Families, build_families
+
+logger = get_module_logger(__name__)
+
+
+class Prober(object):
+    '''
+    Prober scrapes a jmx target named in the request, in the style of the blackbox exporter's /probe,
+    so Prometheus can spread thousands of DataNodes or NodeManagers over a few exporters with its own scheduling.
+    The collector of each (module, target, cluster) is built on the first probe and kept in an LRU,
+    so its definitions, family cache and keep-alive connections are reused by the next probes.
+    '''
+    def __init__(self, modules, cluster, max_collectors=1000):
+        '''
+        @param modules: A dict of {module: collector class}, e.g. {"namenode": NameNodeMetricCollector}.
+        @param cluster: Cluster label of the probes which do not give one.
+        @param max_collectors: Number of collectors kept, the least recently probed one is dropped beyond it.
+        '''
+        self._modules = modules
+        self._cluster = cluster
+        self._max_collectors = max_collectors
+        self._lock = threading.Lock()
+        self._collectors = OrderedDict()
+
+    def modules(self):
+        return sorted(self._modules)
+
+    def targets(self):
+        with self._lock:
+            return set(url for module, url, cluster in self._collectors)
+
+    def probe(self, target, module, cluster=None):
+        '''
+        @param target: The jmx url of the target, "host:port" standing for "http://host:port/jmx".
+        @param module: Name of the collector of the target, a key of modules.
+        @return a list of the metric families of the target, followed by the result of the probe,
+                only the result if the target could not be fetched.
+        '''
+        url = self.target_url(target)
+        collector, lock = self._collector(module, url, cluster or self._cluster)
+        start = time.time()
+        session = profiling.sessions.get(url)
+        failures = utils.fetch_failures()
+        with lock:
+            families = build_families(collector) if session is None else session.run(build_families, collector)
+        # a collector yields its last families again when its fetch fails, they are not the metrics of this probe.
+        succeeded = utils.fetch_failures() == failures
+        if not succeeded:
+            families = []
+        success = GaugeMetricFamily("hadoop_exporter_probe_success",
+                                    "Whether the metrics of the target could be scraped (1) or not (0).")
+        success.add_metric([], 1.0 if succeeded else 0.0)
+        duration = GaugeMetricFamily("hadoop_exporter_probe_duration_seconds",
+                                     "Time taken to collect the metrics of the target in seconds.")
+        duration.add_metric([], time.time() - start)
+        return families + [success, duration]
+
+    @staticmethod
+    def target_url(target):
+        if '://' not in target:
+            target = 'http://' + target
+        if urlsplit(target).path in ('', '/'):
+            target = target.rstrip('/') + '/jmx'
+        return target
+
+    def _collector(self, module, url, cluster):
+        key = (module, url, cluster)
+        with self._lock:
+            entry = self._collectors.pop(key, None)
+            if entry is None:
+                entry = (self._modules[module](cluster, url), threading.Lock())
+                logger.info("probe collector of {0} {1} created".format(module, url))
+            self._collectors[key] = entry
+            evicted = []
+            while len(self._collectors) > self._max_collectors:
+                evicted.append(self._collectors.popitem(last=False))
+            urls = set(k[1] for k in self._collectors)
+        for (module_name, evicted_url, evicted_cluster), (evicted_collector, evicted_lock) in evicted:
+            evicted_collector.close()
+            # the connections of a url are shared by all collectors of the url.
+            if evicted_url not in urls:
+                utils.discard_target(evicted_url)
+        return entry
+
+
+def make_probe_app(prober, registry=REGISTRY, metrics_app=None):
+    '''
+    WSGI app serving /probe?target=<jmx url>&module=<module>[&cluster=<cluster>] with prober,
+    and the metrics of registry on any other path, as start_http_server does.
+    @param metrics_app: The WSGI app of the other paths, e.g. exposition.make_metrics_app, make_wsgi_app(registry) by default.
+    '''
+    metrics_app = metrics_app or make_wsgi_app(registry)
+
+    def probe_app(environ, start_response):
+        if environ['PATH_INFO'] != '/probe':
+            return metrics_app(environ, start_response)
+        params = parse_qs(environ.get('QUERY_STRING', ''))
+        target = params.get('target', [None])[0]
+        module = params.get('module', [None])[0]
+        if not target or module not in prober.modules():
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return ["'target' and 'module' are required, module being one of: {0}\n".format(", ".join(prober.modules()))]
+        try:
+            families = prober.probe(target, module, params.get('cluster', [None])[0])
+        except Exception as e:
+            logger.warning("probe of {0} {1} failed, error msg: {2}".format(module, target, e))
+            start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
+            return ["probe failed: {0}\n".format(e)]
+        encoder, content_type = choose_encoder(environ.get('HTTP_ACCEPT'))
+        output = encoder(Families(families))
+        start_response('200 OK', [('Content-Type', content_type)])
+        return [output]
+
+    return probe_app
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_probe_server(port, prober, addr='', registry=REGISTRY, metrics_app=None):
+    '''
+    Start the http server of /metrics and /probe as a daemon thread, in place of start_http_server.
+    '''
+    httpd = make_server(addr, port, make_probe_app(prober, registry, metrics_app), ThreadingWSGIServer, handler_class=_SilentHandler)
+    t = threading.Thread(target=httpd.serve_forever, name="http-server")
+    t.daemon = True
+    t.start()
+    return httpd
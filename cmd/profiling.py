@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+from collections import Counter
+from urlparse import parse_qs
+
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class ProfileSession(object):
+    '''
+    Profiles the next collections of a target, either with cProfile ("cpu"), or by sampling the stack of the thread
+    collecting it every interval seconds ("stacks"), which gives the collapsed stacks flamegraph.pl takes.
+    '''
+    MODES = ('cpu', 'stacks')
+
+    def __init__(self, mode='cpu', collections=1, interval=0.005):
+        '''
+        @param mode: "cpu" or "stacks".
+        @param collections: Number of collections of the target to profile.
+        @param interval: Seconds between two samples of the stack in "stacks" mode.
+        '''
+        if mode not in self.MODES:
+            raise ValueError("unknown mode '{0}', expect one of: {1}".format(mode, ", ".join(self.MODES)))
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._remaining = collections
+        self._running = collections
+        self._interval = interval
+        self._profile = cProfile.Profile() if mode == 'cpu' else None
+        self._stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self, func, *args):
+        '''
+        @return func(*args), profiled if this session still has collections to profile.
+        '''
+        with self._lock:
+            if self._remaining <= 0:
+                return func(*args)
+            self._remaining -= 1
+        try:
+            if self._profile is not None:
+                # one profiled collection at a time, the profile is not thread safe.
+                with self._profile_lock:
+                    return self._profile.runcall(func, *args)
+            return self._sample(func, *args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if self._running == 0:
+                    self._done.set()
+
+    def wait(self, timeout):
+        '''
+        @return whether every collection was profiled within timeout seconds.
+        '''
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        with self._lock:
+            self._running -= self._remaining
+            self._remaining = 0
+
+    def stats(self, sort='cumulative', limit=50):
+        '''
+        @return the cProfile stats in text, the limit most expensive functions by sort.
+        '''
+        out = StringIO()
+        with self._profile_lock:
+            if not self._profile.getstats():
+                return "no collection of the target was profiled\n"
+            pstats.Stats(self._profile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def collapsed(self):
+        '''
+        @return the sampled stacks in the collapsed format, "frame;frame;frame count" per line, the root first.
+        '''
+        with self._lock:
+            return ''.join('{0} {1}\n'.format(';'.join(stack), count) for stack, count in sorted(self._stacks.items()))
+
+    def _sample(self, func, *args):
+        ident = threading.current_thread().ident
+        running = threading.Event()
+        running.set()
+        sampler = threading.Thread(target=self._sample_stacks, args=(ident, running), name="profile-sampler")
+        sampler.daemon = True
+        sampler.start()
+        try:
+            return func(*args)
+        finally:
+            running.clear()
+            sampler.join()
+
+    def _sample_stacks(self, ident, running):
+        while running.is_set():
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                with self._lock:
+                    self._stacks[tuple(reversed(stack))] += 1
+            time.sleep(self._interval)
+
+
+class ProfileSessions(object):
+    '''
+    The profile session of each target, looked up by the ScrapeEngine and the Prober before collecting the target.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, target):
+        return self._sessions.get(target)
+
+    def start(self, target, session):
+        '''
+        @raise ValueError if target is already being profiled.
+        '''
+        with self._lock:
+            if target in self._sessions:
+                raise ValueError("{0} is already being profiled".format(target))
+            self._sessions[target] = session
+
+    def stop(self, target, session):
+        with self._lock:
+            if self._sessions.get(target) is session:
+                del self._sessions[target]
+        session.cancel()
+
+
+sessions = ProfileSessions()
+
+
+def make_debug_app(token, targets, app, max_collections=100, max_timeout=600):
+    '''
+    WSGI app serving /debug/pprof?target=<jmx url>[&mode=cpu|stacks][&collections=N][&sort=...][&limit=N][&interval=S][&timeout=S],
+    which profiles the next N collections of the target and returns their cProfile stats or collapsed stacks,
+    and app on any other path. Requests must carry token, in the "token" parameter or the X-Debug-Token header.
+    @param targets: Function returning the jmx urls which may be profiled, e.g. the targets of the ScrapeEngine.
+    '''
+    def debug_app(environ, start_response):
+        if environ['PATH_INFO'] != '/debug/pprof':
+            return app(environ, start_response)
+        params = dict((k, v[0]) for k, v in parse_qs(environ.get('QUERY_STRING', '')).items())
+        given = params.get('token') or environ.get('HTTP_X_DEBUG_TOKEN') or ''
+        if not hmac.compare_digest(given, token):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return ["a valid debug token is required\n"]
+        target = params.get('target')
+        known = targets()
+        if target not in known:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ["'target' must be one of:\n{0}\n".format("\n".join(sorted(known)))]
+        try:
+            collections = min(int(params.get('collections', 1)), max_collections)
+            timeout = min(float(params.get('timeout', 120)), max_timeout)
+            session = ProfileSession(params.get('mode', 'cpu'), collections, float(params.get('interval', 0.005)))
+            sessions.start(target, session)
+        except ValueError as e:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return ["{0}\n".format(e)]
+        logger.info("profiling {0} collections of {1} in {2} mode".format(collections, target, session.mode))
+        try:
+            complete = session.wait(timeout)
+        finally:
+            sessions.stop(target, session)
+        if not complete:
+            logger.warning("profiling of {0} timed out, returning the collections profiled so far".format(target))
+        if session.mode == 'cpu':
+            try:
+                body = session.stats(params.get('sort', 'cumulative'), int(params.get('limit', 50)))
+            except (KeyError, ValueError) as e:
+                start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+                return ["invalid sort or limit: {0}\n".format(e)]
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+        else:
+            body = session.collapsed()
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Disposition', 'attachment; filename="hadoop_exporter.stacks"')])
+        return [body]
+
+    return debug_app
@@ -0,0 +1,512 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from urlparse import urlsplit
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily, Metric
+from prometheus_client.exposition import generate_latest
+from prometheus_client.samples import Sample
+
+import utils
+import profiling
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class FetchLimiter(object):
+    '''
+    Bounds the number of jmx fetches in flight, in total and per host, so that the scrape workers can be raised
+    to scrape thousands of targets without opening as many connections at once, or hitting a host with every
+    daemon it runs at the same time. A fetch waits for a free slot until its deadline, and is given up past it.
+    '''
+    def __init__(self, max_inflight=0, max_per_host=0):
+        '''
+        @param max_inflight: Max number of fetches in flight, 0 for no limit.
+        @param max_per_host: Max number of fetches in flight to the same host, 0 for no limit.
+        '''
+        self._cond = threading.Condition()
+        self._max_inflight = max_inflight
+        self._max_per_host = max_per_host
+        self._inflight = 0
+        self._per_host = {}
+
+    def acquire(self, host, deadline):
+        '''
+        @return True once a slot for host is taken, False if no slot was free before deadline.
+        '''
+        with self._cond:
+            while not self._free(host):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._inflight += 1
+            self._per_host[host] = self._per_host.get(host, 0) + 1
+            return True
+
+    def release(self, host):
+        with self._cond:
+            self._inflight -= 1
+            if self._per_host[host] > 1:
+                self._per_host[host] -= 1
+            else:
+                del self._per_host[host]
+            self._cond.notify_all()
+
+    def _free(self, host):
+        if self._max_inflight > 0 and self._inflight >= self._max_inflight:
+            return False
+        return self._max_per_host <= 0 or self._per_host.get(host, 0) < self._max_per_host
+
+
+class ScrapeEngine(object):
+    '''
+    ScrapeEngine is registered in the prometheus REGISTRY in place of the MetricCol instances.
+    prometheus_client runs registered collectors one after another, so one slow jmx endpoint used to add
+    its whole timeout to the /metrics response. ScrapeEngine runs the collect() of every target in a
+    thread pool, waits for each target until its own deadline or the global scrape budget runs out,
+    and returns whatever finished in time. Late targets are flagged by hadoop_exporter_scrape_timeout.
+    '''
+    def __init__(self, workers=10, target_timeout=6, scrape_budget=9, refresh_interval=0, limiter=None, parse_pool=None,
+                 target_label=None):
+        '''
+        @param workers: Number of threads scraping targets in parallel.
+        @param target_timeout: Seconds each target may take, counted from the start of the scrape.
+        @param scrape_budget: Seconds the whole scrape may take, whatever the number of targets.
+        @param refresh_interval: If > 0, targets are scraped by a background scheduler every refresh_interval
+                                 seconds and collect() serves the latest snapshot of each target instead,
+                                 so the load on the hadoop daemons does not depend on the number of scrapers.
+        @param limiter: An optional FetchLimiter. Targets are then fetched within its bounds, out of their collect(),
+                        and their collectors parse the fetched beans, so workers may be far more than the fetches
+                        in flight.
+        @param parse_pool: An optional ParsePool, the targets it handles are decoded and built by its processes.
+        @param target_label: An optional label name, e.g. "target", added to every sample of a target with its key,
+                             so that the targets of the same service and cluster, e.g. scraped by a central exporter,
+                             do not export the same series.
+        '''
+        self._targets = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(workers)
+        self._target_timeout = target_timeout
+        self._scrape_budget = scrape_budget
+        self._refresh_interval = refresh_interval
+        self._intervals = {}
+        self._next_refresh = {}
+        self._snapshots = {}
+        self._wakeup = threading.Event()
+        self._scheduler = None
+        self._limiter = limiter
+        self._parse_pool = parse_pool
+        self._target_label = target_label
+        self._generation = 0
+        self._rendered = {}
+        self._local = threading.local()
+
+    def register(self, collector, key=None, interval=None):
+        '''
+        @param collector: A MetricCol instance.
+        @param key: The target identifier, the jmx url of collector by default.
+        @param interval: Refresh interval of this target in background mode, refresh_interval by default.
+        '''
+        key = key or collector._url
+        with self._lock:
+            replaced = self._targets.get(key)
+            self._targets[key] = collector
+            self._locks.setdefault(key, threading.Lock())
+            self._intervals[key] = interval or self._refresh_interval
+            self._next_refresh[key] = 0
+            self._snapshots.pop(key, None)
+            self._generation += 1
+        self._wakeup.set()
+        logger.info("target {0} registered".format(key))
+        if replaced is not None and replaced is not collector:
+            replaced.close()
+
+    def unregister(self, key):
+        with self._lock:
+            collector = self._targets.pop(key, None)
+            self._locks.pop(key, None)
+            self._intervals.pop(key, None)
+            self._next_refresh.pop(key, None)
+            self._snapshots.pop(key, None)
+            self._rendered.pop(key, None)
+            self._generation += 1
+        if collector is not None:
+            logger.info("target {0} unregistered".format(key))
+            collector.close()
+        return collector
+
+    def targets(self):
+        with self._lock:
+            return OrderedDict(self._targets)
+
+    def describe(self):
+        # metric names depend on the registered targets, do not let REGISTRY call collect() to find them.
+        return []
+
+    def start(self):
+        '''
+        Start the background scheduler, only needed when refresh_interval > 0.
+        '''
+        if self._refresh_interval <= 0 or self._scheduler is not None:
+            return
+        self._scheduler = threading.Thread(target=self._schedule, name="scrape-scheduler")
+        self._scheduler.daemon = True
+        self._scheduler.start()
+
+    def collect(self):
+        if self._refresh_interval > 0:
+            return self._collect_snapshots()
+        return self._collect_live()
+
+    def _collect_live(self):
+        start = time.time()
+        deadline = start + self._scrape_budget
+        pending = []
+        with self._lock:
+            for key, collector in self._targets.items():
+                pending.append((key, self._pool.apply_async(self._collect_target,
+                                                            (key, collector, self._locks[key], min(start + self._target_timeout, deadline)))))
+
+        timeout = GaugeMetricFamily("hadoop_exporter_scrape_timeout",
+                                    "Whether the target missed its deadline and was left out of this scrape (1) or not (0).",
+                                    labels=["target"])
+        duration = GaugeMetricFamily("hadoop_exporter_scrape_duration_seconds",
+                                     "Time taken to collect the metrics of the target in seconds.",
+                                     labels=["target"])
+        target_families = []
+        for key, result in pending:
+            now = time.time()
+            remaining = min(start + self._target_timeout, deadline) - now
+            try:
+                families, elapsed = result.get(max(remaining, 0))
+            except TimeoutError:
+                logger.warning("scrape of {0} missed its deadline, serving partial results".format(key))
+                timeout.add_metric([key], 1.0)
+                continue
+            except Exception as e:
+                logger.warning("scrape of {0} failed, error msg: {1}".format(key, e))
+                timeout.add_metric([key], 0.0)
+                continue
+            timeout.add_metric([key], 0.0 if families is not None else 1.0)
+            if families is None:
+                continue
+            duration.add_metric([key], elapsed)
+            target_families.extend(families)
+        for family in merge_families(target_families):
+            yield family
+        yield timeout
+        yield duration
+        for family in self._breaker_families():
+            yield family
+        for family in self._stats_families():
+            yield family
+        for family in self._cache_families():
+            yield family
+
+    def _collect_snapshots(self):
+        now = time.time()
+        with self._lock:
+            snapshots = [(key, self._snapshots.get(key)) for key in self._targets]
+
+        age = GaugeMetricFamily("hadoop_exporter_snapshot_age_seconds",
+                                "Seconds since the served metrics of the target were scraped.",
+                                labels=["target"])
+        duration = GaugeMetricFamily("hadoop_exporter_scrape_duration_seconds",
+                                     "Time taken to collect the metrics of the target in seconds.",
+                                     labels=["target"])
+        target_families = []
+        for key, snapshot in snapshots:
+            if snapshot is None:
+                continue
+            families, scraped_at, elapsed = snapshot
+            age.add_metric([key], now - scraped_at)
+            duration.add_metric([key], elapsed)
+            if not getattr(self._local, 'without_targets', False):
+                target_families.extend(families)
+        for family in merge_families(target_families):
+            yield family
+        yield age
+        yield duration
+        for family in self._breaker_families():
+            yield family
+        for family in self._stats_families():
+            yield family
+        for family in self._cache_families():
+            yield family
+
+    def generation(self):
+        '''
+        @return a number changing whenever a snapshot is taken or a target is added or removed, in background mode.
+        '''
+        return self._generation
+
+    def rendered_targets(self):
+        '''
+        The latest snapshot of every target in the text format, each family rendered apart, so that the families of
+        the same name of several targets can be merged under a single HELP and TYPE, see merge_rendered.
+        A snapshot is rendered once, on the first call after it was taken.
+        @return a list, per target having a snapshot, of the (name, HELP and TYPE lines, samples) of its families.
+        '''
+        with self._lock:
+            snapshots = [(key, self._snapshots.get(key)) for key in self._targets]
+        parts = []
+        for key, snapshot in snapshots:
+            if snapshot is None:
+                continue
+            rendered = self._rendered.get(key)
+            if rendered is None or rendered[0] is not snapshot:
+                rendered = (snapshot, [_render_family(family) for family in merge_families(snapshot[0])])
+                with self._lock:
+                    if self._snapshots.get(key) is snapshot:
+                        self._rendered[key] = rendered
+            parts.append(rendered[1])
+        return parts
+
+    def render_without_targets(self, registry):
+        '''
+        @return registry in the text format, leaving out the families of the targets, see rendered_targets.
+        '''
+        self._local.without_targets = True
+        try:
+            return generate_latest(registry)
+        finally:
+            self._local.without_targets = False
+
+    @staticmethod
+    def _breaker_families():
+        state = GaugeMetricFamily("hadoop_exporter_breaker_state",
+                                  "Circuit breaker state of the target: 0 closed, 1 open (skipped), 2 half open (probed).",
+                                  labels=["target"])
+        skipped = CounterMetricFamily("hadoop_exporter_breaker_skipped",
+                                      "Number of scrapes of the target skipped by its open circuit breaker.",
+                                      labels=["target"])
+        timeout = GaugeMetricFamily("hadoop_exporter_target_timeout_seconds",
+                                    "Current timeout of the jmx requests of the target, derived from their latency: "
+                                    "kind is queries for the /jmx?qry= requests, whole for the requests of the whole /jmx.",
+                                    labels=["target", "kind"])
+        for url, (breaker_state, skipped_count, timeouts) in sorted(utils.breakers.states().items()):
+            state.add_metric([url], breaker_state)
+            skipped.add_metric([url], skipped_count)
+            for kind in sorted(timeouts):
+                timeout.add_metric([url, kind], timeouts[kind])
+        return [state, skipped, timeout]
+
+    @staticmethod
+    def _stats_families():
+        fetch = HistogramMetricFamily("hadoop_exporter_target_fetch_duration_seconds",
+                                      "Time taken by the jmx requests of the target until their response was read, in seconds.",
+                                      labels=["target"])
+        size = GaugeMetricFamily("hadoop_exporter_target_response_bytes",
+                                 "Size of the jmx responses of the latest scrape of the target.",
+                                 labels=["target"])
+        received = GaugeMetricFamily("hadoop_exporter_target_beans_received",
+                                     "Number of beans in the jmx responses of the latest scrape of the target.",
+                                     labels=["target"])
+        matched = GaugeMetricFamily("hadoop_exporter_target_beans_matched",
+                                    "Number of beans read by the collector in the latest scrape of the target.",
+                                    labels=["target"])
+        series = GaugeMetricFamily("hadoop_exporter_target_series",
+                                   "Number of series built in the latest scrape of the target.",
+                                   labels=["target"])
+        phase = GaugeMetricFamily("hadoop_exporter_target_phase_seconds",
+                                  "Time taken by the latest scrape of the target to parse the jmx responses (parse) and build the metrics (build).",
+                                  labels=["target", "phase"])
+        success = GaugeMetricFamily("hadoop_exporter_target_last_success_timestamp_seconds",
+                                    "Time of the latest successful jmx fetch of the target, in unix time.",
+                                    labels=["target"])
+        for url, (buckets, total, latest, last_success) in sorted(utils.target_stats.states().items()):
+            bounds = [str(bound) for bound in utils.TargetStats.BUCKETS] + ['+Inf']
+            fetch.add_metric([url], zip(bounds, buckets), total)
+            if latest is not None:
+                size.add_metric([url], latest['bytes'])
+                received.add_metric([url], latest['received'])
+                matched.add_metric([url], latest['matched'])
+                series.add_metric([url], latest['series'])
+                phase.add_metric([url, 'parse'], latest['parse_seconds'])
+                phase.add_metric([url, 'build'], latest['build_seconds'])
+            if last_success is not None:
+                success.add_metric([url], last_success)
+        return [fetch, size, received, matched, series, phase, success]
+
+    def _cache_families(self):
+        hits = CounterMetricFamily("hadoop_exporter_family_cache_hits",
+                                   "Number of scrapes of the target reusing the families of the module, its beans being unchanged.",
+                                   labels=["target", "service"])
+        misses = CounterMetricFamily("hadoop_exporter_family_cache_misses",
+                                     "Number of scrapes of the target building the families of the module.",
+                                     labels=["target", "service"])
+        for key, collector in self.targets().items():
+            cache = getattr(collector, '_family_cache', None)
+            if cache is None:
+                continue
+            for service, (hit_count, miss_count) in sorted(cache.counts().items()):
+                hits.add_metric([key, service], hit_count)
+                misses.add_metric([key, service], miss_count)
+        return [hits, misses]
+
+    def _schedule(self):
+        while True:
+            # cleared before the targets are read, so that a target registered from now on wakes the wait below up.
+            self._wakeup.clear()
+            now = time.time()
+            wait = self._refresh_interval
+            with self._lock:
+                for key, collector in self._targets.items():
+                    if self._next_refresh[key] <= now:
+                        self._next_refresh[key] = now + self._intervals[key]
+                        self._pool.apply_async(self._refresh, (key, collector, self._locks[key], self._next_refresh[key]))
+                    wait = min(wait, self._next_refresh[key] - now)
+            self._wakeup.wait(max(wait, 0.1))
+
+    def _refresh(self, key, collector, lock, deadline):
+        try:
+            families, elapsed = self._collect_target(key, collector, lock, deadline)
+        except Exception as e:
+            logger.warning("refresh of {0} failed, keep serving the previous snapshot, error msg: {1}".format(key, e))
+            return
+        if families is None:
+            return
+        with self._lock:
+            # the target may have been unregistered or replaced while it was scraped.
+            if self._targets.get(key) is collector:
+                self._snapshots[key] = (families, time.time(), elapsed)
+                self._generation += 1
+
+    def _collect_target(self, key, collector, lock, deadline):
+        # the scrape gave up on this target while it was queued, do not start it.
+        if time.time() >= deadline:
+            logger.warning("scrape of {0} did not start before its deadline, skip it".format(key))
+            return None, 0.0
+        # a previous scrape that missed its deadline may still be running on this target,
+        # skip it rather than piling up threads on a hung endpoint.
+        if not lock.acquire(False):
+            logger.warning("previous scrape of {0} is still running, skip it".format(key))
+            return None, 0.0
+        try:
+            start = time.time()
+            offload = self._parse_pool is not None and self._parse_pool.handles(collector)
+            if self._limiter is None and not offload:
+                collect, args = build_families, (collector,)
+            else:
+                collect, args = self._collect_fetched, (key, collector, deadline, offload)
+            # the target may be profiled on /debug/pprof.
+            session = profiling.sessions.get(key)
+            families = collect(*args) if session is None else session.run(collect, *args)
+            if families is not None and self._target_label:
+                families = label_families(families, self._target_label, key)
+            return families, time.time() - start
+        finally:
+            lock.release()
+
+    def _collect_fetched(self, key, collector, deadline, offload=False):
+        host = urlsplit(collector._url).hostname
+        if self._limiter is not None and not self._limiter.acquire(host, deadline):
+            logger.warning("no fetch slot for {0} before its deadline, skip it".format(key))
+            return None
+        try:
+            beans = utils.get_metrics(collector._url, collector._queries(), collector._accept, raw=offload)
+        finally:
+            if self._limiter is not None:
+                self._limiter.release(host)
+        if offload:
+            # beans are the raw response bodies here, decoded by a process of the pool.
+            families, build_seconds = self._parse_pool.collect(collector, beans, deadline)
+            if families is not None:
+                utils.target_stats.scraped(collector._url, build_seconds, sum(len(family.samples) for family in families))
+            return families
+        # parse out of the fetch slot, collect() reads the beans fetched above instead of fetching them again.
+        with utils.prefetched(collector._url, beans):
+            return build_families(collector)
+
+
+def build_families(collector):
+    '''
+    @return the families of collector.collect(), after recording their series and build time, the time collect()
+            spent out of utils.get_metrics, in utils.target_stats.
+    '''
+    fetching = utils.fetch_seconds()
+    start = time.time()
+    families = list(collector.collect())
+    build_seconds = time.time() - start - (utils.fetch_seconds() - fetching)
+    utils.target_stats.scraped(collector._url, build_seconds, sum(len(family.samples) for family in families))
+    return families
+
+
+def label_families(families, name, value):
+    '''
+    @return copies of families, the label name being set to value in every sample.
+    '''
+    labeled = []
+    for family in families:
+        copy = Metric(family.name, family.documentation, family.type, family.unit)
+        copy.samples = [Sample(sample.name, dict(sample.labels, **{name: value}), sample.value, sample.timestamp, sample.exemplar)
+                        for sample in family.samples]
+        labeled.append(copy)
+    return labeled
+
+
+def merge_families(families):
+    '''
+    The text formats allow a single HELP and TYPE per metric name, followed by all its samples, so the families of
+    the same name, e.g. of several targets of a service, are exported as one.
+    @return families, the samples of the families of the same name being merged into the first one, in a new family.
+    '''
+    merged = OrderedDict()
+    for family in families:
+        same = merged.get(family.name)
+        if same is None:
+            merged[family.name] = [family]
+        elif same[0].type != family.type:
+            logger.warning("{0} is both a {1} and a {2}, drop the {2} samples".format(family.name, same[0].type, family.type))
+        else:
+            same.append(family)
+    result = []
+    for same in merged.values():
+        if len(same) == 1:
+            result.append(same[0])
+            continue
+        family = Metric(same[0].name, same[0].documentation, same[0].type, same[0].unit)
+        family.samples = [sample for other in same for sample in other.samples]
+        result.append(family)
+    return result
+
+
+def merge_rendered(parts):
+    '''
+    @param parts: Lists of (name, HELP and TYPE lines, samples) of rendered families, see rendered_targets.
+    @return the text format of all parts, the samples of the families of the same name following a single HELP and TYPE.
+    '''
+    merged = OrderedDict()
+    for families in parts:
+        for name, header, samples in families:
+            same = merged.get(name)
+            if same is None:
+                merged[name] = [header, samples]
+            else:
+                same.append(samples)
+    return ''.join(''.join(same) for same in merged.values())
+
+
+def _render_family(family):
+    text = generate_latest(Families([family]))
+    # generate_latest writes the HELP and TYPE lines of a family first.
+    end = text.index('\n', text.index('\n') + 1) + 1
+    return family.name, text[:end], text[end:]
+
+
+class Families(object):
+    '''
+    A list of metric families in the form the prometheus_client encoders take, the families of the same name being merged.
+    '''
+    def __init__(self, families):
+        self._families = merge_families(families)
+
+    def collect(self):
+        return self._families
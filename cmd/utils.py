@@ -3,12 +3,18 @@
 
 import sys
 import os
+import re
+import json
+import time
 import socket
+import bisect
+import threading
 import requests
 import argparse
 import logging
 import yaml
 from subprocess import Popen, PIPE
+from contextlib import contextmanager
 
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
@@ -44,33 +50,694 @@ def get_module_logger(mod_name):
 
 logger = get_module_logger(__name__)
 
-def get_metrics(url):
+class SessionPool(object):
     '''
-    :param url: The jmx url, e.g. http://host1:50070/jmx,http://host1:8088/jmx, http://host2:19888/jmx...
-    :return a dict of all metrics scraped in the jmx url.
+    Keep one keep-alive requests session per jmx target (scheme://host:port), shared by every MetricCol,
+    so the TCP/TLS/SPNEGO handshake is paid once instead of on every scrape.
+    Sessions not used for idle_timeout seconds are closed and dropped from the pool.
     '''
-    result = []
-    try:
+    def __init__(self, pool_connections=1, pool_maxsize=4, idle_timeout=300):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_eviction = time.time()
+        self.configure(pool_connections, pool_maxsize, idle_timeout)
+
+    def configure(self, pool_connections=None, pool_maxsize=None, idle_timeout=None):
+        '''
+        @param pool_connections: Number of urllib3 connection pools kept in each session.
+        @param pool_maxsize: Max number of keep-alive connections kept to each target.
+        @param idle_timeout: Seconds a session may stay unused before it is evicted.
+        '''
+        if pool_connections is not None:
+            self._pool_connections = int(pool_connections)
+        if pool_maxsize is not None:
+            self._pool_maxsize = int(pool_maxsize)
+        if idle_timeout is not None:
+            self._idle_timeout = float(idle_timeout)
+        # sessions built with the old sizes are rebuilt on next use.
+        self.close()
+
+    def get(self, url):
+        '''
+        @param url: The jmx url, only its scheme and host:port are used as the pool key.
+        @return a requests session dedicated to the target of url.
+        '''
+        target = self._target(url)
+        now = time.time()
+        with self._lock:
+            if now - self._last_eviction > min(self._idle_timeout, 60):
+                self._evict_idle(now)
+            entry = self._sessions.get(target)
+            if entry is None:
+                entry = [self._new_session(), now]
+                self._sessions[target] = entry
+            else:
+                entry[1] = now
+            return entry[0]
+
+    def discard(self, url):
+        '''
+        Close the session of the target of url, e.g. after the target went away.
+        '''
+        with self._lock:
+            entry = self._sessions.pop(self._target(url), None)
+        if entry:
+            entry[0].close()
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for target in sessions:
+            sessions[target][0].close()
+
+    def _evict_idle(self, now):
+        self._last_eviction = now
+        for target in list(self._sessions):
+            session, last_used = self._sessions[target]
+            if now - last_used > self._idle_timeout:
+                logger.debug("close idle session of {0}".format(target))
+                session.close()
+                del self._sessions[target]
+
+    def _new_session(self):
         s = requests.session()
-        response = s.get(url, auth=("admin", "admin"), timeout=5)  # , params=params, auth=(self._user, self._password))
+        adapter = HTTPAdapter(pool_connections=self._pool_connections, pool_maxsize=self._pool_maxsize)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        return s
+
+    @staticmethod
+    def _target(url):
+        scheme, sep, rest = url.partition('://')
+        if not sep:
+            scheme, rest = 'http', url
+        return '{0}://{1}'.format(scheme, rest.split('/', 1)[0])
+
+
+session_pool = SessionPool()
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|["{}]')
+_JSON_SEPARATOR = re.compile(r'[\s,]*')
+_BEAN_NAME = re.compile(r'\{\s*"name"\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*")')
+
+def iter_beans(chunks, accept=None):
+    '''
+    Parse a jmx document, {"beans": [{...}, {...}]}, incrementally and yield one bean at a time,
+    so that besides the yielded beans at most one bean and one chunk are held in memory.
+    An accepted bean is decoded in place in the buffer, decoding it again once more text is read if it goes on in
+    the next chunk. A rejected bean is skipped undecoded, delimited with a regex scan of its braces and strings.
+    The text of the parsed beans is only dropped from the buffer once it is more than half of it, so a bean
+    costs a copy of its own text rather than of the whole buffer.
+    @param chunks: An iterable of str chunks of the document, e.g. response.iter_content().
+    @param accept: Optional function of the ObjectName of a bean, beans it rejects are skipped undecoded.
+    @raise ValueError if the document is not a beans list.
+    '''
+    chunks = iter(chunks)
+    buf = ''
+    while '[' not in buf:
+        buf = _read_more(chunks, buf)
+        if buf is None:
+            raise ValueError("no beans in the jmx document")
+    buf = buf[buf.index('[') + 1:]
+    # buf[:start] is parsed, the bean in progress starting at start, accepted once accept took its name.
+    start, pos, depth, accepted = 0, 0, 0, False
+    while True:
+        if depth == 0:
+            pos = start = _JSON_SEPARATOR.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] == ']':
+                    return
+                if buf[pos] != '{':
+                    raise ValueError("unexpected {0!r} in the jmx document".format(buf[pos]))
+                if accept is not None and not accepted:
+                    m = _BEAN_NAME.match(buf, pos)
+                    if m is not None:
+                        if not accept(json.loads(m.group(1))):
+                            # skip the bean, its end is found by the scan below.
+                            pos, depth = pos + 1, 1
+                            continue
+                        accepted = True
+                try:
+                    bean, pos = _JSON_DECODER.raw_decode(buf, pos)
+                except ValueError:
+                    # the bean goes on in the next chunk, or the document is invalid and turns out truncated.
+                    pass
+                else:
+                    if accept is None or accepted or accept(bean.get('name', '')):
+                        accepted = False
+                        yield bean
+                    continue
+        else:
+            m = _JSON_TOKEN.search(buf, pos)
+            if m is not None and m.group() != '"':
+                pos = m.end()
+                token = m.group()
+                if token == '{':
+                    depth += 1
+                elif token == '}':
+                    depth -= 1
+                continue
+            # the skipped bean, or one of its strings, goes on in the next chunk.
+            pos = m.start() if m is not None else len(buf)
+        if start > len(buf) // 2:
+            buf, pos, start = buf[start:], pos - start, 0
+        buf = _read_more(chunks, buf, start)
+        if buf is None:
+            raise ValueError("truncated jmx document")
+
+def _read_more(chunks, buf, start=0):
+    # read at least twice the unparsed text buffered, so a large bean is not copied, nor decoded again, once per chunk.
+    parts = [buf]
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size and size >= 2 * (len(buf) - start):
+            break
+    if not size:
+        return None
+    return ''.join(parts)
+
+class CircuitBreaker(object):
+    '''
+    Per jmx url circuit breaker and adaptive timeout, so a dead daemon costs one timeout per backoff period
+    instead of one per scrape.
+    A breaker opens after failure_threshold consecutive failed scrapes. While open, scrapes of the target are
+    skipped until the next probe, one probe scrape is then let through (half open): success closes the breaker,
+    failure opens it again for twice as long, up to max_backoff seconds.
+    The timeout of a target is timeout_factor times the p99 of its last latencies (time to the response headers),
+    within [min_timeout, max_timeout]. max_timeout is used until enough latencies are known.
+    Latencies are kept per kind of request, the /jmx?qry= requests of a few beans ("queries") and the requests of
+    the whole /jmx ("whole"), so the timeout learned from small responses is not applied to the large ones.
+    '''
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+    KINDS = ('queries', 'whole')
+
+    def __init__(self, failure_threshold=3, backoff=5, max_backoff=300, min_timeout=1, max_timeout=5,
+                 timeout_factor=3, window=50):
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._backoff = backoff
+        self._timeout_factor = timeout_factor
+        self._window = window
+        self.configure(failure_threshold, max_backoff, min_timeout, max_timeout)
+
+    def configure(self, failure_threshold=None, max_backoff=None, min_timeout=None, max_timeout=None):
+        '''
+        @param failure_threshold: Consecutive failures opening the breaker of a target.
+        @param max_backoff: Max seconds between two probes of an open target.
+        @param min_timeout: Min timeout of a request in seconds.
+        @param max_timeout: Max timeout of a request in seconds, also used until the latency of the target is known.
+        '''
+        if failure_threshold is not None:
+            self._failure_threshold = int(failure_threshold)
+        if max_backoff is not None:
+            self._max_backoff = float(max_backoff)
+        if min_timeout is not None:
+            self._min_timeout = float(min_timeout)
+        if max_timeout is not None:
+            self._max_timeout = float(max_timeout)
+
+    def allow(self, url):
+        '''
+        @return whether the target of url may be scraped now. A skipped scrape is counted.
+        '''
+        now = time.time()
+        with self._lock:
+            target = self._get(url)
+            if target['state'] == self.CLOSED:
+                return True
+            if target['state'] == self.OPEN and now >= target['retry_at']:
+                target['state'] = self.HALF_OPEN
+                logger.info("probe {0} after {1}s".format(url, target['backoff']))
+                return True
+            target['skipped'] += 1
+            return False
+
+    def timeout(self, url, kind='whole'):
+        '''
+        @param kind: The kind of request, "queries" or "whole".
+        '''
+        with self._lock:
+            latencies = sorted(self._get(url)['latencies'][kind])
+        if len(latencies) < 10:
+            return self._max_timeout
+        p99 = latencies[int(len(latencies) * 0.99)]
+        return min(max(p99 * self._timeout_factor, self._min_timeout), self._max_timeout)
+
+    def latency(self, url, seconds, kind='whole'):
+        with self._lock:
+            latencies = self._get(url)['latencies'][kind]
+            latencies.append(seconds)
+            if len(latencies) > self._window:
+                del latencies[0]
+
+    def success(self, url):
+        with self._lock:
+            target = self._get(url)
+            if target['state'] != self.CLOSED:
+                logger.info("{0} is back, close its circuit breaker".format(url))
+            target.update(state=self.CLOSED, failures=0, backoff=self._backoff)
+
+    def failure(self, url):
+        now = time.time()
+        with self._lock:
+            target = self._get(url)
+            target['failures'] += 1
+            if target['state'] == self.HALF_OPEN:
+                target['backoff'] = min(target['backoff'] * 2, self._max_backoff)
+            elif target['state'] == self.CLOSED and target['failures'] < self._failure_threshold:
+                return
+            if target['state'] == self.CLOSED:
+                logger.warning("{0} failed {1} times in a row, open its circuit breaker".format(url, target['failures']))
+            target.update(state=self.OPEN, retry_at=now + target['backoff'])
+
+    def discard(self, url):
+        with self._lock:
+            self._targets.pop(url, None)
+
+    def states(self):
+        '''
+        @return a dict of {url: (state, skipped scrapes, {kind: timeout})}.
+        '''
+        with self._lock:
+            urls = list(self._targets)
+        states = {}
+        for url in urls:
+            with self._lock:
+                target = self._targets.get(url)
+                if target is None:
+                    continue
+                state, skipped = target['state'], target['skipped']
+            states[url] = (state, skipped, dict((kind, self.timeout(url, kind)) for kind in self.KINDS))
+        return states
+
+    def _get(self, url):
+        target = self._targets.get(url)
+        if target is None:
+            target = self._targets[url] = {'state': self.CLOSED, 'failures': 0, 'backoff': self._backoff,
+                                           'retry_at': 0, 'skipped': 0, 'latencies': dict((kind, []) for kind in self.KINDS)}
+        return target
+
+
+breakers = CircuitBreaker()
+
+
+class TargetStats(object):
+    '''
+    Self-instrumentation of the jmx targets, to find the targets making the scrapes slow: the latency of their jmx
+    requests, and the response bytes, beans, parse and build times and series of their latest scrape.
+    They are recorded with a few additions under a lock while the target is scraped. The figures recorded since
+    the previous scrape of a target are published as its latest scrape by scraped(), once its metrics are built.
+    '''
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._targets = {}
+
+    def fetched(self, url, seconds, size):
+        '''
+        Record a jmx request of url, taking seconds until its response was read, of size bytes.
+        '''
+        with self._lock:
+            target = self._get(url)
+            target['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            target['sum'] += seconds
+            target['current']['bytes'] += size
+
+    def decoded(self, url, seconds, received, matched):
+        '''
+        Record the decoding of a response of url, taking seconds, which held received beans, matched of them being read.
+        '''
+        with self._lock:
+            current = self._get(url)['current']
+            current['parse_seconds'] += seconds
+            current['received'] += received
+            current['matched'] += matched
+
+    def succeeded(self, url):
+        with self._lock:
+            self._get(url)['last_success'] = time.time()
+
+    def scraped(self, url, build_seconds, series):
+        '''
+        Publish the figures of the scrape of url which built series samples in build_seconds.
+        '''
+        with self._lock:
+            target = self._get(url)
+            target['latest'] = dict(target['current'], build_seconds=build_seconds, series=series)
+            target['current'] = self._current()
+
+    def discard(self, url):
+        with self._lock:
+            self._targets.pop(url, None)
+
+    def states(self):
+        '''
+        @return a dict of {url: (cumulative counts of the BUCKETS and +Inf, sum, latest scrape, last success time)},
+                the latest scrape being a dict of bytes, received, matched, parse_seconds, build_seconds and series,
+                or None before the first scrape.
+        '''
+        states = {}
+        with self._lock:
+            for url, target in self._targets.items():
+                cumulative, total = [], 0
+                for count in target['buckets']:
+                    total += count
+                    cumulative.append(total)
+                states[url] = (cumulative, target['sum'], target['latest'], target['last_success'])
+        return states
+
+    @staticmethod
+    def _current():
+        return {'bytes': 0, 'received': 0, 'matched': 0, 'parse_seconds': 0.0}
+
+    def _get(self, url):
+        target = self._targets.get(url)
+        if target is None:
+            target = self._targets[url] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0,
+                                           'current': self._current(), 'latest': None, 'last_success': None}
+        return target
+
+
+target_stats = TargetStats()
+
+_fetch_clock = threading.local()
+
+def fetch_seconds():
+    '''
+    @return the seconds spent in get_metrics by the current thread, to tell the fetch time of a collect() from its build time.
+    '''
+    return getattr(_fetch_clock, 'seconds', 0.0)
+
+def fetch_failures():
+    '''
+    @return the number of get_metrics calls of the current thread which got no beans, the request failing or the
+            circuit breaker being open, to tell whether a collect() fetched its target or re-yielded its last families.
+    '''
+    return getattr(_fetch_clock, 'failures', 0)
+
+
+class BeanCounter(object):
+    '''
+    An accept function of iter_beans counting the beans it is called with, and the ones accept takes.
+    '''
+    def __init__(self, accept):
+        self._accept = accept
+        self.received = 0
+        self.matched = 0
+
+    def __call__(self, object_name):
+        self.received += 1
+        if self._accept(object_name):
+            self.matched += 1
+            return True
+        return False
+
+
+class _TimedChunks(object):
+    # the chunks of a response, with the seconds spent waiting for them and their size.
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.seconds = 0.0
+        self.size = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        start = time.time()
+        try:
+            chunk = next(self._chunks)
+        finally:
+            self.seconds += time.time() - start
+        self.size += len(chunk)
+        return chunk
+
+def _fetch_beans(url, params=None, accept=None, timeout=5, raw=False):
+    '''
+    @param accept: Optional function of the ObjectName of a bean, see iter_beans.
+    @param raw: Return the undecoded response body instead, see beans_of_bodies.
+    @return the list of beans returned by the jmx url, or None if the request failed.
+    '''
+    start = time.time()
+    try:
+        s = session_pool.get(url)
+        response = s.get(url, params=params, auth=("admin", "admin"), timeout=timeout, stream=True)
     except Exception as e:
         logger.warning("error in func: get_metrics, error msg: %s"%e)
-        result = []
-    else:    
+        return None
+    headers = time.time()
+    breakers.latency(url, response.elapsed.total_seconds(), 'queries' if params else 'whole')
+    try:
         if response.status_code != requests.codes.ok:
-            logger.warning("Get {0} failed, response code is: {1}.".format(url, response.status_code))
-            result = []
-        rlt = response.json()
-        logger.debug(rlt)
-        if rlt and "beans" in rlt:
-            result = rlt['beans']
-        else:
-            logger.warning("No metrics get in the {0}.".format(url))
-            result = []
+            logger.warning("Get {0} failed, response code is: {1}.".format(response.url, response.status_code))
+            return None
+        if raw:
+            body = response.content
+            target_stats.fetched(url, time.time() - start, len(body))
+            return body
+        # the response is read while it is parsed, the time spent waiting for its chunks is the fetch time.
+        chunks = _TimedChunks(response.iter_content(chunk_size=65536))
+        counter = BeanCounter(accept) if accept is not None else None
+        beans = list(iter_beans(chunks, counter))
+        fetching = headers - start + chunks.seconds
+        target_stats.fetched(url, fetching, chunks.size)
+        target_stats.decoded(url, time.time() - start - fetching, counter.received if counter else len(beans),
+                             counter.matched if counter else len(beans))
+        return beans
+    except Exception as e:
+        logger.warning("No metrics get in the {0}, error msg: {1}".format(response.url, e))
+        return None
     finally:
-        s.close()
+        response.close()
+
+class JmxQuery(object):
+    '''
+    Fetch only the beans a collector reads, with one /jmx?qry=<ObjectName pattern> request per pattern,
+    so the daemon does not serialize, and the exporter does not parse, the thousands of beans nobody reads.
+    The requests of a target are sent one after the other by the thread scraping it, over its keep-alive session,
+    so they are bounded by the scrape workers and the fetch limiter like any other fetch.
+    A target is fetched with a single /jmx instead when it needs more than max_queries requests, or when its queries
+    took longer than its whole /jmx: the first scrape of a target fetches its whole /jmx, and every recheck scrapes
+    the way not in use is timed again.
+    '''
+    def __init__(self, max_queries=16, recheck=50):
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._recheck = recheck
+        self.configure(max_queries)
+
+    def configure(self, max_queries):
+        '''
+        @param max_queries: Max number of ?qry= requests of a scrape, 0 disables the filtering.
+        '''
+        self._max_queries = int(max_queries)
+
+    def enabled(self):
+        return self._max_queries > 0
+
+    def use(self, url, queries):
+        '''
+        @return whether this scrape of url should send queries, rather than fetch the whole /jmx.
+        '''
+        if not queries or len(queries) > self._max_queries:
+            return False
+        with self._lock:
+            target = self._targets.get(url)
+            if target is None:
+                target = self._targets[url] = {'scrapes': 0, 'queries': None, 'whole': None}
+            target['scrapes'] += 1
+            if target['whole'] is None:
+                return False
+            faster = target['queries'] is None or target['queries'] <= target['whole']
+            return faster != (target['scrapes'] % self._recheck == 0)
+
+    def timed(self, url, way, seconds):
+        '''
+        Record the seconds taken by the latest fetch of url, way being "queries" or "whole".
+        '''
+        with self._lock:
+            target = self._targets.get(url)
+            if target is not None:
+                target[way] = seconds
+
+    def discard(self, url):
+        with self._lock:
+            self._targets.pop(url, None)
+
+    def get(self, url, queries, accept=None, timeout=5, raw=False):
+        '''
+        @param queries: A list of ObjectName patterns, e.g. "Hadoop:service=NameNode,name=FSNamesystem*".
+        @param accept: Optional function of the ObjectName of a bean, see iter_beans.
+        @param raw: Return the list of undecoded response bodies instead, see beans_of_bodies.
+        @return the beans matched by any of queries, each bean once, or None if a request failed or nothing
+                matched, e.g. an old daemon ignoring qry, in which case the caller fetches the whole /jmx.
+        '''
+        results = []
+        for query in queries:
+            result = _fetch_beans(url, {'qry': query}, accept, timeout, raw)
+            if result is None:
+                return None
+            results.append(result)
+        if raw:
+            return results
+        return _unique_beans(results) or None
+
+
+jmx_query = JmxQuery()
+
+def discard_target(url):
+    '''
+    Drop the session, circuit breaker, query timings, decoded attributes and stats of the jmx url of a target which is no longer scraped.
+    '''
+    session_pool.discard(url)
+    breakers.discard(url)
+    jmx_query.discard(url)
+    decoded_attributes.discard(url)
+    target_stats.discard(url)
+
+def _unique_beans(results):
+    beans = []
+    seen = set()
+    for result in results:
+        for bean in result:
+            if bean.get('name') not in seen:
+                seen.add(bean.get('name'))
+                beans.append(bean)
+    return beans
+
+def beans_of_bodies(bodies, accept=None):
+    '''
+    Decode the response bodies returned by get_metrics(..., raw=True), e.g. in another process.
+    @return the beans of bodies, each bean once.
+    '''
+    return _unique_beans([iter_beans([body], accept) for body in bodies])
+
+_prefetched = threading.local()
+
+@contextmanager
+def prefetched(url, beans):
+    '''
+    Serve beans to the get_metrics(url) calls of this thread within the block, so that the collect() of a collector
+    parses beans fetched beforehand, e.g. by the ScrapeEngine, instead of fetching them itself.
+    '''
+    _prefetched.url, _prefetched.beans = url, beans
+    try:
+        yield
+    finally:
+        _prefetched.url, _prefetched.beans = None, None
+
+def get_metrics(url, queries=None, accept=None, raw=False):
+    '''
+    :param url: The jmx url, e.g. http://host1:50070/jmx,http://host1:8088/jmx, http://host2:19888/jmx...
+    :param queries: ObjectName patterns of the beans to fetch, see JmxQuery. None fetches all beans.
+    :param accept: Optional function of the ObjectName of a bean, beans it rejects are dropped while parsing.
+    :param raw: Return the list of undecoded response bodies instead of the beans, see beans_of_bodies.
+    :return a dict of all metrics scraped in the jmx url, empty while the circuit breaker of url is open.
+    '''
+    if getattr(_prefetched, 'url', None) == url:
+        return _prefetched.beans
+    start = time.time()
+    try:
+        return _get_metrics(url, queries, accept, raw)
+    finally:
+        _fetch_clock.seconds = fetch_seconds() + time.time() - start
+
+def _get_metrics(url, queries, accept, raw):
+    if not breakers.allow(url):
+        logger.debug("circuit breaker of {0} is open, skip it".format(url))
+        _fetch_clock.failures = fetch_failures() + 1
+        return []
+    result = None
+    if jmx_query.use(url, queries):
+        start = time.time()
+        result = jmx_query.get(url, queries, accept, breakers.timeout(url, 'queries'), raw)
+        if result is None:
+            logger.info("jmx queries of {0} failed, fetch all beans instead".format(url))
+        else:
+            jmx_query.timed(url, 'queries', time.time() - start)
+    if result is None:
+        start = time.time()
+        result = _fetch_beans(url, accept=accept, timeout=breakers.timeout(url, 'whole'), raw=raw)
+        if raw and result is not None:
+            result = [result]
+        if result is not None:
+            jmx_query.timed(url, 'whole', time.time() - start)
+    if result is None:
+        breakers.failure(url)
+        _fetch_clock.failures = fetch_failures() + 1
+        return []
+    breakers.success(url)
+    target_stats.succeeded(url)
     return result
 
+class DecodeCache(object):
+    '''
+    Memoize the decoding of the json documents embedded as strings in bean attributes,
+    e.g. RMNMInfo LiveNodeManagers, NameNodeInfo LiveNodes, DataNodeInfo VolumeInfo.
+    Only the last (string, decoded value) pair of each attribute of each target is kept, so an attribute is decoded
+    again only when its content changed since the previous scrape, and the memory held is one decoded value per
+    attribute in use: lists carrying heartbeat times change on every scrape and would never hit a larger cache.
+    Decoded values are shared by every scrape and must be treated as read-only.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, url, attribute, text, decode=json.loads):
+        '''
+        @param url: The jmx url of the target the bean comes from.
+        @param attribute: The name of the attribute, e.g. "LiveNodeManagers".
+        @param text: The attribute value, a json string by default.
+        @param decode: The module level function decoding text, json.loads by default.
+        @return decode(text), computed again only when text differs from the previous one of the attribute.
+        '''
+        key = (url, attribute)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == text:
+            return entry[1]
+        value = decode(text)
+        with self._lock:
+            self._entries[key] = (text, value)
+        return value
+
+    def discard(self, url):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == url]:
+                del self._entries[key]
+
+
+decoded_attributes = DecodeCache()
+
+_snake_case_cache = {}
+_underscore_case_cache = {}
+
+def snake_case(name):
+    '''
+    Turn a CamelCase jmx attribute into a snake_case metric name, e.g. "MemHeapUsedM" -> "mem_heap_used_m".
+    Results are memoized, the inputs being the fixed keys of the metric definition files.
+    '''
+    try:
+        return _snake_case_cache[name]
+    except KeyError:
+        result = _snake_case_cache[name] = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name).lower()
+        return result
+
+def underscore_case(name):
+    '''
+    Turn a dotted or dashed jmx attribute into a metric name, e.g. "memory.heap.used" -> "memory_heap_used".
+    Results are memoized like snake_case.
+    '''
+    try:
+        return _underscore_case_cache[name]
+    except KeyError:
+        result = _underscore_case_cache[name] = re.sub('[^a-z0-9A-Z]', '_', name).lower()
+        return result
+
 def get_host_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -130,6 +797,20 @@ def get_file_list(file_path_name):
         return rlt
 
 
+def node_info_of_host(result, host):
+    '''
+    @param result: The services api response, {cluster: [{hostname: {service: {"jmx": url}}}, ...]}.
+    @return a dict of {cluster: {service: {"jmx": url}}} of the services running on host.
+    '''
+    node_info = {}
+    for k,v in result.items():
+        for i in range(len(v)):
+            if host in v[i]:
+                node_info.setdefault(k, v[i][host])
+            else:
+                continue
+    return node_info
+
 def get_node_info(url):
     '''
     Firstly, I know how many nodes in the cluster.
@@ -153,12 +834,7 @@ def get_node_info(url):
         result = response.json()
         logger.debug(result)
         if result:
-            for k,v in result.items():
-                for i in range(len(v)):
-                    if host in v[i]:
-                        node_info.setdefault(k, v[i][host])
-                    else:
-                        continue
+            node_info = node_info_of_host(result, host)
             logger.debug(node_info)
         else:
             logger.info("No metrics get in the {0}.".format(url))
@@ -257,6 +933,204 @@ def parse_args():
         help='Hadoop llapdaemon metrics URL. (default "http://indata-10-110-13-116.indata.com:15002/jmx")',
         default="http://indata-10-110-13-116.indata.com:15002/jmx"
     )
+    parser.add_argument(
+        '--pool-maxsize',
+        metavar='pool_maxsize',
+        required=False,
+        type=int,
+        help='Max number of keep-alive connections kept to each jmx target. (default "4")',
+        default=4
+    )
+    parser.add_argument(
+        '--pool-idle-timeout',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Close the keep-alive connections of a jmx target not scraped for this many seconds. (default "300")',
+        default=300
+    )
+    parser.add_argument(
+        '--scrape-workers',
+        metavar='workers',
+        required=False,
+        type=int,
+        help='Number of jmx targets scraped in parallel. (default "10")',
+        default=10
+    )
+    parser.add_argument(
+        '--target-timeout',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Leave a jmx target out of the scrape if it is not done within this many seconds. (default "6")',
+        default=6
+    )
+    parser.add_argument(
+        '--scrape-budget',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Max seconds a whole scrape may take, late targets are left out. (default "9")',
+        default=9
+    )
+    parser.add_argument(
+        '--refresh-interval',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Scrape jmx targets in background every this many seconds and serve the latest snapshot, 0 scrapes on every request. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--max-inflight',
+        metavar='fetches',
+        required=False,
+        type=int,
+        help='Max number of jmx targets fetched at once, whatever the number of scrape workers, 0 for no limit. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--max-per-host',
+        metavar='fetches',
+        required=False,
+        type=int,
+        help='Max number of jmx targets of the same host fetched at once, 0 for no limit. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--parse-processes',
+        metavar='processes',
+        required=False,
+        type=int,
+        help='Number of processes decoding the jmx responses of the --parse-services targets, 0 decodes them in the exporter process. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--parse-services',
+        metavar='services',
+        required=False,
+        type=lambda value: [service.strip() for service in value.split(',') if service.strip()],
+        help='Comma separated services whose targets are decoded by the --parse-processes processes. (default "regionserver,jobhistoryserver")',
+        default=['regionserver', 'jobhistoryserver']
+    )
+    parser.add_argument(
+        '--namenode-datanodes',
+        required=False,
+        action='store_true',
+        help='Export the capacity and health of every DataNode from the LiveNodes and DeadNodes of the NameNode, labelled with the NameNode, e.g. in place of scraping the DataNodes in central mode with --skip-services DATANODE. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '--skip-services',
+        metavar='services',
+        required=False,
+        type=str,
+        help='Comma separated services of the rest api not to scrape, e.g. DATANODE when the NameNodes export the DataNodes with --namenode-datanodes. (default "")',
+        default=''
+    )
+    parser.add_argument(
+        '--region-series',
+        metavar='limit',
+        required=False,
+        type=str,
+        help='Limit of the regions exported by a RegionServer: all, topk:<k>[:<metric>], hash:<buckets> or other, the regions beyond it being folded into "other" or a bucket. (default "topk:100:totalRequestCount")',
+        default='topk:100:totalRequestCount'
+    )
+    parser.add_argument(
+        '--table-series',
+        metavar='limit',
+        required=False,
+        type=str,
+        help='Limit of the tables exported by a RegionServer: all, topk:<k>[:<metric>], hash:<buckets> or other, the tables beyond it being folded into "other" or a bucket. (default "topk:100")',
+        default='topk:100'
+    )
+    parser.add_argument(
+        '--user-series',
+        metavar='limit',
+        required=False,
+        type=str,
+        help='Limit of the users exported by a RegionServer: all, topk:<k>[:<metric>], hash:<buckets> or other, the users beyond it being folded into "other" or a bucket. (default "topk:100")',
+        default='topk:100'
+    )
+    parser.add_argument(
+        '--jmx-queries',
+        metavar='queries',
+        required=False,
+        type=int,
+        help='Max number of /jmx?qry= requests fetching only the beans in use from a target, which is fetched with a single /jmx beyond it or when that is faster, 0 always fetches the whole /jmx. (default "16")',
+        default=16
+    )
+    parser.add_argument(
+        '--jmx-timeout',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Max timeout of a jmx request, the timeout of a target adapts to its latency below it. (default "5")',
+        default=5
+    )
+    parser.add_argument(
+        '--breaker-failures',
+        metavar='failures',
+        required=False,
+        type=int,
+        help='Skip a jmx target after this many failed scrapes in a row, probing it with a growing delay. (default "3")',
+        default=3
+    )
+    parser.add_argument(
+        '--breaker-max-backoff',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Max seconds between two probes of a skipped jmx target. (default "300")',
+        default=300
+    )
+    parser.add_argument(
+        '--discovery-interval',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Poll the services api for added, moved or removed services every this many seconds. (default "10")',
+        default=10
+    )
+    parser.add_argument(
+        '--discovery-max-interval',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Max seconds between two polls of the services api while it keeps failing. (default "300")',
+        default=300
+    )
+    parser.add_argument(
+        '--central',
+        required=False,
+        action='store_true',
+        help='Scrape the services of every host of every cluster in the services api, instead of the services of this host. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '--shards',
+        metavar='shards',
+        required=False,
+        type=int,
+        help='Number of central exporters sharing the jmx targets, each target is scraped by one of them. (default "1")',
+        default=1
+    )
+    parser.add_argument(
+        '--shard',
+        metavar='index',
+        required=False,
+        type=int,
+        help='Index of this exporter among the central exporters, from 0 to shards - 1. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--probe-max-targets',
+        metavar='targets',
+        required=False,
+        type=int,
+        help='Number of targets of the /probe endpoint whose collector is kept between two probes. (default "1000")',
+        default=1000
+    )
     parser.add_argument(
         '-p','--path',
         metavar='metrics_path',
@@ -264,6 +1138,14 @@ def parse_args():
         help='Path under which to expose metrics. (default "/metrics")',
         default='/metrics'
     )
+    parser.add_argument(
+        '--debug-token',
+        metavar='token',
+        required=False,
+        type=str,
+        help='Serve /debug/pprof?target=<jmx url>&token=<token>, profiling the next collections of a target, to the requests carrying this token. (default "", disabled)',
+        default=''
+    )
     parser.add_argument(
         '-host','-ip','--address','--addr',
         metavar='ip_or_hostname',
@@ -280,7 +1162,16 @@ def parse_args():
         help='Listen to this port. (default "9131")',
         default=9131
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.shards < 1 or not 0 <= args.shard < args.shards:
+        parser.error("--shard must be in [0, {0}), got {1}".format(args.shards, args.shard))
+    from common import CardinalityLimit
+    for dimension in ('region', 'table', 'user'):
+        try:
+            setattr(args, dimension + '_series', CardinalityLimit(getattr(args, dimension + '_series')))
+        except ValueError as e:
+            parser.error("--{0}-series: {1}".format(dimension, e))
+    return args
 
 
 def main():
@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info
 
 logger = get_module_logger(__name__)
 
@@ -32,7 +32,7 @@ class NodeManagerMetricCollector(MetricCol):
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
@@ -44,7 +44,7 @@ class NodeManagerMetricCollector(MetricCol):
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "yarn", "nodemanager")
+            common_metrics = common_metrics_info(self._cluster, beans, "yarn", "nodemanager", self._family_cache)
             self._hadoop_nodemanager_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -59,10 +59,10 @@ class NodeManagerMetricCollector(MetricCol):
             for service in self._metrics:
                 if service in beans[i]['name']:
                     for metric in self._metrics[service]:
-                        name = re.sub('[^a-z0-9A-Z]', '_', metric).lower()                
-                        self._hadoop_nodemanager_metrics[service][metric] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                              self._metrics[service][metric],
-                                                                                              labels=label)
+                        name = utils.underscore_case(metric)                
+                        self._hadoop_nodemanager_metrics[service][metric] = gauge_family("_".join([self._prefix, name]),
+                                                                                         self._metrics[service][metric],
+                                                                                         labels=label)
                 else:
                     continue
 
@@ -11,7 +11,7 @@ from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REG
 import utils
 from utils import get_module_logger
 from consul import Consul
-from common import MetricCol, common_metrics_info
+from common import MetricCol, gauge_family, common_metrics_info
 
 logger = get_module_logger(__name__)
 
@@ -39,19 +39,16 @@ class ResourceManagerMetricCollector(MetricCol):
         # beans returns a type of 'List'
 
         try:
-            beans = utils.get_metrics(self._url)
+            beans = utils.get_metrics(self._url, self._queries(), self._accept)
         except:
             logger.info("Can't scrape metrics from url: {0}".format(self._url))
             pass
         else:
-            # set up all metrics with labels and descriptions.
-            self._setup_metrics_labels(beans)
-    
-            # add metric value to every metric.
+            # set up all metrics with labels and descriptions, and add metric value to every metric.
             self._get_metrics(beans)
     
             # update namenode metrics with common metrics
-            common_metrics = common_metrics_info(self._cluster, beans, "yarn", "resourcemanager")
+            common_metrics = common_metrics_info(self._cluster, beans, "yarn", "resourcemanager", self._family_cache)
             self._hadoop_resourcemanager_metrics.update(common_metrics())
     
             for i in range(len(self._merge_list)):
@@ -72,14 +69,14 @@ class ResourceManagerMetricCollector(MetricCol):
                name = "_".join([self._prefix, 'node_memory_available'])
            else:
                pass
-           self._hadoop_resourcemanager_metrics['RMNMInfo'][metric] = GaugeMetricFamily(name,
-                                                                                        self._metrics['RMNMInfo'][metric],
-                                                                                        labels=label)
+           self._hadoop_resourcemanager_metrics['RMNMInfo'][metric] = gauge_family(name,
+                                                                                   self._metrics['RMNMInfo'][metric],
+                                                                                   labels=label)
     
     def _setup_queue_labels(self):
         running_flag = 1
         for metric in self._metrics['QueueMetrics']:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            snake_case = utils.snake_case(metric)
             if "running_" in metric:
                 if running_flag:
                     running_flag = 0
@@ -87,16 +84,16 @@ class ResourceManagerMetricCollector(MetricCol):
                     key = "running_app"
                     name = "running_app_total"
                     descriptions = "Current number of running applications in each elapsed time ( < 60min, 60min < x < 300min, 300min < x < 1440min and x > 1440min )"
-                    self._hadoop_resourcemanager_metrics['QueueMetrics'][key] = GaugeMetricFamily("_".join([self._prefix, name]),
-                                                                                                  descriptions,
-                                                                                                  labels=label)
+                    self._hadoop_resourcemanager_metrics['QueueMetrics'][key] = gauge_family("_".join([self._prefix, name]),
+                                                                                             descriptions,
+                                                                                             labels=label)
                 else:
                     continue
             else:
                 label = ["cluster"]
-                self._hadoop_resourcemanager_metrics['QueueMetrics'][metric] = GaugeMetricFamily("_".join([self._prefix, snake_case]),
-                                                                                                 self._metrics['QueueMetrics'][metric],
-                                                                                                 labels=label)
+                self._hadoop_resourcemanager_metrics['QueueMetrics'][metric] = gauge_family("_".join([self._prefix, snake_case]),
+                                                                                            self._metrics['QueueMetrics'][metric],
+                                                                                            labels=label)
 
     def _setup_cluster_labels(self):
         nm_flag, cm_num_flag, cm_avg_flag = 1,1,1
@@ -133,24 +130,13 @@ class ResourceManagerMetricCollector(MetricCol):
                 name = metric
                 description = self._metrics['ClusterMetrics'][metric]
                 label = ["cluster"]
-            self._hadoop_resourcemanager_metrics['ClusterMetrics'][key] = GaugeMetricFamily("_".join([self._prefix, name]),
+            self._hadoop_resourcemanager_metrics['ClusterMetrics'][key] = gauge_family("_".join([self._prefix, name]),
                                                                                              descriptions,
                                                                                              labels=label)
     
-    def _setup_metrics_labels(self, beans):
-        # The metrics we want to export.
-        for i in range(len(beans)):
-            if 'RMNMInfo' in beans[i]['name']:
-                self._setup_rmnminfo_labels()
-            if 'QueueMetrics' in self._metrics:
-                self._setup_queue_labels()    
-            if 'ClusterMetrics' in self._metrics:
-                self._setup_cluster_labels()                    
-
-
     def _get_rmnminfo_metrics(self, bean):
+        live_nm_list = utils.decoded_attributes.get(self._url, 'LiveNodeManagers', bean['LiveNodeManagers'])
         for metric in self._metrics['RMNMInfo']:
-            live_nm_list = yaml.safe_load(bean['LiveNodeManagers'])
             for j in range(len(live_nm_list)):
                 host = live_nm_list[j]['HostName']
                 version = live_nm_list[j]['NodeManagerVersion']
@@ -165,7 +151,7 @@ class ResourceManagerMetricCollector(MetricCol):
     def _get_queue_metrics(self, bean):
         for metric in self._metrics['QueueMetrics']:
             label = [self._cluster]
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+            snake_case = utils.snake_case(metric)
             if "running_0" in metric:
                 key = "running_app"
                 label.append("0to60")
@@ -200,17 +186,20 @@ class ResourceManagerMetricCollector(MetricCol):
             self._hadoop_resourcemanager_metrics['ClusterMetrics'][key].add_metric(label, bean[metric] if metric in bean else 0)
 
     def _get_metrics(self, beans):
+        # The metrics we want to export, set up and filled per module, or reused if its beans did not change.
+        handlers = [
+            ('RMNMInfo', self._setup_rmnminfo_labels, self._get_rmnminfo_metrics),
+            ('QueueMetrics', self._setup_queue_labels, self._get_queue_metrics),
+            ('ClusterMetrics', self._setup_cluster_labels, self._get_cluster_metrics),
+        ]
+        for service, setup, get in handlers:
+            group = [bean for bean in beans if service in bean['name']]
+            if 'QueueMetrics' == service:
+                # only the root queue is exported.
+                group = [bean for bean in group if 'root' == bean.get('tag.Queue')]
+            if group and service in self._metrics:
+                self._update_families(self._hadoop_resourcemanager_metrics, service, group, setup, get)
 
-        for i in range(len(beans)):
-            if 'RMNMInfo' in beans[i]['name']:
-                self._get_rmnminfo_metrics(beans[i])
-                    
-            if 'QueueMetrics' in beans[i]['name'] and 'root' == beans[i]['tag.Queue']:
-                self._get_queue_metrics(beans[i])
-                    
-            if 'ClusterMetrics' in beans[i]['name']:
-                self._get_cluster_metrics(beans[i])
-                    
 
 def main():
     try:
@@ -4,8 +4,9 @@
 import yaml
 import re
 import time
+import signal
 from sys import exit
-from prometheus_client import start_http_server
+from prometheus_client import start_http_server, make_wsgi_app
 from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily, REGISTRY
 
 from consul import Consul
@@ -13,6 +14,14 @@ from consul import Consul
 from cmd import utils
 from cmd.utils import get_host_ip
 from cmd.utils import get_module_logger
+from cmd.definitions import metric_definitions
+from cmd.scrape import ScrapeEngine, FetchLimiter
+from cmd.offload import ParsePool
+from cmd.discovery import ServiceDiscovery
+from cmd.probe import Prober, start_probe_server
+from cmd.exposition import ExpositionCache, make_metrics_app
+from cmd.profiling import make_debug_app
+from cmd import hdfs_namenode
 from cmd.hdfs_namenode import NameNodeMetricCollector
 from cmd.hdfs_datanode import DataNodeMetricCollector
 from cmd.hdfs_journalnode import JournalNodeMetricCollector
@@ -20,6 +29,7 @@ from cmd.yarn_resourcemanager import ResourceManagerMetricCollector
 from cmd.yarn_nodemanager import NodeManagerMetricCollector
 from cmd.mapreduce_jobhistoryserver import MapReduceMetricCollector
 from cmd.hbase_master import HBaseMasterMetricCollector
+from cmd import hbase_regionserver
 from cmd.hbase_regionserver import HBaseRegionServerMetricCollector
 from cmd.hive_server import HiveServerMetricCollector
 from cmd.hive_llap import HiveLlapDaemonMetricCollector
@@ -27,97 +37,56 @@ from cmd.hive_llap import HiveLlapDaemonMetricCollector
 logger = get_module_logger(__name__)
 
 
-def register_consul(address, port):
-    start_http_server(port)
+def register_consul(address, port, prober, metrics_app=None):
+    # serves /metrics like start_http_server, and /probe?target=...&module=... with prober.
+    start_probe_server(port, prober, metrics_app=metrics_app)
     # print("Polling %s. Serving at port: %s" % (args.address, port))
     print "Polling %s. Serving at port: %s" % (address, port)
 
 
-def register_prometheus(rest_url):
-    try:
-        namenode_flag, datanode_flag, journalnode_flag, resourcemanager_flag, nodemanager_flag, hbase_master_flag, hbase_regionserver_flag, historyserver_flag, hive_server_interactive_flag, hive_llap_flag = 1,1,1,1,1,1,1,1,1,1
-        while True:
-            url = 'http://{0}/alert/getservicesbyhost'.format(rest_url)
-            node_info = utils.get_node_info(url)
-            if node_info:
-                for cluster, info in node_info.items():
-                    for k, v in info.items():
-                        if 'NAMENODE' in k:
-                            if namenode_flag:
-                                namenode_url = v['jmx']
-                                logger.info("namenode_url = {0}, start to register".format(namenode_url))
-                                REGISTRY.register(NameNodeMetricCollector(cluster, namenode_url))
-                                namenode_flag = 0
-                                continue
-                        if 'DATANODE' in k:
-                            if datanode_flag:
-                                datanode_url = v['jmx']
-                                logger.info("datanode_url = {0}, start to register".format(datanode_url))
-                                REGISTRY.register(DataNodeMetricCollector(cluster, datanode_url))
-                                datanode_flag = 0
-                                continue
-                        if 'JOURNALNODE' in k:
-                            if journalnode_flag:
-                                journalnode_url = v['jmx']
-                                logger.info("journalnode_url = {0}, start to register".format(journalnode_url))
-                                REGISTRY.register(JournalNodeMetricCollector(cluster, journalnode_url))
-                                journalnode_flag = 0
-                                continue
-                        if 'RESOURCEMANAGER' in k:
-                            if resourcemanager_flag:
-                                resourcemanager_url = v['jmx']
-                                logger.info("resourcemanager_url = {0}, start to register".format(resourcemanager_url))
-                                REGISTRY.register(ResourceManagerMetricCollector(cluster, resourcemanager_url))
-                                resourcemanager_flag = 0
-                                continue
-                        if 'NODEMANAGER' in k:
-                            if nodemanager_flag:
-                                nodemanager_url = v['jmx']
-                                logger.info("nodemanager_url = {0}, start to register".format(nodemanager_url))
-                                REGISTRY.register(NodeManagerMetricCollector(cluster, nodemanager_url))
-                                nodemanager_flag = 0
-                                continue
-                        if 'HBASE_MASTER' in k:
-                            if hbase_master_flag:
-                                hbase_master_url = v['jmx']
-                                logger.info("hbase_master_url = {0}, start to register".format(hbase_master_url))
-                                REGISTRY.register(HBaseMasterMetricCollector(cluster, hbase_master_url))
-                                hbase_master_flag = 0
-                                continue
-                        if 'HBASE_REGIONSERVER' in k:
-                            if hbase_regionserver_flag:
-                                hbase_regionserver_url = v['jmx']
-                                logger.info("hbase_regionserver_url = {0}, start to register".format(hbase_regionserver_url))
-                                REGISTRY.register(HBaseRegionServerMetricCollector(cluster, hbase_regionserver_url))
-                                hbase_regionserver_flag = 0
-                                continue
-                        if 'HISTORYSERVER' in k:
-                            if historyserver_flag:
-                                historyserver_url = v['jmx']
-                                logger.info("historyserver_url = {0}, start to register".format(historyserver_url))
-                                REGISTRY.register(MapReduceMetricCollector(cluster, historyserver_url))
-                                historyserver_flag = 0
-                                continue
-                        if 'HIVE_SERVER_INTERACTIVE' in k:
-                            if hive_server_interactive_flag:
-                                hive_server_interactive_url = v['jmx']
-                                logger.info("hive_server_interactive_url = {0}, start to register".format(hive_server_interactive_url))
-                                REGISTRY.register(HiveServerMetricCollector(cluster, hive_server_interactive_url))
-                                hive_server_interactive_flag = 0
-                                continue
-                        if 'HIVE_LLAP' in k:
-                            if hive_llap_flag:
-                                hive_llap_url = v['jmx']
-                                logger.info("hive_llap_url = {0}, start to register".format(hive_llap_url))
-                                REGISTRY.register(HiveLlapDaemonMetricCollector(cluster, hive_llap_url))
-                                hive_llap_flag = 0
-                                continue
-                time.sleep(300)
-            else:
-                logger.error("No service running in THIS node")
-                # if getserviceshost url return null dict, sleep 60s, retry to reconnect the api.
-                time.sleep(300)
+# services of the services api -> collector class, a service is handled by the first match in its name.
+SERVICE_COLLECTORS = [
+    ('NAMENODE', NameNodeMetricCollector),
+    ('DATANODE', DataNodeMetricCollector),
+    ('JOURNALNODE', JournalNodeMetricCollector),
+    ('RESOURCEMANAGER', ResourceManagerMetricCollector),
+    ('NODEMANAGER', NodeManagerMetricCollector),
+    ('HBASE_MASTER', HBaseMasterMetricCollector),
+    ('HBASE_REGIONSERVER', HBaseRegionServerMetricCollector),
+    ('HISTORYSERVER', MapReduceMetricCollector),
+    ('HIVE_SERVER_INTERACTIVE', HiveServerMetricCollector),
+    ('HIVE_LLAP', HiveLlapDaemonMetricCollector),
+]
+
+# module of the /probe endpoint -> collector class.
+PROBE_MODULES = {
+    'namenode': NameNodeMetricCollector,
+    'datanode': DataNodeMetricCollector,
+    'journalnode': JournalNodeMetricCollector,
+    'resourcemanager': ResourceManagerMetricCollector,
+    'nodemanager': NodeManagerMetricCollector,
+    'master': HBaseMasterMetricCollector,
+    'regionserver': HBaseRegionServerMetricCollector,
+    'jobhistoryserver': MapReduceMetricCollector,
+    'hiveserver2': HiveServerMetricCollector,
+    'llapdaemon': HiveLlapDaemonMetricCollector,
+}
 
+def service_collectors(skip_services):
+    '''
+    @param skip_services: Comma separated services not to scrape, e.g. "DATANODE".
+    @return SERVICE_COLLECTORS without the skipped services.
+    '''
+    skipped = set(service.strip().upper() for service in skip_services.split(',') if service.strip())
+    for service in skipped - set(name for name, cls in SERVICE_COLLECTORS):
+        logger.warning("unknown service {0} in --skip-services, expect one of: {1}".format(service, ", ".join(name for name, cls in SERVICE_COLLECTORS)))
+    return [(name, cls) for name, cls in SERVICE_COLLECTORS if name not in skipped]
+
+def register_prometheus(rest_url, engine, interval=10, max_interval=300, central=False, shards=1, shard=0, collectors=SERVICE_COLLECTORS):
+    try:
+        url = 'http://{0}/alert/getservicesbyhost'.format(rest_url)
+        ServiceDiscovery(url, engine, collectors, interval=interval, max_interval=max_interval,
+                         central=central, shards=shards, shard=shard).run()
     except KeyboardInterrupt:
         print "Interrupted"
         exit(0)
@@ -131,8 +100,31 @@ def main():
         address = args.address
         port = int(args.port)
         rest_url = args.services_api
-        register_consul(address, port)
-        register_prometheus(rest_url)
+        utils.session_pool.configure(pool_maxsize=args.pool_maxsize, idle_timeout=args.pool_idle_timeout)
+        utils.jmx_query.configure(args.jmx_queries)
+        utils.breakers.configure(failure_threshold=args.breaker_failures, max_backoff=args.breaker_max_backoff, max_timeout=args.jmx_timeout)
+        # kill -HUP reloads the metric definition json files on the next scrape, without restarting the exporter.
+        signal.signal(signal.SIGHUP, lambda signum, frame: metric_definitions.request_reload())
+        hbase_regionserver.series_limits.update(region=args.region_series, table=args.table_series, user=args.user_series)
+        hdfs_namenode.datanode_metrics = args.namenode_datanodes
+        # forks the parse processes, before any thread is started.
+        parse_pool = ParsePool(args.parse_processes, args.parse_services)
+        limiter = None
+        if args.max_inflight > 0 or args.max_per_host > 0:
+            limiter = FetchLimiter(max_inflight=args.max_inflight, max_per_host=args.max_per_host)
+        engine = ScrapeEngine(workers=args.scrape_workers, target_timeout=args.target_timeout, scrape_budget=args.scrape_budget,
+                              refresh_interval=args.refresh_interval, limiter=limiter, parse_pool=parse_pool,
+                              target_label='target' if args.central else None)
+        REGISTRY.register(engine)
+        engine.start()
+        # in background mode, /metrics is rendered once per snapshot instead of once per request.
+        metrics_app = make_metrics_app(ExpositionCache(engine)) if args.refresh_interval > 0 else None
+        prober = Prober(PROBE_MODULES, args.cluster, max_collectors=args.probe_max_targets)
+        if args.debug_token:
+            metrics_app = make_debug_app(args.debug_token, lambda: set(engine.targets()) | prober.targets(), metrics_app or make_wsgi_app())
+        register_consul(address, port, prober, metrics_app)
+        register_prometheus(rest_url, engine, interval=args.discovery_interval, max_interval=args.discovery_max_interval,
+                            central=args.central, shards=args.shards, shard=args.shard, collectors=service_collectors(args.skip_services))
     except Exception as e:
         logger.info('Error happened, msg: %s'%e)
     else:
@@ -0,0 +1,518 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Synthetic jmx responses of large clusters, scaled up from the dumps of test/, and a local http server standing in
+for the hadoop daemons, to load test the exporter without a cluster:
+    python synthetic.py --target resourcemanager --target regionserver:20 --nodemanagers 5000 --regions 10000 \\
+                        --rpc-methods 300 --latency 0.05 --jitter 0.2 --failure-rate 0.01 --port 18000
+    python hadoop_exporter.py -s http://127.0.0.1:18000/alert/getservicesbyhost --central -c synthetic
+The i-th target of a role is served at /<role>/<i>/jmx, with its ?qry= filter, and listed on host "<role>-<i>"
+by the services api at /alert/getservicesbyhost.
+'''
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import random
+import hashlib
+import argparse
+import threading
+from fnmatch import fnmatchcase
+from urlparse import parse_qs
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from prometheus_client.exposition import ThreadingWSGIServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# role -> (jmx service, service name in the services api, dumps of test/).
+ROLES = {
+    'namenode': ('NameNode', 'NAMENODE', 'test/namenode'),
+    'datanode': ('DataNode', 'DATANODE', 'test/datanode/datanode.json'),
+    'journalnode': ('JournalNode', 'JOURNALNODE', 'test/journalnode/journalnode.json'),
+    'resourcemanager': ('ResourceManager', 'RESOURCEMANAGER', 'test/yarn'),
+    'jobhistoryserver': ('JobHistoryServer', 'HISTORYSERVER', 'test/jobhistoryserver/jobhistoryserver.json'),
+    'master': ('HBase', 'HBASE_MASTER', 'test/hbase/hbase.json'),
+    'regionserver': ('HBase', 'HBASE_REGIONSERVER', None),
+    'nodemanager': ('NodeManager', 'NODEMANAGER', None),
+    'hiveserver2': ('hiveserver2', 'HIVE_SERVER_INTERACTIVE', None),
+}
+
+# beans every daemon exports, taken from the NameNode dumps for the roles whose dumps lack them.
+_COMMON_BEANS = re.compile(r'^Hadoop:service=NameNode,name=(JvmMetrics|RpcActivity.*|RpcDetailedActivity.*|UgiMetrics|MetricsSystem,sub=Stats)$')
+
+
+def load_beans(path):
+    '''
+    @return the beans of the dump(s) in path, a json file or a directory holding one file per bean.
+    '''
+    paths = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+    beans = []
+    for p in paths:
+        with open(p) as f:
+            dump = json.load(f)
+        beans.extend(dump['beans'] if 'beans' in dump else [dump])
+    return beans
+
+
+def generate(role, host=None, nodemanagers=3, datanodes=3, regions=3, tables=3, users=3, rpc_methods=0, seed=0):
+    '''
+    @param role: A key of ROLES.
+    @param host: The tag.Hostname of the beans, the one of the dump by default.
+    @param nodemanagers: Number of NodeManagers in the RMNMInfo LiveNodeManagers of a ResourceManager.
+    @param datanodes: Number of DataNodes in the NameNodeInfo LiveNodes and DeadNodes of a NameNode, one in 50 dead.
+    @param regions: Number of regions of a RegionServer, spread over tables, with their per-region metrics.
+    @param tables: Number of tables of a RegionServer.
+    @param users: Number of users of a RegionServer, with their per-user metrics.
+    @param rpc_methods: Number of rpc methods added to the RpcDetailedActivity beans.
+    @return the beans of a daemon of role.
+    '''
+    rng = random.Random('{0}-{1}-{2}'.format(role, host, seed))
+    jmx_service, _, path = ROLES[role]
+    if path is not None:
+        beans = load_beans(os.path.join(ROOT, path))
+    else:
+        beans = []
+    if role == 'namenode':
+        beans.append(_nninfo(datanodes, rng))
+    elif role == 'resourcemanager':
+        beans.append(_rmnminfo(beans, nodemanagers, rng))
+    elif role == 'regionserver':
+        beans.extend(_regionserver(regions, tables, users, rng))
+    elif role in _DEFINITION_BEANS:
+        beans.extend(_definition_beans(role, rng))
+    if role in ('resourcemanager', 'regionserver') or role in _DEFINITION_BEANS:
+        beans.extend(_common_beans(jmx_service))
+    for bean in beans:
+        if host is not None and 'tag.Hostname' in bean:
+            bean['tag.Hostname'] = host
+        if rpc_methods and bean.get('name', '').split('name=')[-1].startswith('RpcDetailedActivity'):
+            for i in range(rpc_methods):
+                bean['SyntheticMethod{0}NumOps'.format(i)] = rng.randint(0, 10 ** 7)
+                bean['SyntheticMethod{0}AvgTime'.format(i)] = rng.random() * 10
+    return beans
+
+
+def _common_beans(jmx_service):
+    beans = [bean for bean in load_beans(os.path.join(ROOT, ROLES['namenode'][2])) if _COMMON_BEANS.match(bean['name'])]
+    for bean in beans:
+        bean['name'] = bean['name'].replace('service=NameNode', 'service=' + jmx_service)
+    return beans
+
+
+def _nninfo(datanodes, rng):
+    live, dead = {}, {}
+    for i in range(datanodes):
+        node = 'datanode-{0}.synthetic:50010'.format(i)
+        if i % 50 == 49:
+            dead[node] = {'lastContact': rng.randint(600, 86400), 'decommissioned': rng.random() < 0.5, 'xferaddr': node}
+            continue
+        capacity = rng.randint(12, 48) * 2 ** 40
+        used = rng.randint(0, capacity // 2)
+        non_dfs_used = rng.randint(0, capacity // 20)
+        live[node] = {
+            'infoAddr': node.replace(':50010', ':50075'),
+            'infoSecureAddr': node.replace(':50010', ':0'),
+            'xferaddr': node,
+            'lastContact': rng.randint(0, 3),
+            'usedSpace': used,
+            'adminState': 'In Service' if i % 100 else 'Decommission In Progress',
+            'nonDfsUsedSpace': non_dfs_used,
+            'capacity': capacity,
+            'numBlocks': rng.randint(0, 10 ** 6),
+            'version': '2.7.3',
+            'used': used,
+            'remaining': capacity - used - non_dfs_used,
+            'blockScheduled': rng.randint(0, 10),
+            'blockPoolUsed': used,
+            'blockPoolUsedPercent': used * 100.0 / capacity,
+            'volfails': 1 if i % 97 == 0 else 0,
+        }
+    # the servlet serializes LiveNodes and DeadNodes as json strings.
+    return {
+        'name': 'Hadoop:service=NameNode,name=NameNodeInfo',
+        'modelerType': 'org.apache.hadoop.hdfs.server.namenode.FSNamesystem',
+        'LiveNodes': json.dumps(live),
+        'DeadNodes': json.dumps(dead),
+        'DecomNodes': json.dumps({}),
+    }
+
+
+def _rmnminfo(beans, nodemanagers, rng):
+    for bean in beans:
+        if bean['name'] == 'Hadoop:service=ResourceManager,name=ClusterMetrics':
+            bean['NumActiveNMs'] = nodemanagers
+    nodes = []
+    for i in range(nodemanagers):
+        host = 'nodemanager-{0}.synthetic'.format(i)
+        nodes.append({
+            'HostName': host,
+            'Rack': '/rack-{0}'.format(i // 40),
+            'State': 'RUNNING',
+            'NodeId': '{0}:45454'.format(host),
+            'NodeHTTPAddress': '{0}:8042'.format(host),
+            'LastHealthUpdate': int(time.time() * 1000),
+            'HealthReport': '',
+            'NodeManagerVersion': '2.7.3',
+            'NumContainers': rng.randint(0, 64),
+            'UsedMemoryMB': rng.randint(0, 256) * 1024,
+            'AvailableMemoryMB': rng.randint(0, 256) * 1024,
+        })
+    # the servlet serializes LiveNodeManagers as a json string.
+    return {
+        'name': 'Hadoop:service=ResourceManager,name=RMNMInfo',
+        'modelerType': 'org.apache.hadoop.yarn.server.resourcemanager.RMNMInfo',
+        'LiveNodeManagers': json.dumps(nodes),
+    }
+
+
+def _regionserver(regions, tables, users, rng):
+    '''
+    @return the sub=<file> beans of a RegionServer, one per definition file of regionserver/, with the attributes
+            of every region, table and user named as the RegionServer does.
+    '''
+    beans = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'regionserver', '*.json'))):
+        with open(path) as f:
+            definitions = json.load(f)
+        sub = os.path.splitext(os.path.basename(path))[0]
+        bean = {'name': 'Hadoop:service=HBase,name=RegionServer,sub={0}'.format(sub), 'tag.Hostname': 'regionserver.synthetic'}
+        for metric in definitions:
+            if metric.startswith('region_metric_'):
+                for r in range(regions):
+                    table = r % max(tables, 1)
+                    encoded = hashlib.md5(str(r)).hexdigest()
+                    bean['Namespace_default_table_t{0}_region_{1}_metric_{2}'.format(table, encoded, metric[len('region_metric_'):])] = rng.randint(0, 10 ** 6)
+            elif metric.startswith('table_metric_'):
+                for t in range(tables):
+                    bean['Namespace_default_table_t{0}_metric_{1}'.format(t, metric[len('table_metric_'):])] = rng.randint(0, 10 ** 6)
+            elif metric.startswith('User_metric_'):
+                for u in range(users):
+                    bean['User_user{0}_metric_{1}'.format(u, metric[len('User_metric_'):])] = rng.randint(0, 10 ** 6)
+            else:
+                bean[metric] = rng.randint(0, 10 ** 6)
+        if sub == 'Server':
+            bean['regionCount'] = regions
+        beans.append(bean)
+    return beans
+
+
+def _hiveserver2_bean_name(name):
+    # the kafka producer beans of the hive hooks are keyed by client, and by node or topic.
+    if name == 'hiveserver2':
+        return 'Hadoop:service=hiveserver2,name=hiveserver2'
+    keys = {'producer-node-metrics': ',node-id=node-1', 'producer-topic-metrics': ',topic=topic-1'}
+    return 'kafka.producer:type={0},client-id=producer-1{1}'.format(name, keys.get(name, ''))
+
+
+# ObjectName of the bean of each definition file of the roles without dumps.
+_DEFINITION_BEANS = {
+    'nodemanager': lambda name: 'Hadoop:service=NodeManager,name={0}'.format(name),
+    'hiveserver2': _hiveserver2_bean_name,
+}
+
+
+def _definition_beans(role, rng):
+    '''
+    @return one bean per definition file of the role, named by _DEFINITION_BEANS, with every attribute defined in it.
+    '''
+    beans = []
+    for path in sorted(glob.glob(os.path.join(ROOT, role, '*.json'))):
+        with open(path) as f:
+            definitions = json.load(f)
+        name = _DEFINITION_BEANS[role](os.path.splitext(os.path.basename(path))[0])
+        bean = {'name': name}
+        if name.startswith('Hadoop:'):
+            bean['tag.Hostname'] = '{0}.synthetic'.format(role)
+        for metric in definitions:
+            bean[metric] = rng.randint(0, 10 ** 6)
+        beans.append(bean)
+    return beans
+
+
+def object_name_matches(pattern, object_name):
+    '''
+    @return whether object_name matches the ObjectName pattern of a /jmx?qry=, e.g. "Hadoop:service=NameNode,name=Rpc*"
+            or "Hadoop:service=HBase,*".
+    '''
+    domain_pattern, _, keys_pattern = pattern.partition(':')
+    domain, _, keys = object_name.partition(':')
+    if not fnmatchcase(domain, domain_pattern):
+        return False
+    wanted = [k for k in keys_pattern.split(',') if k]
+    open_ended = '*' in wanted
+    wanted = dict(k.split('=', 1) for k in wanted if k != '*')
+    properties = dict(k.split('=', 1) for k in keys.split(',') if '=' in k)
+    if not open_ended and set(wanted) != set(properties):
+        return False
+    return all(key in properties and fnmatchcase(properties[key], value) for key, value in wanted.items())
+
+
+class StandInServer(object):
+    '''
+    Serves the jmx responses of synthetic targets, and the services api listing them, with injected latency and failures.
+    '''
+    def __init__(self, targets, cluster='synthetic', latency=0, jitter=0, failure_rate=0, hang_rate=0, hang_seconds=30, seed=0):
+        '''
+        @param targets: A list of (role, index, beans), served at /<role>/<index>/jmx.
+        @param latency: Seconds added to every jmx response.
+        @param jitter: Max random seconds added to latency.
+        @param failure_rate: Ratio of jmx requests answered with a 500.
+        @param hang_rate: Ratio of jmx requests held for hang_seconds before a 500, to hit the timeouts of the exporter.
+        '''
+        self._targets = dict(((role, str(index)), beans) for role, index, beans in targets)
+        self._cluster = cluster
+        self._latency = latency
+        self._jitter = jitter
+        self._failure_rate = failure_rate
+        self._hang_rate = hang_rate
+        self._hang_seconds = hang_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bodies = {}
+
+    def services(self, base_url):
+        '''
+        @return the services api response, each target on its own host "<role>-<index>".
+        '''
+        nodes = []
+        for role, index in sorted(self._targets):
+            host = '{0}-{1}'.format(role, index)
+            nodes.append({host: {ROLES[role][1]: {'jmx': '{0}/{1}/{2}/jmx'.format(base_url, role, index)}}})
+        return {self._cluster: nodes}
+
+    def body(self, role, index, qry=None):
+        key = (role, index, qry)
+        with self._lock:
+            if key not in self._bodies:
+                beans = self._targets[(role, index)]
+                if qry:
+                    beans = [bean for bean in beans if object_name_matches(qry, bean.get('name', ''))]
+                self._bodies[key] = json.dumps({'beans': beans})
+            return self._bodies[key]
+
+    def _delay(self):
+        with self._lock:
+            draw = self._rng.random()
+            delay = self._latency + self._rng.random() * self._jitter
+        if draw < self._failure_rate:
+            return delay, True
+        if draw < self._failure_rate + self._hang_rate:
+            return delay + self._hang_seconds, True
+        return delay, False
+
+    def app(self, environ, start_response):
+        path = environ['PATH_INFO'].strip('/').split('/')
+        if path == ['alert', 'getservicesbyhost']:
+            base_url = 'http://{0}'.format(environ['HTTP_HOST'])
+            if environ.get('HTTP_IF_NONE_MATCH') == '"synthetic"':
+                start_response('304 Not Modified', [('ETag', '"synthetic"')])
+                return ['']
+            start_response('200 OK', [('Content-Type', 'application/json'), ('ETag', '"synthetic"')])
+            return [json.dumps(self.services(base_url))]
+        if len(path) != 3 or path[2] != 'jmx' or (path[0], path[1]) not in self._targets:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['no such target\n']
+        delay, failed = self._delay()
+        time.sleep(delay)
+        if failed:
+            start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
+            return ['injected failure\n']
+        qry = parse_qs(environ.get('QUERY_STRING', '')).get('qry', [None])[0]
+        start_response('200 OK', [('Content-Type', 'application/json; charset=utf8')])
+        return [self.body(path[0], path[1], qry)]
+
+    def start(self, port, addr='127.0.0.1'):
+        '''
+        Start the http server as a daemon thread.
+        @return the server, its port being server.server_port.
+        '''
+        httpd = make_server(addr, port, self.app, ThreadingWSGIServer, handler_class=_SilentHandler)
+        t = threading.Thread(target=httpd.serve_forever, name="standin-server")
+        t.daemon = True
+        t.start()
+        return httpd
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_target(value):
+    role, _, count = value.partition(':')
+    if role not in ROLES:
+        raise argparse.ArgumentTypeError("unknown role '{0}', expect one of: {1}".format(role, ", ".join(sorted(ROLES))))
+    return role, int(count or 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description = 'Serve the jmx of synthetic hadoop daemons, scaled up from the dumps of test/, to load test the exporter.'
+    )
+    parser.add_argument(
+        '--target',
+        metavar='role[:count]',
+        required=False,
+        action='append',
+        type=parse_target,
+        help='Daemons to serve, roles being {0}, may be repeated. (default "resourcemanager")'.format(", ".join(sorted(ROLES))),
+        default=[]
+    )
+    parser.add_argument(
+        '--nodemanagers',
+        metavar='nodemanagers',
+        required=False,
+        type=int,
+        help='Number of NodeManagers in the LiveNodeManagers of a ResourceManager. (default "5000")',
+        default=5000
+    )
+    parser.add_argument(
+        '--datanodes',
+        metavar='datanodes',
+        required=False,
+        type=int,
+        help='Number of DataNodes in the LiveNodes and DeadNodes of a NameNode. (default "3000")',
+        default=3000
+    )
+    parser.add_argument(
+        '--regions',
+        metavar='regions',
+        required=False,
+        type=int,
+        help='Number of regions of a RegionServer. (default "10000")',
+        default=10000
+    )
+    parser.add_argument(
+        '--tables',
+        metavar='tables',
+        required=False,
+        type=int,
+        help='Number of tables of a RegionServer. (default "100")',
+        default=100
+    )
+    parser.add_argument(
+        '--users',
+        metavar='users',
+        required=False,
+        type=int,
+        help='Number of users of a RegionServer. (default "100")',
+        default=100
+    )
+    parser.add_argument(
+        '--rpc-methods',
+        metavar='methods',
+        required=False,
+        type=int,
+        help='Number of rpc methods added to the RpcDetailedActivity beans. (default "300")',
+        default=300
+    )
+    parser.add_argument(
+        '--latency',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Seconds added to every jmx response. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--jitter',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Max random seconds added to the latency. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--failure-rate',
+        metavar='ratio',
+        required=False,
+        type=float,
+        help='Ratio of jmx requests answered with a 500. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--hang-rate',
+        metavar='ratio',
+        required=False,
+        type=float,
+        help='Ratio of jmx requests held for --hang-seconds before a 500. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--hang-seconds',
+        metavar='seconds',
+        required=False,
+        type=float,
+        help='Seconds a hung jmx request is held. (default "30")',
+        default=30
+    )
+    parser.add_argument(
+        '--seed',
+        metavar='seed',
+        required=False,
+        type=int,
+        help='Seed of the metric values and of the injected latency and failures. (default "0")',
+        default=0
+    )
+    parser.add_argument(
+        '--dump',
+        required=False,
+        action='store_true',
+        help='Print the jmx response of the first target and exit, instead of serving it. (default "false")',
+        default=False
+    )
+    parser.add_argument(
+        '-c','--cluster',
+        metavar='cluster_name',
+        required=False,
+        help='Cluster of the targets in the services api. (default "synthetic")',
+        default='synthetic'
+    )
+    parser.add_argument(
+        '-host','-ip','--address','--addr',
+        metavar='ip_or_hostname',
+        required=False,
+        type=str,
+        help='Listen on this address. (default "127.0.0.1")',
+        default='127.0.0.1'
+    )
+    parser.add_argument(
+        '-P', '--port',
+        metavar='port',
+        required=False,
+        type=int,
+        help='Listen to this port. (default "18000")',
+        default=18000
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    targets = []
+    for role, count in args.target or [('resourcemanager', 1)]:
+        for i in range(count):
+            beans = generate(role, host='{0}-{1}'.format(role, i), nodemanagers=args.nodemanagers, datanodes=args.datanodes,
+                             regions=args.regions, tables=args.tables, users=args.users, rpc_methods=args.rpc_methods, seed=args.seed)
+            targets.append((role, i, beans))
+            if args.dump:
+                print(json.dumps({'beans': beans}, indent=2))
+                return
+    server = StandInServer(targets, cluster=args.cluster, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                           hang_rate=args.hang_rate, hang_seconds=args.hang_seconds, seed=args.seed)
+    server.start(args.port, args.address)
+    print("Serving {0} targets at http://{1}:{2}/alert/getservicesbyhost".format(len(targets), args.address, args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(" Interrupted")
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
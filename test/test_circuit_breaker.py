@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from cmd import utils
+from cmd.utils import CircuitBreaker
+
+URL = 'http://datanode.test:50075/jmx'
+
+
+class Clock(object):
+    '''
+    Stands in for the time module of utils, so that the backoffs pass without sleeping.
+    '''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        utils.time = self.clock
+        self.breaker = CircuitBreaker(failure_threshold=3, backoff=5, max_backoff=12, min_timeout=1, max_timeout=5)
+
+    def tearDown(self):
+        utils.time = time
+
+    def state(self):
+        return self.breaker.states()[URL][:2]
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure(URL)
+        self.breaker.failure(URL)
+        self.breaker.success(URL)
+        self.breaker.failure(URL)
+        self.breaker.failure(URL)
+        self.assertTrue(self.breaker.allow(URL))
+        self.breaker.failure(URL)
+        self.assertFalse(self.breaker.allow(URL))
+        self.assertFalse(self.breaker.allow(URL))
+        self.assertEqual((CircuitBreaker.OPEN, 2), self.state())
+
+    def test_probe_after_backoff(self):
+        for i in range(3):
+            self.breaker.failure(URL)
+        self.clock.now += 4.9
+        self.assertFalse(self.breaker.allow(URL))
+        self.clock.now += 0.1
+        self.assertTrue(self.breaker.allow(URL))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.state()[0])
+        # a single probe is let through while half open.
+        self.assertFalse(self.breaker.allow(URL))
+        self.breaker.success(URL)
+        self.assertEqual(CircuitBreaker.CLOSED, self.state()[0])
+        self.assertTrue(self.breaker.allow(URL))
+
+    def test_failed_probes_double_the_backoff(self):
+        for i in range(3):
+            self.breaker.failure(URL)
+        self.clock.now += 5
+        # 5s, then 10s, then max_backoff.
+        for backoff in (10, 12, 12):
+            self.assertTrue(self.breaker.allow(URL))
+            self.breaker.failure(URL)
+            self.clock.now += backoff - 0.1
+            self.assertFalse(self.breaker.allow(URL))
+            self.clock.now += 0.1
+
+    def test_timeout_follows_latency(self):
+        self.assertEqual(5, self.breaker.timeout(URL))
+        for i in range(9):
+            self.breaker.latency(URL, 0.5)
+        self.assertEqual(5, self.breaker.timeout(URL))
+        self.breaker.latency(URL, 0.5)
+        self.assertEqual(1.5, self.breaker.timeout(URL))
+        for i in range(10):
+            self.breaker.latency(URL, 0.1)
+        self.assertEqual(1.5, self.breaker.timeout(URL))
+        for i in range(50):
+            self.breaker.latency(URL, 0.1)
+        self.assertEqual(1, self.breaker.timeout(URL))
+        self.breaker.latency(URL, 10)
+        self.assertEqual(5, self.breaker.timeout(URL))
+
+    def test_timeout_per_kind(self):
+        for i in range(10):
+            self.breaker.latency(URL, 0.1, 'queries')
+        self.assertEqual(1, self.breaker.timeout(URL, 'queries'))
+        self.assertEqual(5, self.breaker.timeout(URL, 'whole'))
+        self.assertEqual({'queries': 1, 'whole': 5}, self.breaker.states()[URL][2])
+
+    def test_discard(self):
+        for i in range(3):
+            self.breaker.failure(URL)
+        self.breaker.discard(URL)
+        self.assertNotIn(URL, self.breaker.states())
+        self.assertTrue(self.breaker.allow(URL))
+
+
+if __name__ == '__main__':
+    unittest.main()
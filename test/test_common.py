@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from cmd import utils
+from cmd.common import FamilyCache
+from cmd.definitions import metric_definitions
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from synthetic import load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FamilyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FamilyCache(max_changes=3, recheck=5)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return {'metric': object()}
+
+    def families(self, beans, *context):
+        return self.cache.families('FSNamesystem', beans, self.build, *context)
+
+    def test_unchanged_beans_reuse_the_families(self):
+        first = self.families([{'name': 'a', 'Value': 1}], 'host1')
+        self.assertIs(first, self.families([{'name': 'a', 'Value': 1}], 'host1'))
+        self.assertIsNot(first, self.families([{'name': 'a', 'Value': 1}], 'host2'))
+        self.assertIsNot(first, self.families([{'name': 'a', 'Value': 2}], 'host2'))
+        self.assertEqual({'FSNamesystem': (1, 3)}, self.cache.counts())
+
+    def test_definitions_reload_rebuilds(self):
+        beans = [{'name': 'a', 'Value': 1}]
+        first = self.families(beans)
+        metric_definitions.generation += 1
+        self.assertIsNot(first, self.families(beans))
+
+    def test_changing_beans_are_not_kept(self):
+        for i in range(4):
+            self.families([{'name': 'a', 'Value': i}])
+        self.assertNotIn('FSNamesystem', self.cache._entries)
+        # unchanged beans are not even compared for the next recheck scrapes.
+        for i in range(5):
+            self.families([{'name': 'a', 'Value': 3}])
+        self.assertEqual(9, self.builds)
+        self.assertNotIn('FSNamesystem', self.cache._entries)
+        self.families([{'name': 'a', 'Value': 3}])
+        self.families([{'name': 'a', 'Value': 3}])
+        self.assertEqual(10, self.builds)
+        self.assertEqual({'FSNamesystem': (1, 10)}, self.cache.counts())
+
+
+class CollectorFamilyCacheTest(unittest.TestCase):
+
+    def test_namenode_dump(self):
+        collector = NameNodeMetricCollector('test', 'http://namenode.test:50070/jmx')
+        beans = [bean for bean in load_beans(os.path.join(ROOT, 'test', 'namenode')) if collector._accept(bean['name'])]
+        with utils.prefetched(collector._url, beans):
+            first = list(collector.collect())
+            second = list(collector.collect())
+        self.assertEqual([family.name for family in first], [family.name for family in second])
+        self.assertEqual([id(family) for family in first], [id(family) for family in second])
+        hits, misses = collector._family_cache.counts()['FSNamesystem']
+        self.assertEqual((1, 1), (hits, misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
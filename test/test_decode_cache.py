@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from cmd.utils import DecodeCache
+
+
+class DecodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoded = []
+        self.cache = DecodeCache()
+
+    def decode(self, text):
+        self.decoded.append(text)
+        return json.loads(text)
+
+    def test_unchanged_attribute_is_decoded_once(self):
+        first = self.cache.get('http://rm:8088/jmx', 'LiveNodeManagers', '[{"HostName": "nm1"}]', self.decode)
+        second = self.cache.get('http://rm:8088/jmx', 'LiveNodeManagers', '[{"HostName": "nm1"}]', self.decode)
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self.decoded))
+
+    def test_only_the_last_value_of_an_attribute_is_kept(self):
+        for i in range(100):
+            text = '[{{"HostName": "nm1", "LastHealthUpdate": {0}}}]'.format(i)
+            value = self.cache.get('http://rm:8088/jmx', 'LiveNodeManagers', text, self.decode)
+            self.assertEqual(i, value[0]['LastHealthUpdate'])
+        self.cache.get('http://rm2:8088/jmx', 'LiveNodeManagers', '[]', self.decode)
+        self.assertEqual(101, len(self.decoded))
+        self.assertEqual(2, len(self.cache._entries))
+
+    def test_discard(self):
+        self.cache.get('http://nn:50070/jmx', 'LiveNodes', '{}', self.decode)
+        self.cache.get('http://nn:50070/jmx', 'DeadNodes', '{}', self.decode)
+        self.cache.get('http://nn2:50070/jmx', 'LiveNodes', '{}', self.decode)
+        self.cache.discard('http://nn:50070/jmx')
+        self.assertEqual([('http://nn2:50070/jmx', 'LiveNodes')], list(self.cache._entries))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from cmd.definitions import MetricDefinitions
+
+
+class MetricDefinitionsTest(unittest.TestCase):
+
+    def test_files_are_loaded_once(self):
+        definitions = MetricDefinitions()
+        metrics = definitions.get("namenode")
+        self.assertIn("FSNamesystem", definitions.files("namenode"))
+        self.assertIs(metrics, definitions.get("namenode"))
+        self.assertEqual(1, definitions.generation)
+
+    def test_request_reload_does_not_take_the_lock(self):
+        definitions = MetricDefinitions()
+        metrics = definitions.get("namenode")
+        # as a SIGHUP handler interrupting a thread loading definitions would.
+        with definitions._lock:
+            definitions.request_reload()
+        self.assertEqual(1, definitions.generation)
+        definitions.maybe_reload()
+        self.assertEqual(2, definitions.generation)
+        self.assertIsNot(metrics, definitions.get("namenode"))
+        self.assertEqual(metrics, definitions.get("namenode"))
+        definitions.maybe_reload()
+        self.assertEqual(2, definitions.generation)
+
+
+if __name__ == '__main__':
+    unittest.main()
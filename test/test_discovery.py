@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+from collections import Counter
+
+from cmd import utils
+from cmd.scrape import ScrapeEngine
+from cmd.discovery import HashRing, ServiceDiscovery
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from cmd.hdfs_datanode import DataNodeMetricCollector
+
+
+def services(*targets):
+    '''
+    @param targets: (host, service, jmx url) of the services api response.
+    '''
+    nodes = []
+    for host, service, url in targets:
+        nodes.append({host: {service: {'jmx': url}}})
+    return {'cluster1': nodes}
+
+
+class BrokenCollector(object):
+    def __init__(self, cluster, url):
+        raise ValueError("broken")
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_single_shard(self):
+        self.assertEqual(0, HashRing(1).shard_of('http://namenode:50070/jmx'))
+
+    def test_spread_and_stability(self):
+        urls = ['http://datanode-{0}:50075/jmx'.format(i) for i in range(3000)]
+        three, four = HashRing(3), HashRing(4)
+        shards = Counter(three.shard_of(url) for url in urls)
+        self.assertEqual([0, 1, 2], sorted(shards))
+        self.assertTrue(min(shards.values()) > 600, shards)
+        moved = sum(1 for url in urls if three.shard_of(url) != four.shard_of(url))
+        # about 1/4 of the targets move to the new shard, none between the old ones.
+        self.assertTrue(moved < 1200, moved)
+        self.assertFalse([url for url in urls if three.shard_of(url) != four.shard_of(url) and four.shard_of(url) != 3])
+
+
+class ServiceDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ScrapeEngine(workers=1)
+        self.discovery = ServiceDiscovery('http://ambari:9035/alert/getservicesbyhost', self.engine,
+                                          [('NAMENODE', NameNodeMetricCollector), ('DATANODE', DataNodeMetricCollector),
+                                           ('BROKEN', BrokenCollector)],
+                                          interval=10, max_interval=40, central=True)
+        self.responses = []
+        self.discovery._fetch = lambda: self.responses.pop(0)
+
+    def poll(self, result, etag='"1"'):
+        self.responses.append((result, etag))
+        return self.discovery.poll()
+
+    def test_register_with_the_url_of_the_collector(self):
+        self.assertTrue(self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx/'),
+                                           ('dn1', 'DATANODE', 'http://dn1:50075/jmx'))))
+        targets = self.engine.targets()
+        self.assertEqual(['http://dn1:50075/jmx', 'http://nn1:50070/jmx'], sorted(targets))
+        for key, collector in targets.items():
+            self.assertEqual(key, collector._url)
+
+    def test_removed_and_moved_services(self):
+        self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx/'), ('dn1', 'DATANODE', 'http://dn1:50075/jmx')))
+        utils.breakers.failure('http://dn1:50075/jmx')
+        utils.breakers.failure('http://nn1:50070/jmx')
+        self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50071/jmx')), '"2"')
+        self.assertEqual(['http://nn1:50071/jmx'], list(self.engine.targets()))
+        states = utils.breakers.states()
+        self.assertNotIn('http://dn1:50075/jmx', states)
+        self.assertNotIn('http://nn1:50070/jmx', states)
+
+    def test_unchanged_services(self):
+        self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx')))
+        collector = self.engine.targets()['http://nn1:50070/jmx']
+        self.assertTrue(self.poll(None, None))
+        self.assertTrue(self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx'))))
+        self.assertIs(collector, self.engine.targets()['http://nn1:50070/jmx'])
+        self.assertEqual('"1"', self.discovery._etag)
+
+    def test_failed_apply_is_retried(self):
+        self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx')))
+        broken = services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx'), ('x1', 'BROKEN', 'http://x1:1/jmx'))
+        self.assertFalse(self.poll(broken, '"2"'))
+        self.assertEqual('"1"', self.discovery._etag)
+        self.assertEqual(20, self.discovery._delay)
+        self.assertFalse(self.poll(broken, '"2"'))
+        self.assertEqual(40, self.discovery._delay)
+        self.assertTrue(self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx')), '"3"'))
+        self.assertEqual('"3"', self.discovery._etag)
+        self.assertEqual(10, self.discovery._delay)
+
+    def test_failed_fetch_keeps_the_targets(self):
+        self.poll(services(('nn1', 'NAMENODE', 'http://nn1:50070/jmx')))
+
+        def fail():
+            raise IOError("connection refused")
+
+        self.discovery._fetch = fail
+        self.assertFalse(self.discovery.poll())
+        self.assertEqual(['http://nn1:50070/jmx'], list(self.engine.targets()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from cmd import utils
+from cmd.common import CardinalityLimit
+from cmd.hbase_regionserver import HBaseRegionServerMetricCollector
+from synthetic import generate
+
+URL = 'http://regionserver.synthetic:16030/jmx'
+
+
+def samples(regions):
+    return [(key, 'r{0}'.format(i), value) for i in range(regions)
+            for key, value in [('region_metric_totalRequestCount', i), ('region_metric_storeFileSize', 10),
+                               ('region_metric_maxStoreFileAge', i)]]
+
+
+class CardinalityLimitTest(unittest.TestCase):
+
+    def test_all(self):
+        self.assertEqual((samples(5), 0), CardinalityLimit('all').apply(samples(5)))
+
+    def test_topk_by_metric(self):
+        kept, folded = CardinalityLimit('topk:2:totalRequestCount').apply(samples(5))
+        self.assertEqual(set(['r4', 'r3', 'other']), set(label for key, label, value in kept))
+        self.assertEqual(6, folded)
+        other = dict((key, value) for key, label, value in kept if label == 'other')
+        self.assertEqual({'region_metric_totalRequestCount': 0 + 1 + 2, 'region_metric_storeFileSize': 30,
+                          'region_metric_maxStoreFileAge': 2}, other)
+
+    def test_hash(self):
+        kept, folded = CardinalityLimit('hash:4').apply(samples(50))
+        labels = set(label for key, label, value in kept)
+        self.assertTrue(labels <= set('bucket_{0}'.format(i) for i in range(4)))
+        self.assertEqual(150 - len(kept), folded)
+        self.assertEqual(sum(range(50)), sum(value for key, label, value in kept if key == 'region_metric_totalRequestCount'))
+        self.assertEqual(kept, CardinalityLimit('hash:4').apply(samples(50))[0])
+
+    def test_other(self):
+        kept, folded = CardinalityLimit('other').apply(samples(5))
+        self.assertEqual([('region_metric_totalRequestCount', 'other', 10), ('region_metric_storeFileSize', 'other', 50),
+                          ('region_metric_maxStoreFileAge', 'other', 4)], kept)
+        self.assertEqual(12, folded)
+
+    def test_invalid(self):
+        for spec in ('top', 'topk', 'topk:0', 'topk:x', 'hash:2:m', 'other:1'):
+            self.assertRaises(ValueError, CardinalityLimit, spec)
+
+
+class SeriesLimitsTest(unittest.TestCase):
+
+    def test_defaults(self):
+        argv, sys.argv = sys.argv, ['hadoop_exporter.py', '-s', 'http://127.0.0.1:1/alert/getservicesbyhost']
+        try:
+            args = utils.parse_args()
+        finally:
+            sys.argv = argv
+        self.assertEqual(['topk:100:totalRequestCount', 'topk:100', 'topk:100'],
+                         [repr(args.region_series), repr(args.table_series), repr(args.user_series)])
+
+
+class RegionServerTest(unittest.TestCase):
+
+    def tearDown(self):
+        utils.discard_target(URL)
+
+    def collect(self, beans):
+        collector = HBaseRegionServerMetricCollector('test', URL)
+        with utils.prefetched(URL, beans):
+            return dict((family.name, family) for family in collector.collect())
+
+    def test_no_beans(self):
+        self.assertNotIn('hadoop_hbase_regionserver_folded_series', self.collect([]))
+
+    def test_folded_series(self):
+        families = self.collect(generate('regionserver', regions=150, tables=3, users=3))
+        folded = dict((sample.labels['label'], sample) for sample in families['hadoop_hbase_regionserver_folded_series'].samples)
+        self.assertEqual('regionserver.synthetic', folded['region'].labels['host'])
+        self.assertTrue(folded['region'].value > 0)
+        self.assertEqual(0, folded['table'].value)
+        self.assertEqual(0, folded['user'].value)
+        regions = set(sample.labels['region'] for family in families.values() for sample in family.samples
+                      if 'region' in sample.labels)
+        self.assertEqual(101, len(regions))
+        self.assertIn('other', regions)
+
+
+if __name__ == '__main__':
+    unittest.main()
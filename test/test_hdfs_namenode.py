@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from cmd import utils
+from cmd import hdfs_namenode
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from cmd.hdfs_datanode import DataNodeMetricCollector
+from synthetic import load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATANODE = 'indata-10-110-13-163.indata.com'
+
+
+def collect(collector, *paths):
+    beans = []
+    for path in paths:
+        beans.extend(load_beans(os.path.join(ROOT, 'test', path)))
+    beans = [bean for bean in beans if collector._accept(bean['name'])]
+    with utils.prefetched(collector._url, beans):
+        return dict((family.name, family) for family in collector.collect())
+
+
+def samples(family, label):
+    return dict((sample.labels[label], sample.value) for sample in family.samples)
+
+
+class NameNodeDataNodesTest(unittest.TestCase):
+
+    def tearDown(self):
+        hdfs_namenode.datanode_metrics = False
+
+    def collect(self):
+        collector = NameNodeMetricCollector('test', 'http://namenode.test:50070/jmx')
+        try:
+            return collect(collector, 'namenode', 'namenodeinfo/NameNodeInfoTest.json')
+        finally:
+            utils.discard_target(collector._url)
+
+    def test_disabled_by_default(self):
+        families = self.collect()
+        self.assertIn('hadoop_hdfs_namenode_fsname_system_files_total', families)
+        self.assertFalse([name for name in families if '_datanode_' in name])
+
+    def test_live_and_dead_datanodes(self):
+        hdfs_namenode.datanode_metrics = True
+        families = self.collect()
+        live = samples(families['hadoop_hdfs_namenode_datanode_live'], 'datanode')
+        self.assertEqual({'indata-10-110-13-163.indata.com:1019': 1.0, 'indata-10-110-13-164.indata.com:1019': 1.0,
+                          'indata-10-110-13-165.indata.com:1019': 1.0, 'indata-10-110-13-166.indata.com:1019': 0.0}, live)
+        admin_state = samples(families['hadoop_hdfs_namenode_datanode_admin_state'], 'datanode')
+        self.assertEqual(1.0, admin_state['indata-10-110-13-165.indata.com:1019'])
+        self.assertEqual(0.0, admin_state['indata-10-110-13-166.indata.com:1019'])
+        last_contact = samples(families['hadoop_hdfs_namenode_datanode_last_contact'], 'datanode')
+        self.assertEqual(7214, last_contact['indata-10-110-13-166.indata.com:1019'])
+        # a dead DataNode only reports its last contact.
+        capacity = samples(families['hadoop_hdfs_namenode_datanode_capacity'], 'datanode')
+        self.assertEqual(3, len(capacity))
+
+    def test_namenode_label(self):
+        hdfs_namenode.datanode_metrics = True
+        families = self.collect()
+        # the standby NameNode reports the same DataNodes, tell the series apart.
+        self.assertEqual(set(['namenode.test:50070']), set(samples(families['hadoop_hdfs_namenode_datanode_live'], 'namenode')))
+
+    def test_same_values_as_the_datanode(self):
+        hdfs_namenode.datanode_metrics = True
+        derived = self.collect()
+        collector = DataNodeMetricCollector('test', 'http://{0}:1022/jmx'.format(DATANODE))
+        try:
+            datanode = collect(collector, 'datanode/datanode.json')
+        finally:
+            utils.discard_target(collector._url)
+        for namenode_metric, datanode_metric in (('capacity', 'capacity'), ('used_space', 'dfs_used'),
+                                                 ('remaining', 'remaining'), ('volfails', 'failed_volumes')):
+            values = samples(derived['hadoop_hdfs_namenode_datanode_' + namenode_metric], 'datanode')
+            expected = samples(datanode['hadoop_hdfs_datanode_' + datanode_metric], 'host')[DATANODE]
+            self.assertEqual(expected, values[DATANODE + ':1019'], namenode_metric)
+
+
+class SkipServicesTest(unittest.TestCase):
+
+    def test_skip_datanodes(self):
+        import hadoop_exporter
+        names = [name for name, cls in hadoop_exporter.service_collectors('datanode, ')]
+        self.assertNotIn('DATANODE', names)
+        self.assertIn('NAMENODE', names)
+        self.assertEqual(len(hadoop_exporter.SERVICE_COLLECTORS) - 1, len(names))
+
+    def test_skip_nothing(self):
+        import hadoop_exporter
+        self.assertEqual(hadoop_exporter.SERVICE_COLLECTORS, hadoop_exporter.service_collectors(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
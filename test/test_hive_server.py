@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from cmd.scrape import ScrapeEngine
+from cmd.hive_server import HiveServerReadiness, HiveServerMetricCollector
+
+READY = [{'name': 'metrics:name=hiveserver2', 'init_total_count_tables': 12}]
+WARMING_UP = [{'name': 'metrics:name=hiveserver2'}]
+
+
+class HiveServerReadinessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fetches = 0
+        self.readiness = HiveServerReadiness('http://hiveserver2:10002/jmx', self.fetch, poll_interval=0.01,
+                                             max_poll_interval=0.01, max_wait=60)
+
+    def tearDown(self):
+        self.readiness.stop()
+
+    def fetch(self):
+        self.fetches += 1
+        return WARMING_UP
+
+    def wait_watcher(self, timeout=2):
+        watcher = self.readiness._watcher
+        if watcher is not None:
+            watcher.join(timeout)
+            self.assertFalse(watcher.is_alive())
+
+    def test_warming_up_exports_the_last_ready_beans_with_their_age(self):
+        self.assertEqual((READY, 0.0), self.readiness.update(READY))
+        self.assertTrue(self.readiness.ready())
+        self.readiness._last_ready = (READY, time.time() - 100)
+        beans, age = self.readiness.update(WARMING_UP)
+        self.assertIs(READY, beans)
+        self.assertTrue(100 <= age < 110, age)
+        self.assertFalse(self.readiness.ready())
+        self.readiness._last_ready = (READY, time.time() - 400)
+        self.assertEqual((WARMING_UP, 0.0), self.readiness.update(WARMING_UP))
+
+    def test_stop_ends_the_watcher(self):
+        self.readiness.update(WARMING_UP)
+        self.assertIsNotNone(self.readiness._watcher)
+        time.sleep(0.05)
+        self.readiness.stop()
+        self.wait_watcher()
+        fetches = self.fetches
+        self.assertTrue(fetches > 0)
+        time.sleep(0.05)
+        self.assertEqual(fetches, self.fetches)
+        # no new watcher once stopped.
+        self.readiness.update(WARMING_UP)
+        self.assertIsNone(self.readiness._watcher)
+
+    def test_unregister_stops_the_watcher(self):
+        engine = ScrapeEngine(workers=1)
+        collector = HiveServerMetricCollector('test', 'http://hiveserver2:10002/jmx')
+        collector._readiness = self.readiness
+        engine.register(collector)
+        self.readiness.update(WARMING_UP)
+        engine.unregister(collector._url)
+        self.wait_watcher()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import unittest
+
+from cmd.utils import iter_beans, BeanCounter
+from synthetic import load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class IterBeansTest(unittest.TestCase):
+
+    def setUp(self):
+        self.beans = load_beans(os.path.join(ROOT, 'test', 'namenode'))
+        self.document = json.dumps({'beans': self.beans}, indent=2)
+
+    def test_any_chunk_size(self):
+        for size in (1, 7, 64, 4096, len(self.document)):
+            self.assertEqual(self.beans, list(iter_beans(chunked(self.document, size))), size)
+
+    def test_compact_document(self):
+        self.assertEqual(self.beans, list(iter_beans(chunked(json.dumps({'beans': self.beans}), 100))))
+
+    def test_accept(self):
+        accept = lambda name: name.startswith('Hadoop:service=NameNode,name=FSNamesystem')
+        expected = [bean for bean in self.beans if accept(bean['name'])]
+        self.assertTrue(expected)
+        self.assertEqual(expected, list(iter_beans(chunked(self.document, 13), accept)))
+
+    def test_strings_with_braces_and_quotes(self):
+        beans = [{'name': 'a', 'Value': 'x { "y" } \\ z [ ] }}'}, {'name': 'b\\"c', 'Nested': {'k': ['{', '}']}}]
+        document = json.dumps({'beans': beans})
+        for size in (1, 2, 3, 5):
+            self.assertEqual(beans, list(iter_beans(chunked(document, size))), size)
+        self.assertEqual(beans[1:], list(iter_beans([document], lambda name: name == 'b\\"c')))
+
+    def test_large_bean(self):
+        beans = [{'name': 'large', 'Value': 'x' * (1 << 20)}] + [{'name': 'b{0}'.format(i), 'Value': i} for i in range(1000)]
+        document = json.dumps({'beans': beans})
+        self.assertEqual(beans, list(iter_beans(chunked(document, 4096))))
+        counter = BeanCounter(lambda name: name != 'b1')
+        self.assertEqual(beans[:2] + beans[3:], list(iter_beans(chunked(document, 4096), counter)))
+        self.assertEqual((1001, 1000), (counter.received, counter.matched))
+
+    def test_name_not_first(self):
+        beans = [{'Value': 1, 'name': 'a'}, {'Value': 2, 'name': 'b'}]
+        document = json.dumps({'beans': beans})
+        counter = BeanCounter(lambda name: name == 'b')
+        self.assertEqual(beans[1:], list(iter_beans(chunked(document, 3), counter)))
+        self.assertEqual((2, 1), (counter.received, counter.matched))
+
+    def test_empty(self):
+        self.assertEqual([], list(iter_beans(['{"beans": []}'])))
+        self.assertEqual([], list(iter_beans(['{"beans"', ': [', ' ]}'])))
+
+    def test_invalid_documents(self):
+        for document in ('', '{}', '{"beans": [1]}', self.document[:len(self.document) // 2]):
+            self.assertRaises(ValueError, list, iter_beans(chunked(document, 50)))
+
+
+if __name__ == '__main__':
+    unittest.main()
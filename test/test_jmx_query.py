@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+from urlparse import parse_qs
+
+from cmd import utils
+from cmd.utils import JmxQuery
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from synthetic import StandInServer, load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JmxQueryTest(unittest.TestCase):
+
+    def test_whole_jmx_first_then_the_faster_way(self):
+        query = JmxQuery(max_queries=4, recheck=5)
+        url = 'http://namenode.test:50070/jmx'
+        self.assertFalse(query.use(url, ['a*', 'b*']))
+        query.timed(url, 'whole', 1.0)
+        self.assertTrue(query.use(url, ['a*', 'b*']))
+        query.timed(url, 'queries', 2.0)
+        self.assertEqual([False, False, True, False, False], [query.use(url, ['a*', 'b*']) for i in range(5)])
+
+    def test_too_many_queries(self):
+        query = JmxQuery(max_queries=2)
+        url = 'http://namenode.test:50070/jmx'
+        query.use(url, ['a*'])
+        query.timed(url, 'whole', 1.0)
+        self.assertTrue(query.use(url, ['a*', 'b*']))
+        self.assertFalse(query.use(url, ['a*', 'b*', 'c*']))
+        self.assertFalse(query.use(url, []))
+        query.configure(0)
+        self.assertFalse(query.enabled())
+        self.assertFalse(query.use(url, ['a*']))
+
+
+class GetMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        server = StandInServer([('namenode', 0, load_beans(os.path.join(ROOT, 'test', 'namenode')))])
+        serve = server.app
+
+        def app(environ, start_response):
+            self.requests.append(parse_qs(environ.get('QUERY_STRING', '')).get('qry', [None])[0])
+            return serve(environ, start_response)
+
+        server.app = app
+        self.httpd = server.start(0)
+        self.url = 'http://127.0.0.1:{0}/namenode/0/jmx'.format(self.httpd.server_port)
+        self.collector = NameNodeMetricCollector('test', self.url)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        utils.discard_target(self.url)
+
+    def fetch(self):
+        beans = utils.get_metrics(self.url, self.collector._queries(), self.collector._accept)
+        return sorted(bean['name'] for bean in beans)
+
+    def test_queries_fetch_the_beans_of_the_whole_jmx(self):
+        whole = self.fetch()
+        self.assertEqual([None], self.requests)
+        del self.requests[:]
+        self.assertEqual(whole, self.fetch())
+        self.assertEqual(self.collector._queries(), self.requests)
+        self.assertIn('Hadoop:service=NameNode,name=FSNamesystem', whole)
+
+    def test_disabled(self):
+        utils.jmx_query.configure(0)
+        try:
+            self.fetch()
+            self.fetch()
+        finally:
+            utils.jmx_query.configure(16)
+        self.assertEqual([None, None], self.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+from prometheus_client.core import GaugeMetricFamily
+
+from cmd import utils
+from cmd.probe import Prober, make_probe_app
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from synthetic import StandInServer, load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeCollector(object):
+    instances = []
+
+    def __init__(self, cluster, url):
+        self._url = url
+        self.cluster = cluster
+        self.closed = False
+        FakeCollector.instances.append(self)
+
+    def collect(self):
+        family = GaugeMetricFamily('test_up', 'Whether the target answered.', labels=['cluster'])
+        family.add_metric([self.cluster], 1)
+        yield family
+
+    def close(self):
+        self.closed = True
+
+
+class ProberTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeCollector.instances = []
+        self.prober = Prober({'fake': FakeCollector}, 'default', max_collectors=2)
+
+    def tearDown(self):
+        for url in ('http://a:1/jmx', 'http://b:1/jmx', 'http://c:1/jmx'):
+            utils.discard_target(url)
+
+    def test_target_url(self):
+        self.assertEqual('http://a:1/jmx', Prober.target_url('a:1'))
+        self.assertEqual('http://a:1/jmx', Prober.target_url('http://a:1/'))
+        self.assertEqual('https://a:1/jmx?qry=x', Prober.target_url('https://a:1/jmx?qry=x'))
+
+    def test_collectors_reused(self):
+        self.prober.probe('a:1', 'fake')
+        self.prober.probe('http://a:1/jmx', 'fake')
+        self.assertEqual(1, len(FakeCollector.instances))
+        self.prober.probe('a:1', 'fake', 'other')
+        self.assertEqual(['default', 'other'], [collector.cluster for collector in FakeCollector.instances])
+
+    def test_least_recently_probed_evicted(self):
+        self.prober.probe('a:1', 'fake')
+        self.prober.probe('b:1', 'fake')
+        self.prober.probe('a:1', 'fake')
+        utils.breakers.failure('http://b:1/jmx')
+        self.prober.probe('c:1', 'fake')
+        a, b, c = FakeCollector.instances
+        self.assertEqual([False, True, False], [a.closed, b.closed, c.closed])
+        self.assertEqual(set(['http://a:1/jmx', 'http://c:1/jmx']), self.prober.targets())
+        self.assertNotIn('http://b:1/jmx', utils.breakers.states())
+
+    def test_shared_url_kept(self):
+        self.prober.probe('a:1', 'fake', 'one')
+        self.prober.probe('a:1', 'fake', 'two')
+        utils.breakers.failure('http://a:1/jmx')
+        self.prober.probe('a:1', 'fake', 'three')
+        self.assertTrue(FakeCollector.instances[0].closed)
+        self.assertIn('http://a:1/jmx', utils.breakers.states())
+
+    def test_bad_request(self):
+        app = make_probe_app(self.prober)
+        statuses = []
+        for query in ('target=a:1', 'module=fake', 'target=a:1&module=other'):
+            app({'PATH_INFO': '/probe', 'QUERY_STRING': query}, lambda status, headers: statuses.append(status))
+        self.assertEqual(['400 Bad Request'] * 3, statuses)
+        self.assertEqual([], FakeCollector.instances)
+
+
+class NameNodeProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        beans = load_beans(os.path.join(ROOT, 'test', 'namenode'))
+        self.httpd = StandInServer([('namenode', 0, beans)]).start(0)
+        self.target = '127.0.0.1:{0}/namenode/0/jmx'.format(self.httpd.server_port)
+        self.prober = Prober({'namenode': NameNodeMetricCollector}, 'test')
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        utils.discard_target(Prober.target_url(self.target))
+
+    def test_probe(self):
+        app = make_probe_app(self.prober)
+        statuses = []
+        body = app({'PATH_INFO': '/probe', 'QUERY_STRING': 'target={0}&module=namenode'.format(self.target)},
+                   lambda status, headers: statuses.append(status))[0]
+        self.assertEqual(['200 OK'], statuses)
+        self.assertIn('hadoop_exporter_probe_success 1.0', body)
+        self.assertIn('hadoop_hdfs_namenode_fsname_system_files_total{', body)
+
+    def test_up_then_down(self):
+        families = dict((family.name, family) for family in self.prober.probe(self.target, 'namenode'))
+        self.assertIn('hadoop_hdfs_namenode_fsname_system_files_total', families)
+        self.assertEqual(1.0, families['hadoop_exporter_probe_success'].samples[0].value)
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        # the collector still holds the families of the first probe.
+        for attempt in range(2):
+            families = dict((family.name, family) for family in self.prober.probe(self.target, 'namenode'))
+            self.assertEqual(set(['hadoop_exporter_probe_success', 'hadoop_exporter_probe_duration_seconds']), set(families))
+            self.assertEqual(0.0, families['hadoop_exporter_probe_success'].samples[0].value)
+
+
+if __name__ == '__main__':
+    unittest.main()
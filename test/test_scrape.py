@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import time
+import threading
+import unittest
+from StringIO import StringIO
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.exposition import generate_latest
+
+from cmd import utils
+from cmd.scrape import ScrapeEngine, FetchLimiter
+from cmd.exposition import ExpositionCache, make_metrics_app
+from cmd.hdfs_namenode import NameNodeMetricCollector
+from synthetic import StandInServer, load_beans
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FetchLimiterTest(unittest.TestCase):
+
+    def test_no_limit(self):
+        limiter = FetchLimiter()
+        for i in range(100):
+            self.assertTrue(limiter.acquire('host1', time.time()))
+
+    def test_max_inflight(self):
+        limiter = FetchLimiter(max_inflight=2)
+        self.assertTrue(limiter.acquire('host1', time.time() + 1))
+        self.assertTrue(limiter.acquire('host2', time.time() + 1))
+        self.assertFalse(limiter.acquire('host3', time.time() + 0.05))
+        limiter.release('host1')
+        self.assertTrue(limiter.acquire('host3', time.time()))
+
+    def test_max_per_host(self):
+        limiter = FetchLimiter(max_per_host=1)
+        self.assertTrue(limiter.acquire('host1', time.time() + 1))
+        self.assertFalse(limiter.acquire('host1', time.time() + 0.05))
+        self.assertTrue(limiter.acquire('host2', time.time()))
+        limiter.release('host1')
+        self.assertTrue(limiter.acquire('host1', time.time()))
+
+    def test_waits_for_a_release(self):
+        limiter = FetchLimiter(max_inflight=1)
+        limiter.acquire('host1', time.time())
+        timer = threading.Timer(0.1, limiter.release, ['host1'])
+        timer.start()
+        start = time.time()
+        self.assertTrue(limiter.acquire('host2', time.time() + 5))
+        self.assertTrue(0.05 < time.time() - start < 5)
+        timer.join()
+
+    def test_bounds_concurrent_fetches(self):
+        limiter = FetchLimiter(max_inflight=3, max_per_host=2)
+        lock = threading.Lock()
+        inflight = {'all': 0, 'max': 0, 'max_per_host': 0, 'acquired': 0}
+        per_host = {}
+
+        def fetch(host):
+            if not limiter.acquire(host, time.time() + 10):
+                return
+            with lock:
+                inflight['acquired'] += 1
+                inflight['all'] += 1
+                inflight['max'] = max(inflight['max'], inflight['all'])
+                per_host[host] = per_host.get(host, 0) + 1
+                inflight['max_per_host'] = max(inflight['max_per_host'], per_host[host])
+            time.sleep(0.01)
+            with lock:
+                inflight['all'] -= 1
+                per_host[host] -= 1
+            limiter.release(host)
+
+        threads = [threading.Thread(target=fetch, args=('host{0}'.format(i % 2),)) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(20, inflight['acquired'])
+        self.assertLessEqual(inflight['max'], 3)
+        self.assertLessEqual(inflight['max_per_host'], 2)
+
+
+class HangingCollector(object):
+    '''
+    Collector of a target answering after seconds, or once released if seconds is None.
+    '''
+    def __init__(self, name, seconds, released):
+        self._url = 'http://{0}.test:1/jmx'.format(name)
+        self._name = name
+        self._seconds = seconds
+        self._released = released
+
+    def collect(self):
+        self._released.wait(self._seconds)
+        family = GaugeMetricFamily('test_{0}_up'.format(self._name), 'Whether the target answered.')
+        family.add_metric([], 1)
+        yield family
+
+    def close(self):
+        pass
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.released = threading.Event()
+
+    def tearDown(self):
+        self.released.set()
+
+    def scrape(self, engine):
+        start = time.time()
+        families = dict((family.name, family) for family in engine.collect())
+        timeouts = dict((sample.labels['target'], sample.value) for sample in families['hadoop_exporter_scrape_timeout'].samples)
+        return families, timeouts, time.time() - start
+
+    def register(self, engine, name, seconds):
+        collector = HangingCollector(name, seconds, self.released)
+        engine.register(collector)
+        return collector._url
+
+    def test_slow_target_left_out(self):
+        engine = ScrapeEngine(workers=2, target_timeout=0.3, scrape_budget=5)
+        fast = self.register(engine, 'fast', 0)
+        slow = self.register(engine, 'slow', None)
+        families, timeouts, elapsed = self.scrape(engine)
+        self.assertLess(elapsed, 2)
+        self.assertEqual({fast: 0.0, slow: 1.0}, timeouts)
+        self.assertIn('test_fast_up', families)
+        self.assertNotIn('test_slow_up', families)
+
+    def test_scrape_budget(self):
+        engine = ScrapeEngine(workers=4, target_timeout=5, scrape_budget=0.3)
+        urls = [self.register(engine, 'slow{0}'.format(i), None) for i in range(4)]
+        families, timeouts, elapsed = self.scrape(engine)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(dict((url, 1.0) for url in urls), timeouts)
+
+    def test_queued_target_not_started_past_its_deadline(self):
+        engine = ScrapeEngine(workers=1, target_timeout=0.3, scrape_budget=5)
+        self.register(engine, 'slow', 0.6)
+        queued = HangingCollector('queued', 0, self.released)
+        started = []
+        queued.collect = lambda: started.append(True) or []
+        engine.register(queued)
+        families, timeouts, elapsed = self.scrape(engine)
+        self.assertEqual(1.0, timeouts[queued._url])
+        # let the single worker reach the queued target.
+        time.sleep(0.5)
+        self.assertEqual([], started)
+
+    def test_registered_target_refreshed_at_once(self):
+        engine = ScrapeEngine(workers=2, refresh_interval=60)
+        engine.start()
+        time.sleep(0.2)
+        url = self.register(engine, 'fast', 0)
+        for i in range(50):
+            if engine.rendered_targets():
+                break
+            time.sleep(0.02)
+        families = dict((family.name, family) for family in engine.collect())
+        self.assertIn('test_fast_up', families)
+        engine.unregister(url)
+
+    def test_hung_target_not_scraped_twice(self):
+        engine = ScrapeEngine(workers=2, target_timeout=0.3, scrape_budget=5)
+        slow = self.register(engine, 'slow', None)
+        self.scrape(engine)
+        families, timeouts, elapsed = self.scrape(engine)
+        self.assertEqual(1.0, timeouts[slow])
+        self.assertLess(elapsed, 0.2)
+        self.released.set()
+        time.sleep(0.1)
+        families, timeouts, elapsed = self.scrape(engine)
+        self.assertEqual(0.0, timeouts[slow])
+        self.assertIn('test_slow_up', families)
+
+
+class StandInTestCase(unittest.TestCase):
+    '''
+    Serves the NameNode dump of test/ as targets namenode/0 .. namenode/<targets - 1> of a StandInServer.
+    '''
+    targets = 2
+    latency = 0
+
+    def setUp(self):
+        beans = load_beans(os.path.join(ROOT, 'test', 'namenode'))
+        self.server = StandInServer([('namenode', i, beans) for i in range(self.targets)], latency=self.latency)
+        self.httpd = self.server.start(0)
+        self.urls = ['http://127.0.0.1:{0}/namenode/{1}/jmx'.format(self.httpd.server_port, i) for i in range(self.targets)]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for url in self.urls:
+            utils.discard_target(url)
+
+
+def type_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith('# TYPE {0} '.format(name))]
+
+
+def sample_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name + '{')]
+
+
+def series(text):
+    # the name and labels of every sample of text.
+    return [line.rsplit(' ', 1)[0] for line in text.splitlines() if line and not line.startswith('#')]
+
+
+class MergeFamiliesTest(StandInTestCase):
+
+    def test_live_mode(self):
+        engine = ScrapeEngine(workers=2, target_label='target')
+        for url in self.urls:
+            engine.register(NameNodeMetricCollector('test', url))
+        registry = CollectorRegistry()
+        registry.register(engine)
+        text = generate_latest(registry)
+        self.assertEqual(1, len(type_lines(text, 'hadoop_hdfs_namenode_fsname_system_files_total')))
+        lines = sample_lines(text, 'hadoop_hdfs_namenode_fsname_system_files_total')
+        self.assertEqual(2, len(lines))
+        for url, line in zip(self.urls, lines):
+            self.assertIn('target="{0}"'.format(url), line)
+        self.assertEqual(len(series(text)), len(set(series(text))))
+
+    def test_no_target_label(self):
+        engine = ScrapeEngine(workers=2)
+        engine.register(NameNodeMetricCollector('test', self.urls[0]))
+        registry = CollectorRegistry()
+        registry.register(engine)
+        lines = sample_lines(generate_latest(registry), 'hadoop_hdfs_namenode_fsname_system_files_total')
+        self.assertEqual(['hadoop_hdfs_namenode_fsname_system_files_total{cluster="test"} 9071.0'], lines)
+
+    def test_background_mode(self):
+        engine = ScrapeEngine(workers=2, refresh_interval=60, target_label='target')
+        registry = CollectorRegistry()
+        registry.register(engine)
+        for url in self.urls:
+            collector = NameNodeMetricCollector('test', url)
+            engine.register(collector)
+            engine._refresh(url, collector, engine._locks[url], float('inf'))
+        cache = ExpositionCache(engine, registry)
+        etag, text = cache.get()
+        self.assertEqual(1, len(type_lines(text, 'hadoop_hdfs_namenode_fsname_system_files_total')))
+        self.assertEqual(2, len(sample_lines(text, 'hadoop_hdfs_namenode_fsname_system_files_total')))
+        self.assertEqual(len(series(text)), len(set(series(text))))
+        names = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE ')]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(sorted(names), sorted(line.split()[2] for line in generate_latest(registry).splitlines()
+                                               if line.startswith('# TYPE ')))
+
+
+
+class CountingCollector(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def collect(self):
+        self.calls += 1
+        return []
+
+
+class ExpositionCacheTest(StandInTestCase):
+    targets = 1
+
+    def setUp(self):
+        super(ExpositionCacheTest, self).setUp()
+        self.engine = ScrapeEngine(workers=1, refresh_interval=60)
+        self.registry = CollectorRegistry()
+        self.registry.register(self.engine)
+        self.counting = CountingCollector()
+        self.registry.register(self.counting)
+        self.collector = NameNodeMetricCollector('test', self.urls[0])
+        self.engine.register(self.collector)
+        self.refresh()
+        self.cache = ExpositionCache(self.engine, self.registry)
+
+    def refresh(self):
+        self.engine._refresh(self.urls[0], self.collector, self.engine._locks[self.urls[0]], float('inf'))
+
+    def test_other_collectors_rendered_per_request(self):
+        etag, text = self.cache.get()
+        self.assertEqual(1, self.counting.calls)
+        self.assertEqual(etag, self.cache.get()[0])
+        self.assertEqual(2, self.counting.calls)
+        self.assertIn('hadoop_exporter_snapshot_age_seconds', text)
+
+    def test_gzip(self):
+        etag, text = self.cache.get()
+        gzip_etag, body = self.cache.get(gzip=True)
+        self.assertNotEqual(etag, gzip_etag)
+        body = gzip.GzipFile(fileobj=StringIO(body)).read()
+        self.assertEqual([line for line in text.splitlines() if line.startswith('# ')],
+                         [line for line in body.splitlines() if line.startswith('# ')])
+        self.assertEqual(sample_lines(text, 'hadoop_hdfs_namenode_fsname_system_files_total'),
+                         sample_lines(body, 'hadoop_hdfs_namenode_fsname_system_files_total'))
+
+    def test_etag_changes_with_snapshots(self):
+        etag = self.cache.etag()
+        self.assertEqual(etag, self.cache.get()[0])
+        self.refresh()
+        self.assertNotEqual(etag, self.cache.etag())
+
+    def test_not_modified(self):
+        app = make_metrics_app(self.cache, self.registry)
+        statuses = []
+
+        def request(etag, encoding):
+            environ = {'HTTP_IF_NONE_MATCH': etag, 'HTTP_ACCEPT_ENCODING': encoding}
+            app(environ, lambda status, headers: statuses.append(status))
+            return statuses[-1]
+
+        etag = self.cache.etag(gzip=True)
+        self.assertEqual('304 Not Modified', request(etag, 'gzip'))
+        self.assertEqual(0, self.counting.calls)
+        self.assertEqual('200 OK', request(etag, 'identity'))
+
+
+if __name__ == '__main__':
+    unittest.main()